@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Compare the FFT backends of spectral.py (and their thread counts) on the spectrograms and envelope the bioacoustic
+features of one file need.
+Example:
+    python -m benchmarks.bench_fft --duration 300 --fs 48000 --threads 1,4
+"""
+
+import time
+import click
+import numpy as np
+from datavis import spectral
+
+
+def transforms(y, fs):
+    for win_len in (512, 1024, spectral.segmented_win_len(fs, 1000, 10000)):
+        spectral.spectrogram(y, fs, win_len=win_len, hop=win_len // 2)
+    spectral.envelope(y)
+
+
+@click.command()
+@click.option("--duration", "-d", type=click.FLOAT, default=300, show_default=True, help="Duration of a file in seconds.")
+@click.option("--fs", type=click.INT, default=48000, show_default=True, help="Sampling rate in Hz.")
+@click.option("--threads", type=click.STRING, default='1,4', show_default=True, help="Comma separated thread counts.")
+@click.option("--repeats", "-r", type=click.INT, default=3, show_default=True)
+def main(duration, fs, threads, repeats):
+    y = (0.1 * np.random.RandomState(0).randn(int(duration * fs))).astype('float32')
+    for name in spectral.FFT_BACKENDS:
+        measured = set()
+        for n in map(int, threads.split(',')):
+            try:
+                spectral.set_fft_backend(name, n)
+            except ImportError as ex:
+                print(f'{name:>6}: {ex}')
+                break
+            if spectral.get_fft_backend().threads in measured:
+                continue
+            measured.add(spectral.get_fft_backend().threads)
+            transforms(y, fs)
+            times = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                transforms(y, fs)
+                times.append(time.perf_counter() - start)
+            print(f'{name:>6} x{spectral.get_fft_backend().threads}: {np.median(times) * 1000:8.1f}ms')
+    spectral.set_fft_backend()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Compare the global formant estimation (one LPC of the whole signal) against the frame-based mode: time per file and
+the formant statistics of both on synthetic signals. The "one frame" mode runs the frame-based code on a single frame
+of the whole signal without decimation, which checks its agreement with the global mode on the same problem.
+Example:
+    python -m benchmarks.bench_formants --duration 60 --fs 48000 --band 8000
+"""
+
+import time
+import click
+import numpy as np
+from benchmarks.corpus import KINDS, synthesize
+from datavis.bioacoustics import get_formant_frequencies, FORMANT_COLUMNS
+
+
+def measure(y, fs, params, repeats):
+    config = {'use': True, 'params': params}
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        try:
+            formants = get_formant_frequencies(y=y, fs=fs, config=config)
+        except Exception as ex:
+            return None, repr(ex)
+        times.append(time.perf_counter() - start)
+    return float(np.median(times)), formants
+
+
+@click.command()
+@click.option("--duration", "-d", type=click.FLOAT, default=60, show_default=True, help="Duration of a file in seconds.")
+@click.option("--fs", type=click.INT, default=48000, show_default=True, help="Sampling rate in Hz.")
+@click.option("--band", type=click.FLOAT, default=5000, show_default=True,
+              help="Highest frequency of interest of the frame-based mode in Hz.")
+@click.option("--frame", type=click.FLOAT, default=0.03, show_default=True, help="Frame duration in seconds.")
+@click.option("--hop", type=click.FLOAT, default=0.03, show_default=True, help="Hop between frames in seconds.")
+@click.option("--repeats", "-r", type=click.INT, default=3, show_default=True)
+def main(duration, fs, band, frame, hop, repeats):
+    modes = [('global', {'order': None}),
+             ('one frame', {'order': None, 'mode': 'frames', 'band': None, 'frame': duration, 'hop': duration}),
+             ('frames', {'order': None, 'mode': 'frames', 'band': band, 'frame': frame, 'hop': hop})]
+    for kind in KINDS:
+        y = synthesize(kind, duration, fs)
+        results = [(name,) + measure(y, fs, params, repeats) for name, params in modes]
+        if results[0][1] is not None and results[-1][1] is not None:
+            print(f'{kind}: frames {results[0][1] / results[-1][1]:.1f}x faster')
+        else:
+            print(f'{kind}:')
+        for name, elapsed, formants in results:
+            if elapsed is None:
+                print(f'{name:>10}: failed with {formants}')
+                continue
+            stats = ', '.join(f'{column[len("formant_"):]}={formants[column]:.0f}' for column in FORMANT_COLUMNS)
+            print(f'{name:>10}: {elapsed * 1000:8.1f}ms  {stats}')
+
+
+if __name__ == '__main__':
+    main()
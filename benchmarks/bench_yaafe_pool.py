@@ -0,0 +1,45 @@
+#!/usr/bin/env python3
+"""
+Compare building a YAAFE engine for every file against reusing the pooled engine of the process.
+Example:
+    python -m benchmarks.bench_yaafe_pool --files 50 --duration 60 --fs 48000
+"""
+
+import time
+import click
+import yaml
+import numpy as np
+from datavis.yaafe_wrapper import YaafeWrapper, get_yaafe_wrapper, clear_yaafe_pool
+
+
+def per_file(signals, fs, config):
+    for y in signals:
+        YaafeWrapper(fs=fs, config=config).compute_feature_stats(y)
+
+
+def pooled(signals, fs, config):
+    clear_yaafe_pool()
+    for y in signals:
+        get_yaafe_wrapper(fs=fs, config=config).compute_feature_stats(y)
+
+
+@click.command()
+@click.option("--files", "-n", type=click.INT, default=20, show_default=True, help="Number of synthetic files.")
+@click.option("--duration", "-d", type=click.FLOAT, default=60, show_default=True, help="Duration of a file in seconds.")
+@click.option("--fs", type=click.INT, default=48000, show_default=True, help="Sampling rate in Hz.")
+@click.option("--config", "-c", type=click.Path(exists=True), default='datavis/config.yaml', show_default=True)
+def main(files, duration, fs, config):
+    with open(config, 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)['YAAFE_features']
+    rng = np.random.RandomState(0)
+    signals = [(0.1 * rng.randn(int(duration * fs))).astype('float32') for _ in range(files)]
+
+    for name, f in [('per-file', per_file), ('pooled', pooled)]:
+        start = time.perf_counter()
+        f(signals, fs, config)
+        elapsed = time.perf_counter() - start
+        print(f'{name:>10}: {elapsed:.3f}s total, {elapsed / files * 1000:.1f}ms per file')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,50 @@
+"""
+Synthetic WAV corpora for benchmarks: pure tones, white noise and bird-like chirps over background noise.
+"""
+
+import os
+import numpy as np
+import soundfile as sf
+from datetime import datetime, timedelta
+from scipy.signal import chirp
+
+KINDS = ['tone', 'noise', 'chirp']
+
+
+def synthesize(kind: str, duration: float, fs: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.RandomState(seed)
+    t = np.arange(int(duration * fs)) / fs
+    if kind == 'tone':
+        y = 0.3 * np.sin(2 * np.pi * 1000 * t) + 0.01 * rng.randn(len(t))
+    elif kind == 'noise':
+        y = 0.1 * rng.randn(len(t))
+    elif kind == 'chirp':
+        # 200 ms up-sweeps from 2 to 6 kHz about once per second with random onsets, over background noise
+        y = 0.02 * rng.randn(len(t))
+        call = chirp(np.arange(int(0.2 * fs)) / fs, f0=2000, t1=0.2, f1=min(6000, fs / 2 - 1)) * np.hanning(int(0.2 * fs))
+        for onset in np.arange(0, duration - 0.2, 1.0) + rng.uniform(0, 0.5, int(np.ceil(duration - 0.2))):
+            start = int(onset * fs)
+            end = min(start + len(call), len(y))
+            y[start: end] += 0.3 * call[: end - start]
+    else:
+        raise ValueError(f'Unknown kind of signal {kind}')
+    return y.astype('float32')
+
+
+def write_corpus(directory: str, n_files: int, duration: float, fs: int, kinds: list = None,
+                 start: datetime = datetime(2020, 1, 1)) -> list:
+    """
+    Write n_files WAV files cycling through kinds, named with consecutive timestamps as the recorders do
+    :return: list of paths
+    """
+    kinds = kinds or KINDS
+    os.makedirs(directory, exist_ok=True)
+    step = timedelta(seconds=max(60, int(np.ceil(duration))))
+    paths = []
+    for i in range(n_files):
+        kind = kinds[i % len(kinds)]
+        name = f'bench-{kind}-' + (start + i * step).strftime('%Y-%m-%dT%H-%M-%S') + '.wav'
+        path = os.path.join(directory, name)
+        sf.write(path, synthesize(kind, duration, fs, seed=i), fs, subtype='PCM_16')
+        paths.append(path)
+    return paths
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+"""
+Performance benchmarks of the extraction and visualisation pipeline on synthetic corpora.
+Examples:
+    python -m benchmarks.suite run --output before.json
+    python -m benchmarks.suite run --output after.json
+    python -m benchmarks.suite compare before.json after.json --threshold 0.1
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import tempfile
+import subprocess
+import click
+import yaml
+import numpy as np
+from click.testing import CliRunner
+from datavis import bioacoustics
+from datavis.audio_io import read_results
+from datavis.features import process_audio, wav_dir_to_features
+from datavis.yaafe_wrapper import YaafeWrapper
+from benchmarks.corpus import KINDS, synthesize, write_corpus
+
+BIOACOUSTIC_FUNCTIONS = [
+    ('Acoustic_Complexity_Index', bioacoustics.get_acoustic_complexity_index),
+    ('Acoustic_Diversity_Index', bioacoustics.get_acoustic_diversity_index),
+    ('Acoustic_Evenness_Index', bioacoustics.get_acoustic_evenness_index),
+    ('Bioacoustic_Index', bioacoustics.get_bioacoustic_index),
+    ('Spectral_entropy', bioacoustics.get_spectral_entropy),
+    ('Temporal_entropy', bioacoustics.get_temporal_entropy),
+    ('Acoustic_activity', bioacoustics.get_acoustic_activity),
+    ('Formants', bioacoustics.get_formant_frequencies),
+]
+
+
+def measure(f, repeats: int, setup=None) -> dict:
+    times = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - start)
+    return {'median': float(np.median(times)), 'min': float(np.min(times)), 'mean': float(np.mean(times)),
+            'repeats': repeats}
+
+
+def get_metadata() -> dict:
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'platform': platform.platform(), 'cpus': os.cpu_count()}
+
+
+def bench_functions(config: dict, durations: list, sample_rates: list, repeats: int) -> dict:
+    results = {}
+    yaafe_config = config['YAAFE_features']
+    for fs in sample_rates:
+        yaafe = YaafeWrapper(fs=fs, config=yaafe_config)
+        for duration in durations:
+            for kind in KINDS:
+                y = synthesize(kind, duration, fs)
+                suffix = f'{kind}.{fs}Hz.{duration}s'
+                for name, f in BIOACOUSTIC_FUNCTIONS:
+                    feature_config = config['Bioacoustic_features'][name]
+                    results[f'bioacoustics.{name}.{suffix}'] = measure(
+                        lambda: f(y=y, fs=fs, config=feature_config), repeats)
+                results[f'bioacoustics.get_bioacoustic_features.{suffix}'] = measure(
+                    lambda: bioacoustics.get_bioacoustic_features(y=y, fs=fs, config=config['Bioacoustic_features']),
+                    repeats)
+                results[f'yaafe.compute_feature_stats.{suffix}'] = measure(
+                    lambda: yaafe.compute_feature_stats(y), repeats)
+    return results
+
+
+def bench_pipeline(config_path: str, config: dict, workdir: str, n_files: int, duration: float, fs: int,
+                   n_jobs: list, repeats: int) -> dict:
+    results = {}
+    corpus = os.path.join(workdir, f'corpus_{fs}Hz_{duration}s')
+    paths = write_corpus(corpus, n_files=n_files, duration=duration, fs=fs)
+    suffix = f'{n_files}x{duration}s.{fs}Hz'
+
+    results[f'features.process_audio.{fs}Hz.{duration}s'] = measure(lambda: process_audio(paths[0], config), repeats)
+    for jobs in n_jobs:
+        results[f'features.wav_dir_to_features.j{jobs}.{suffix}'] = measure(
+            lambda: wav_dir_to_features(directory=corpus, config=config_path, n_jobs=jobs, resume=False), repeats)
+    results[f'audio_io.read_results.{suffix}'] = measure(lambda: read_results(corpus), repeats)
+
+    import viscli
+    output = os.path.join(workdir, 'heatmap.html')
+    runner = CliRunner()
+    results[f'viscli.f2i.{suffix}'] = measure(
+        lambda: runner.invoke(viscli.cli, ['--quiet', 'f2i', '--input', corpus, '--output', output, '--aggregation', '1'],
+                              catch_exceptions=False), repeats)
+    return results
+
+
+@click.group()
+def cli():
+    """
+    Benchmarks of the audio feature pipeline
+    """
+
+
+@cli.command('run', help='Run the benchmarks and write the results as JSON.')
+@click.option("--output", "-out", type=click.Path(dir_okay=False), required=True, help="Output JSON file.")
+@click.option("--config", "-c", type=click.Path(exists=True), default='datavis/config.yaml', show_default=True)
+@click.option("--durations", type=click.STRING, default='10,60', show_default=True,
+              help="Comma separated durations (in seconds) of the synthetic signals.")
+@click.option("--sample-rates", type=click.STRING, default='16000,48000', show_default=True,
+              help="Comma separated sampling rates (in Hz).")
+@click.option("--files", "-n", type=click.INT, default=12, show_default=True, help="Number of files of the corpus.")
+@click.option("--jobs", "-j", type=click.STRING, default='1,2,4', show_default=True,
+              help="Comma separated n_jobs values for wav_dir_to_features.")
+@click.option("--repeats", "-r", type=click.INT, default=3, show_default=True)
+@click.option("--workdir", type=click.Path(file_okay=False), default=None,
+              help="Directory for the synthetic corpora. Defaults to a temporary directory removed afterwards.")
+def run(output, config, durations, sample_rates, files, jobs, repeats, workdir):
+    config_path = config
+    with open(config, 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    durations = [float(d) for d in durations.split(',')]
+    sample_rates = [int(fs) for fs in sample_rates.split(',')]
+    n_jobs = [int(j) for j in jobs.split(',')]
+
+    cleanup = workdir is None
+    workdir = workdir or tempfile.mkdtemp(prefix='datavis_bench_')
+    try:
+        results = bench_functions(config, durations, sample_rates, repeats)
+        results.update(bench_pipeline(config_path, config, workdir, n_files=files, duration=durations[0],
+                                      fs=sample_rates[0], n_jobs=n_jobs, repeats=repeats))
+    finally:
+        if cleanup:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output, 'w') as fo:
+        json.dump({'meta': get_metadata(), 'results': results}, fo, indent=2, sort_keys=True)
+    print(f'{len(results)} benchmarks written to {output}')
+
+
+@cli.command('compare', help='Compare two benchmark runs and flag regressions.')
+@click.argument('baseline', type=click.Path(exists=True))
+@click.argument('candidate', type=click.Path(exists=True))
+@click.option("--threshold", "-t", type=click.FLOAT, default=0.1, show_default=True,
+              help="Relative slowdown of the median flagged as a regression.")
+def compare(baseline, candidate, threshold):
+    with open(baseline) as f:
+        baseline = json.load(f)['results']
+    with open(candidate) as f:
+        candidate = json.load(f)['results']
+
+    regressions = 0
+    print(f'{"benchmark":<70} {"baseline":>10} {"candidate":>10} {"change":>8}')
+    for name in sorted(set(baseline) & set(candidate)):
+        before, after = baseline[name]['median'], candidate[name]['median']
+        change = (after - before) / before if before > 0 else 0.0
+        flag = ''
+        if change > threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        print(f'{name:<70} {before:>10.4f} {after:>10.4f} {change:>+8.1%}{flag}')
+    for name in sorted(set(baseline) ^ set(candidate)):
+        print(f'{name:<70} only in {"baseline" if name in baseline else "candidate"}')
+
+    if regressions:
+        print(f'{regressions} regression(s) above {threshold:.0%}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,143 @@
+"""
+Memory admission control of a2f (--max-memory). The peak memory of every file is estimated from its WAVE header and
+the features in use: the signal, its float64 copy for YAAFE, the spectrograms and envelope of the feature plan and the
+largest transient buffer (windowed frames and their complex spectra, the complex analytic signal). Units of work enter
+the pool in order as long as the estimates of the units in flight stay within the budget; a unit that does not fit
+waits for running units to complete. Files whose estimate alone exceeds the budget go to the streaming lane: they are
+computed with --stream-block (or STREAM_LANE_BLOCK seconds) in units of their own, or in memory on their own with
+windowed results, which cannot be streamed.
+"""
+
+import re
+import struct
+import logging
+from datavis import spectral
+from datavis.audio_io import probe_wav, AudioIOException
+from datavis.common import working_dtype
+from datavis.filters import get_band_filter
+from datavis.plan import build_plan
+from datavis.yaafe_wrapper import get_feature_specs
+from datavis.windows import get_windowing
+
+# Block duration (in seconds) of files in the streaming lane when the run does not stream
+STREAM_LANE_BLOCK = 60
+# Samples of context around a streamed block (see streaming.ENVELOPE_MARGIN)
+STREAM_MARGIN = 2 * 8192
+# Bytes per sample of all channels as read by soundfile (float32) before the mix down to mono
+READ_ITEMSIZE = 4
+
+_UNITS = {'': 1, 'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+
+
+def parse_memory(text: str) -> int:
+    """
+    :param text: amount of memory, e.g. "512M", "16G" or a number of bytes
+    :return: bytes
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)i?B?\s*', text, flags=re.IGNORECASE)
+    if match is None:
+        raise ValueError(f'Memory must be a number of bytes with an optional K, M, G or T suffix, got {text}')
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def estimate_memory(fs: int, channels: int, frames: int, config: dict, stream_block: float = None) -> int:
+    """
+    Rough peak memory of computing the features of a file
+    :param fs: sampling rate (in Hz)
+    :param channels: number of channels
+    :param frames: number of samples per channel
+    :param config: config dictionary
+    :param stream_block: block duration (in seconds) of the streaming mode, None for in-memory
+    :return: bytes
+    """
+    if stream_block:
+        frames = min(frames, int(stream_block * fs) + STREAM_MARGIN)
+    itemsize = working_dtype(config).itemsize
+    signal = frames * itemsize
+    kept, transient = signal, frames * channels * READ_ITEMSIZE
+    if get_feature_specs(config['YAAFE_features']) and itemsize < 8:
+        kept += frames * 8
+    if get_band_filter(config, fs) is not None:
+        kept += signal
+    plan = build_plan(config['Bioacoustic_features'], fs)
+    for key in set(key for keys in plan.values() for key in keys):
+        if key[0] == spectral.spectrogram_key()[0]:
+            _, win_len, hop, _ = key
+            n_frames = max(frames - win_len, 0) // hop + 1
+            kept += n_frames * (win_len // 2) * itemsize
+            transient = max(transient, n_frames * (win_len + 2 * (win_len // 2 + 1)) * itemsize)
+        elif key == spectral.ENVELOPE_KEY:
+            kept += signal
+            transient = max(transient, 3 * signal)
+    if 'Formants' in plan:
+        transient = max(transient, 4 * signal)
+    return kept + transient
+
+
+class Admission(object):
+    """
+    Memory budget of the units of work in flight
+    :param budget: bytes
+    :param stream_block: block duration of the run (None if it does not stream)
+    """
+    def __init__(self, budget: int, config: dict, stream_block: float = None):
+        self.budget = budget
+        self.config = config
+        self.stream_block = stream_block
+        self.lane_block = None if get_windowing(config) is not None else stream_block or STREAM_LANE_BLOCK
+        self.used = 0
+        self._estimates = {}
+        self._streamed = set()
+
+    def _file_estimate(self, path: str, stream_block: float = None) -> int:
+        try:
+            info = probe_wav(path)
+        except (AudioIOException, OSError, struct.error):
+            return 0
+        return estimate_memory(info.fs, info.channels, info.frames, self.config, stream_block)
+
+    def split(self, tasks: list) -> tuple:
+        """
+        Estimate the memory of tasks and separate those exceeding the budget
+        :return: list of the tasks that fit the budget and list of the tasks of the streaming lane
+        """
+        regular, streamed = [], []
+        for paths in tasks:
+            estimate = sum(self._file_estimate(path, self.stream_block) for path in paths)
+            if estimate > self.budget:
+                # files of a batch are streamed one by one
+                estimate = max(self._file_estimate(path, self.lane_block) for path in paths)
+                self._streamed.add(tuple(paths))
+                streamed.append(paths)
+            else:
+                regular.append(paths)
+            self._estimates[tuple(paths)] = estimate
+        if streamed:
+            lane = f'streamed in blocks of {self.lane_block}s' if self.lane_block else 'processed on their own'
+            logging.info(f'{sum(len(paths) for paths in streamed)} files exceed the memory budget of '
+                         f'{self.budget / 2 ** 20:.0f}MB and are {lane}')
+        return regular, streamed
+
+    def cost(self, unit: list) -> int:
+        """
+        :return: estimate of a unit of work; its tasks run one after the other
+        """
+        return max(self._estimates.get(tuple(paths), 0) for paths in unit)
+
+    def unit_stream_block(self, unit: list):
+        """
+        :return: block duration of a unit of the streaming lane, None for other units
+        """
+        return self.lane_block if any(tuple(paths) in self._streamed for paths in unit) else None
+
+    def fits(self, cost: int) -> bool:
+        """
+        :return: whether a unit of this cost can enter the pool now; with nothing in flight every unit does
+        """
+        return self.used == 0 or self.used + cost <= self.budget
+
+    def acquire(self, cost: int):
+        self.used += cost
+
+    def release(self, cost: int):
+        self.used -= cost
@@ -1,19 +1,150 @@
 import os
 import re
 import glob
+import struct
 import logging
+import librosa
+from collections import OrderedDict, namedtuple
+import numpy as np
 import pandas as pd
-from io import StringIO
+import soundfile as sf
+from io import StringIO, BytesIO
 from typing import Generator, Tuple
 from joblib import Parallel, delayed
-from datetime import datetime
+from datetime import datetime, timedelta
 from pathlib import Path, PosixPath
+from datavis.store import is_store, read_store, iter_store, OFFSET_COLUMN
 
 
 class AudioIOException(Exception):
     pass
 
 
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# (format, bits per sample) -> dtype of the samples and the scale that maps them to [-1, 1)
+_PCM_DTYPES = {
+    (WAVE_FORMAT_PCM, 8): (np.dtype('u1'), 1 / 128),
+    (WAVE_FORMAT_PCM, 16): (np.dtype('<i2'), 1 / 2 ** 15),
+    (WAVE_FORMAT_PCM, 32): (np.dtype('<i4'), 1 / 2 ** 31),
+    (WAVE_FORMAT_IEEE_FLOAT, 32): (np.dtype('<f4'), 1),
+    (WAVE_FORMAT_IEEE_FLOAT, 64): (np.dtype('<f8'), 1),
+}
+
+WavInfo = namedtuple('WavInfo', ['fs', 'channels', 'frames', 'duration', 'format', 'bits', 'data_offset',
+                                 'truncated'])
+# Data chunk size left in the header by writers that stream and do not know the size in advance
+_UNKNOWN_SIZE = 0xFFFFFFFF
+
+
+def probe_wav(path: str) -> WavInfo:
+    """
+    Parse the RIFF header of a WAVE file without reading the samples
+    :param path: path to the WAVE file
+    :return: WavInfo with sampling rate, channels, number of frames, duration (s), format tag, bits per sample,
+    offset of the sample data and whether the file holds less data than its header announces (e.g. an interrupted
+    upload)
+    """
+    with open(path, 'rb') as fo:
+        return _parse_wav_header(fo, os.path.getsize(path), path)
+
+
+def _parse_wav_header(fo, file_size: int, name: str) -> WavInfo:
+    riff, _, wave = struct.unpack('<4sI4s', fo.read(12))
+    if riff != b'RIFF' or wave != b'WAVE':
+        raise AudioIOException(f'{name} is not a RIFF/WAVE file')
+    fmt = None
+    while True:
+        header = fo.read(8)
+        if len(header) < 8:
+            raise AudioIOException(f'No data chunk found in {name}')
+        chunk_id, chunk_size = struct.unpack('<4sI', header)
+        if chunk_id == b'fmt ':
+            chunk = fo.read(chunk_size)
+            audio_format, channels, fs, _, block_align, bits = struct.unpack('<HHIIHH', chunk[:16])
+            if audio_format == WAVE_FORMAT_EXTENSIBLE and len(chunk) >= 26:
+                audio_format = struct.unpack('<H', chunk[24:26])[0]
+            fmt = (audio_format, channels, fs, block_align, bits)
+            fo.seek(chunk_size % 2, os.SEEK_CUR)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise AudioIOException(f'Data chunk precedes fmt chunk in {name}')
+            audio_format, channels, fs, block_align, bits = fmt
+            data_offset = fo.tell()
+            # writers that were interrupted or stream leave a wrong size in the header, trust the file size
+            data_size = min(chunk_size, file_size - data_offset)
+            frames = data_size // block_align
+            return WavInfo(fs=fs, channels=channels, frames=frames, duration=frames / fs, format=audio_format,
+                           bits=bits, data_offset=data_offset,
+                           truncated=chunk_size != _UNKNOWN_SIZE and chunk_size > file_size - data_offset)
+        else:
+            fo.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
+
+
+def _to_mono_float32(samples: np.ndarray, scale: float, offset: float) -> np.ndarray:
+    if samples.shape[1] > 1:
+        y = samples.mean(axis=1, dtype=np.float32)
+        y -= offset
+        y *= scale
+        return y
+    if offset:
+        y = np.subtract(samples[:, 0], offset, dtype=np.float32)
+        y *= scale
+        return y
+    return np.multiply(samples[:, 0], np.float32(scale), dtype=np.float32)
+
+
+def _sample_encoding(info: WavInfo, name: str) -> Tuple[np.dtype, float, float]:
+    key = (info.format, info.bits)
+    if key not in _PCM_DTYPES:
+        raise AudioIOException(f'Unsupported WAVE encoding {key} of {name}')
+    dtype, scale = _PCM_DTYPES[key]
+    offset = 128 if dtype == np.dtype('u1') else 0
+    return dtype, scale, offset
+
+
+def _memmap_wav(path: str, info: WavInfo) -> Tuple[np.ndarray, float, float]:
+    dtype, scale, offset = _sample_encoding(info, path)
+    samples = np.memmap(path, dtype=dtype, mode='r', offset=info.data_offset, shape=(info.frames, info.channels))
+    return samples, scale, offset
+
+
+def load_audio(path: str) -> Tuple[np.ndarray, int]:
+    """
+    Load a WAVE file as float32 mono at its native sampling rate, the equivalent of librosa.load(path, sr=None).
+    PCM and float WAVE files are memory-mapped and converted in a single pass, other encodings go through librosa.
+    :param path: path to the audio file
+    :return: audio and sampling rate
+    """
+    try:
+        info = probe_wav(str(path))
+        samples, scale, offset = _memmap_wav(str(path), info)
+    except (AudioIOException, struct.error, ValueError) as ex:
+        logging.debug('Falling back to librosa for %s: %s', path, ex)
+        return librosa.load(path, sr=None)
+    return _to_mono_float32(samples, scale, offset), info.fs
+
+
+def load_audio_bytes(data: bytes, name: str = '') -> Tuple[np.ndarray, int]:
+    """
+    Decode an audio file held in memory (e.g. a downloaded response) like load_audio
+    :param data: content of the audio file
+    :param name: name of the file for error messages
+    :return: audio and sampling rate
+    """
+    try:
+        info = _parse_wav_header(BytesIO(data), len(data), name)
+        dtype, scale, offset = _sample_encoding(info, name)
+        samples = np.frombuffer(data, dtype=dtype, count=info.frames * info.channels, offset=info.data_offset)
+    except (AudioIOException, struct.error, ValueError) as ex:
+        logging.debug('Falling back to soundfile for %s: %s', name, ex)
+        samples, fs = sf.read(BytesIO(data), dtype='float32', always_2d=True)
+        return (samples.mean(axis=1) if samples.shape[1] > 1 else samples[:, 0]), fs
+    return _to_mono_float32(samples.reshape(info.frames, info.channels), scale, offset), info.fs
+
+
 def get_all_waves_generator(directory: str, resume: bool = False):
     gen = Path(directory).rglob('*.wav')
     if resume:
@@ -34,6 +165,54 @@ def get_all_waves_generator(directory: str, resume: bool = False):
     return paths, total
 
 
+def iter_blocks(path: str, block_duration: float) -> Tuple[Generator[np.ndarray, None, None], int]:
+    """
+    Read audio in consecutive non-overlapping blocks, channels are averaged to mono as librosa.load does
+    :param path: path to the audio file
+    :param block_duration: duration of a block in seconds
+    :return: generator of float32 mono blocks and sampling rate
+    """
+    try:
+        info = probe_wav(path)
+        samples, scale, offset = _memmap_wav(path, info)
+    except (AudioIOException, struct.error, ValueError):
+        samples = None
+    fs = info.fs if samples is not None else sf.info(path).samplerate
+    block_len = max(1, int(block_duration * fs))
+
+    def mapped_blocks():
+        for start in range(0, len(samples), block_len):
+            yield _to_mono_float32(samples[start: start + block_len], scale, offset)
+
+    def blocks():
+        for block in sf.blocks(path, blocksize=block_len, dtype='float32', always_2d=True):
+            yield block.mean(axis=1) if block.shape[1] > 1 else block[:, 0]
+    return (mapped_blocks() if samples is not None else blocks()), fs
+
+
+def get_same_shape_batches(files, batch_size: int) -> list:
+    """
+    Group files with the same sampling rate, length and number of channels into batches
+    :param files: iterable of paths
+    :param batch_size: maximum number of files in a batch
+    :return: list of batches (lists of paths); unreadable headers end up in batches of one
+    """
+    groups = OrderedDict()
+    for path in files:
+        try:
+            info = probe_wav(str(path))
+            key = (info.fs, info.frames, info.channels)
+        except (AudioIOException, OSError, struct.error):
+            key = None
+        groups.setdefault(key, []).append(path)
+
+    batches = []
+    for key, paths in groups.items():
+        size = batch_size if key is not None else 1
+        batches.extend(paths[i: i + size] for i in range(0, len(paths), size))
+    return batches
+
+
 def get_all_waves(directory: str) -> list:
     """
     Return all wave files (recursively) from the provided directory in sorted order
@@ -72,16 +251,23 @@ def get_date_range_from_directory(directory: str, periods: int) -> pd.DatetimeIn
 
 def read_result_csv(path):
     """
-    Assumes the result file has a header and a single line with results
+    Assumes the result file has a header and a single line with results, or a line per window starting with the
+    offset of the window (see windows.py)
     :param path:
-    :return:
+    :return: header and lines with results prefixed with the timestamp (of the window)
     """
     with open(path) as fo:
-        data = fo.readlines()[1]
+        lines = fo.readlines()
+    header = lines[0]
     filename = os.path.basename(path)
     time = extract_datetime_from_filename(filename)
-    data = str(time) + ',' + data
-    return data
+    if not header.startswith(OFFSET_COLUMN + ','):
+        return header, str(time) + ',' + lines[1]
+    data = []
+    for line in lines[1:]:
+        offset, values = line.split(',', 1)
+        data.append(str(time + timedelta(seconds=float(offset))) + ',' + values)
+    return header.split(',', 1)[1], ''.join(data)
 
 
 def get_result_header(path):
@@ -93,15 +279,40 @@ def read_results(directory: str) -> pd.DataFrame:
     """
     If reading this section makes you think "why not use pandas or dask read_csv?", answer is simple: processing
     with these takes prohibitively long time, especially concat of results. By using StringIO we reduce the load time
-    over 100x for large datasets
+    over 100x for large datasets. A feature store written by "a2f --store" is read directly.
     :param directory:
     :return:
     """
-    csv_paths = list(Path(directory).rglob('*.csv'))
-    header = get_result_header(csv_paths[0])
-    data = Parallel(n_jobs=15, backend='loky')(delayed(read_result_csv)(path=path) for path in csv_paths)
-    data = header + ''.join(data)
-    data = StringIO(data)
-    data = pd.read_csv(data)
+    if is_store(directory):
+        return read_store(directory)
+    return read_result_files(list(Path(directory).rglob('*.csv')))
+
+
+def iter_results(directory: str, chunk_files: int = 20000):
+    """
+    Read results (see read_results) in time-ordered chunks, so that memory is bounded by the chunk size rather than
+    by the size of the data set
+    :param directory: directory with result CSVs or a feature store
+    :param chunk_files: number of result files (rows) per chunk
+    :return: generator of timestamp-indexed DataFrames sorted by time
+    """
+    if is_store(directory):
+        yield from iter_store(directory, rows=chunk_files)
+        return
+    csv_paths = sorted(Path(directory).rglob('*.csv'), key=lambda path: extract_datetime_from_filename(path.name))
+    for start in range(0, len(csv_paths), chunk_files):
+        yield read_result_files(csv_paths[start:start + chunk_files])
+
+
+def read_result_files(csv_paths: list) -> pd.DataFrame:
+    """
+    Read result CSV files (see read_results) into a timestamp-indexed DataFrame
+    """
+    results = Parallel(n_jobs=15, backend='loky')(delayed(read_result_csv)(path=path) for path in csv_paths)
+    # Results computed with different configs (e.g. partially updated with "a2f --resume") have different headers
+    lines = OrderedDict()
+    for header, data in results:
+        lines.setdefault(header, []).append(data)
+    data = pd.concat([pd.read_csv(StringIO(header + ''.join(data))) for header, data in lines.items()], sort=False)
     data.index = pd.to_datetime(data.index)
     return data.sort_index()
@@ -1,7 +1,10 @@
+import logging
+import numpy as np
 import pandas as pd
 import plotly.graph_objects as go
 
 SUPPORTED_FORMATS = ['html', 'png', 'webp', 'svg', 'pdf', 'eps']
+ENVELOPES = ['max', 'mean', 'min']
 
 sns_colorscale = [[0.0, '#3f7f93'],
  [0.071, '#5890a1'],
@@ -20,18 +23,58 @@ sns_colorscale = [[0.0, '#3f7f93'],
  [1.0, '#d93a46']]
 
 
-def save_heatmap_with_datetime(df: pd.DataFrame, output_path: str, dformat: str = 'html'):
-    fig = go.Figure(data=go.Heatmap(
-        z=df.T,
-        x=df.index,
-        y=df.columns.values,
-        colorscale='Viridis'))
+def decimate(df: pd.DataFrame, width: int) -> dict:
+    """
+    Downsample the time axis to at most width columns, e.g. the pixel width of the figure. Consecutive rows are grouped
+    into width bins summarised by their minimum, mean and maximum, so short spikes survive in the envelopes.
+    :param df: time indexed data
+    :param width: maximum number of rows of the result, no decimation if 0
+    :return: dictionary envelope (max, mean, min) -> DataFrame indexed by the start of every bin
+    """
+    if width <= 0 or len(df) <= width:
+        return {envelope: df for envelope in ENVELOPES}
+    bins = np.arange(len(df)) * width // len(df)
+    groups = df.groupby(bins)
+    starts = df.index[np.searchsorted(bins, np.arange(width))]
+    envelopes = {'max': groups.max(), 'mean': groups.mean(), 'min': groups.min()}
+    for envelope in envelopes.values():
+        envelope.index = starts
+    return envelopes
+
+
+def save_heatmap_with_datetime(df: pd.DataFrame, output_path: str, dformat: str = 'html', width: int = 0,
+                               envelope: str = 'max', webgl: bool = False):
+    """
+    :param width: maximum number of time columns, longer data is decimated (see decimate); 0 plots every row
+    :param envelope: statistic of the decimated bins shown as colour, all three are shown on hover
+    :param webgl: render with WebGL (heatmapgl) where the installed plotly supports it
+    """
+    envelopes = decimate(df, width)
+    # float32 numpy arrays keep the figure compact, recent plotly versions encode them as binary arrays
+    z = envelopes[envelope].T.values.astype(np.float32)
+    x, y = envelopes[envelope].index, df.columns.values
+    if webgl and hasattr(go, 'Heatmapgl'):
+        trace = go.Heatmapgl(z=z, x=x, y=y, colorscale='Viridis')
+    else:
+        if webgl:
+            logging.warning('This version of plotly has no WebGL heatmap, using a regular heatmap')
+        hover = {}
+        if len(x) < len(df):
+            hover = dict(customdata=np.dstack([envelopes[e].T.values.astype(np.float32) for e in ENVELOPES]),
+                         hovertemplate='%{y}<br>%{x}<br>max %{customdata[0]:.3f}<br>mean %{customdata[1]:.3f}'
+                                       '<br>min %{customdata[2]:.3f}<extra></extra>')
+        trace = go.Heatmap(z=z, x=x, y=y, colorscale='Viridis', **hover)
+    fig = go.Figure(data=trace)
     save_figure(fig, dformat, output_path)
 
 
-def save_corr_matrix(df: pd.DataFrame, output_path: str, dformat: str = 'html'):
-    corr = df.corr().values
-    col_names = df.columns.values
+def save_corr_matrix(df: pd.DataFrame, output_path: str, dformat: str = 'html', corr: pd.DataFrame = None):
+    """
+    :param corr: correlation matrix of df if already computed (e.g. by chunked.OnlineStats), df.corr() otherwise
+    """
+    corr = df.corr() if corr is None else corr
+    col_names = corr.columns.values
+    corr = corr.values
     N = len(corr)
     corr = [[corr[i][j] if i > j else None for j in range(N)] for i in range(N)]
     text = [[f'corr({col_names[i]}, {col_names[j]}) = {corr[i][j]:.2f}' if i > j else '' for j in range(N)] for i in range(N)]
@@ -1,9 +1,31 @@
 import librosa
 import numpy as np
 from functools import wraps
+from collections import OrderedDict
 from scipy.stats import entropy
+from scipy.special import entr
+from scipy.signal import resample_poly
 from datavis import spectral
 from datavis.common import gini, strided_array, moving_average
+from datavis.plan import build_plan, PlanExecution
+from datavis.instrumentation import NULL_PROFILER, STAGE_SEPARATOR
+
+ACOUSTIC_ACTIVITY_COLUMNS = ['SNR', 'Acoustic_activity', 'Acoustic_events_count', 'Event_average_duration']
+FORMANT_COLUMNS = ['formant_q25', 'formant_q50', 'formant_q75', 'formant_IQR', 'formant_len']
+# Frames of the frame-based formant mode processed at once, bounds the memory of long recordings
+FORMANT_FRAMES_BLOCK = 4096
+
+# Output columns of every bioacoustic feature, in the order they appear in the results
+FEATURE_COLUMNS = OrderedDict([
+    ('Acoustic_Complexity_Index', ['Acoustic_Complexity_Index']),
+    ('Acoustic_Diversity_Index', ['Acoustic_Diversity_Index']),
+    ('Bioacoustic_Index', ['Bioacoustic_Index']),
+    ('Spectral_entropy', ['Spectral_entropy']),
+    ('Temporal_entropy', ['Temporal_entropy']),
+    ('Acoustic_Evenness_Index', ['Acoustic_Evenness_Index']),
+    ('Acoustic_activity', ACOUSTIC_ACTIVITY_COLUMNS),
+    ('Formants', FORMANT_COLUMNS),
+])
 
 
 def toggle(f):
@@ -22,7 +44,7 @@ def toggle(f):
 
 
 @toggle
-def get_acoustic_complexity_index(y: np.ndarray, fs: int, config: dict) -> float:
+def get_acoustic_complexity_index(y: np.ndarray, fs: int, config: dict, scope: spectral.SpectralScope = None) -> float:
     """
     The ACI is based on the "observation that many biotic sounds, such as bird songs, are characterized by an intrinsic
     variability of intensities, while some types of human generated noise (such as car passing or airplane transit)
@@ -36,11 +58,12 @@ def get_acoustic_complexity_index(y: np.ndarray, fs: int, config: dict) -> float
     :param y: mono audio
     :param fs: sampling (in Hz)
     :param config: config dictionary
+    :param scope: spectral intermediates of y shared with other features (optional)
     :return: Acoustic Complexity Index (ACI)
     """
     aci_params = config['params']
     spec_params = config['spectrogram']
-    spec, freq = spectral.spectrogram(sig=y, fs=fs, **spec_params)
+    spec, freq = spectral.get_scope(y, fs, scope).spectrogram(**spec_params)
     j_bin = int(aci_params['bin'] * fs / spec_params['hop'])
     full_bins = spec.shape[1] // j_bin
 
@@ -51,7 +74,7 @@ def get_acoustic_complexity_index(y: np.ndarray, fs: int, config: dict) -> float
 
 
 @toggle
-def get_acoustic_diversity_index(y: np.ndarray, fs: int, config: dict) -> float:
+def get_acoustic_diversity_index(y: np.ndarray, fs: int, config: dict, scope: spectral.SpectralScope = None) -> float:
     """
     The ADI is calculated by dividing the spectrogram into bins (default 10) and taking the proportion of the signals in
     each bin above a threshold (default -50 dBFS). The ADI is the result of the Shannon index applied to these bins.
@@ -62,6 +85,7 @@ def get_acoustic_diversity_index(y: np.ndarray, fs: int, config: dict) -> float:
     :param y: mono audio
     :param fs: sampling (in Hz)
     :param config: config dictionary
+    :param scope: spectral intermediates of y shared with other features (optional)
     :return: Diversity Index (DI)
     """
     adi_params = config['params']
@@ -69,13 +93,14 @@ def get_acoustic_diversity_index(y: np.ndarray, fs: int, config: dict) -> float:
     fs_step = adi_params['fs_step']
     db_threshold = adi_params['db_threshold']
 
-    spec_segmented = spectral.segmented_spectogram(y=y, fs=fs, fs_step=fs_step, fs_max=fs_max, db_threshold=db_threshold)
+    spec_segmented = spectral.get_scope(y, fs, scope).segmented_spectrogram(fs_step=fs_step, fs_max=fs_max,
+                                                                         db_threshold=db_threshold)
     ADI = entropy(spec_segmented)
     return ADI
 
 
 @toggle
-def get_bioacoustic_index(y: np.ndarray, fs: int, config: dict):
+def get_bioacoustic_index(y: np.ndarray, fs: int, config: dict, scope: spectral.SpectralScope = None):
     """
     The Bioacoustic Index is calculated as the "area under each curve included all frequency bands associated with the
     dB value that was greater than the minimum dB value for each curve. The area values are thus a function of both the
@@ -88,13 +113,14 @@ def get_bioacoustic_index(y: np.ndarray, fs: int, config: dict):
     :param y: mono audio
     :param fs: sampling (in Hz)
     :param config: config dictionary
+    :param scope: spectral intermediates of y shared with other features (optional)
     :return: Bioacoustic Index (BI)
     """
     bi_params = config['params']
     spec_params = config['spectrogram']
     fs_min = bi_params['fs_min']
     fs_max = min(bi_params['fs_max'], fs / 2)
-    spec, freq = spectral.spectrogram(sig=y, fs=fs, **spec_params)
+    spec, freq = spectral.get_scope(y, fs, scope).spectrogram(**spec_params)
 
     min_freq_idx = (np.abs(freq - fs_min)).argmin() - 1
     max_freq_idx = (np.abs(freq - fs_max)).argmin()
@@ -111,7 +137,7 @@ def get_bioacoustic_index(y: np.ndarray, fs: int, config: dict):
 
 
 @toggle
-def get_spectral_entropy(y: np.ndarray, fs: int, config: dict) -> float:
+def get_spectral_entropy(y: np.ndarray, fs: int, config: dict, scope: spectral.SpectralScope = None) -> float:
     """
     Spectral Entropy (Shannon definition) of audio signal.
     The Shannon spectral entropy of a noisy signal will tend towards 1 whereas the Shannon spectral entropy of a pure
@@ -123,10 +149,11 @@ def get_spectral_entropy(y: np.ndarray, fs: int, config: dict) -> float:
     :param y: mono audio
     :param fs: sampling (in Hz)
     :param config: config dictionary
+    :param scope: spectral intermediates of y shared with other features (optional)
     :return: spectral entropy (SE)
     """
     spec_params = config['spectrogram']
-    spec, freq = spectral.spectrogram(sig=y, fs=fs, **spec_params)
+    spec, freq = spectral.get_scope(y, fs, scope).spectrogram(**spec_params)
     N = spec.shape[0]
     spec_sum = np.sum(spec, axis=1) / np.sum(spec)
     spectral_entropy = entropy(spec_sum) / np.log(N)
@@ -134,7 +161,8 @@ def get_spectral_entropy(y: np.ndarray, fs: int, config: dict) -> float:
     return spectral_entropy
 
 
-def get_temporal_entropy(y: np.ndarray, fs: int, config: dict) -> float:
+@toggle
+def get_temporal_entropy(y: np.ndarray, fs: int, config: dict, scope: spectral.SpectralScope = None) -> float:
     """
     Temporal entropy is a measure of the temporal dispersal of acoustic energy within a recording,
     has been shown to reflect the number of avian calls in a recording (Sueur, Pavoine et al. 2008).
@@ -142,17 +170,18 @@ def get_temporal_entropy(y: np.ndarray, fs: int, config: dict) -> float:
     :param y: mono audio
     :param fs: sampling (in Hz)
     :param config: config dictionary
+    :param scope: spectral intermediates of y shared with other features (optional)
     :return: temporal entropy (TE)
     """
-    envelope = spectral.envelope(sig=y)
-    envelope /= np.sum(envelope)
+    envelope = spectral.get_scope(y, fs, scope).envelope()
+    envelope = envelope / np.sum(envelope)
     N = len(envelope)
     temporal_entropy = entropy(envelope) / np.log(N)
     return temporal_entropy
 
 
 @toggle
-def get_acoustic_evenness_index(y: np.ndarray, fs: int, config: dict) -> float:
+def get_acoustic_evenness_index(y: np.ndarray, fs: int, config: dict, scope: spectral.SpectralScope = None) -> float:
     """
     The AEI is calculated by dividing the spectrogram into bins (default 10) and taking the proportion of the signals
     in each bin above a threshold (default -50 dBFS). The AEI is the result of the Gini index applied to these bins.
@@ -163,19 +192,21 @@ def get_acoustic_evenness_index(y: np.ndarray, fs: int, config: dict) -> float:
     :param y: mono audio
     :param fs: sampling (in Hz)
     :param config: config dictionary
+    :param scope: spectral intermediates of y shared with other features (optional)
     :return: Acoustic Evenness Index (AEI)
     """
     aei_params = config['params']
     fs_max = min(aei_params['fs_max'], fs / 2)
     fs_step = aei_params['fs_step']
     db_threshold = aei_params['db_threshold']
-    spec_segmented = spectral.segmented_spectogram(y=y, fs=fs, fs_step=fs_step, fs_max=fs_max, db_threshold=db_threshold)
+    spec_segmented = spectral.get_scope(y, fs, scope).segmented_spectrogram(fs_step=fs_step, fs_max=fs_max,
+                                                                         db_threshold=db_threshold)
     aei = gini(spec_segmented)
     return aei
 
 
 @toggle
-def get_spectral_centroid(y: np.ndarray, fs: int, config: dict):
+def get_spectral_centroid(y: np.ndarray, fs: int, config: dict, scope: spectral.SpectralScope = None):
     """
     Compute the spectral centroid of an audio signal
 
@@ -183,16 +214,17 @@ def get_spectral_centroid(y: np.ndarray, fs: int, config: dict):
     :param y: mono audio
     :param fs: sampling (in Hz)
     :param config: config dictionary
+    :param scope: spectral intermediates of y shared with other features (optional)
     :return: spectral centroid (SC)
     """
     spec_params = config['spectrogram']
-    spec, freq = spectral.spectrogram(sig=y, fs=fs, **spec_params)
+    spec, freq = spectral.get_scope(y, fs, scope).spectrogram(**spec_params)
     centroid = freq.dot(spec) / spec.sum(axis=0)
     return centroid  # Currently not returning the expected shape (hence commented below)
 
 
 @toggle
-def get_acoustic_activity(y: np.ndarray, fs: int, config: dict) -> dict:
+def get_acoustic_activity(y: np.ndarray, fs: int, config: dict, scope: spectral.SpectralScope = None) -> dict:
     """
 
     Compute the following:
@@ -215,12 +247,28 @@ def get_acoustic_activity(y: np.ndarray, fs: int, config: dict) -> dict:
     :param y: mono audio
     :param fs: sampling (in Hz)
     :param config: config dictionary
+    :param scope: spectral intermediates of y shared with other features (optional)
     :return: dictionary with SNR, Acoustic_activity, Count_acoustic_events and Average_duration
     """
     params = config['params']
 
     duration_s = len(y) / fs
-    wave_env = 20 * np.log10(np.max(np.abs(strided_array(y, params['frame_len'], params['frame_len'])), axis=1))
+    wave_env = frames_envelope_db(y, params['frame_len'])
+    return acoustic_activity_from_envelope(wave_env, duration_s, params)
+
+
+def frames_envelope_db(y: np.ndarray, frame_len: int) -> np.ndarray:
+    return 20 * np.log10(np.max(np.abs(strided_array(y, frame_len, frame_len)), axis=1))
+
+
+def acoustic_activity_from_envelope(wave_env: np.ndarray, duration_s: float, params: dict) -> dict:
+    """
+    Acoustic activity statistics from the frame-wise envelope (in dB) of the signal, see get_acoustic_activity
+    :param wave_env: maximum absolute amplitude (in dB) of consecutive frames
+    :param duration_s: duration of the signal in seconds
+    :param params: 'params' of the Acoustic_activity config
+    :return: dictionary with SNR, Acoustic_activity, Count_acoustic_events and Average_duration
+    """
     minimum = np.max((np.min(wave_env), params['min_dB']))
     hist, bin_edges = np.histogram(wave_env, range=(minimum, minimum + params['dB_range']),
                                    bins=params['hist_number_bins'], density=False)
@@ -266,7 +314,7 @@ def get_acoustic_activity(y: np.ndarray, fs: int, config: dict) -> dict:
 
 
 @toggle
-def get_formant_frequencies(y: np.ndarray, fs: int, config: dict) -> dict:
+def get_formant_frequencies(y: np.ndarray, fs: int, config: dict, scope: spectral.SpectralScope = None) -> dict:
     """
     Formants are frequency peaks in the spectrum which have a high degree of energy.
     See e.g. https://stackoverflow.com/questions/61519826/how-to-decide-filter-order-in-linear-prediction-coefficients-lpc-while-calcu/61528322#61528322
@@ -275,12 +323,28 @@ def get_formant_frequencies(y: np.ndarray, fs: int, config: dict) -> dict:
     :param y: mono audio
     :param fs: sampling (in Hz)
     :param config: config dictionary
+    :param scope: spectral intermediates of y shared with other features (optional)
     :return: dictionary with formants quartiles, IQR and number of formants
     """
-    order = config['params']['order']
+    params = config['params']
+    if params.get('mode', 'global') == 'frames':
+        _, tracks = formant_tracks(y, fs, order=params['order'], band=params.get('band', 5000),
+                                   frame=params.get('frame', 0.03), hop=params.get('hop', 0.03))
+        return formants_from_tracks(tracks)
+    order = params['order']
     if order is None:
         order = fs // 1000
     A = librosa.core.lpc(y, order)
+    return formants_from_lpc(A, fs)
+
+
+def formants_from_lpc(A: np.ndarray, fs: int) -> dict:
+    """
+    Formant statistics from the roots of the LPC polynomial
+    :param A: LPC coefficients
+    :param fs: sampling (in Hz)
+    :return: dictionary with formants quartiles, IQR and number of formants
+    """
     rts = np.roots(A)
     rts = rts[np.imag(rts) >= 0]
     angz = np.arctan2(np.imag(rts), np.real(rts))
@@ -296,33 +360,238 @@ def get_formant_frequencies(y: np.ndarray, fs: int, config: dict) -> dict:
     return d
 
 
-def get_bioacoustic_features(y: np.ndarray, fs: int, config: dict) -> dict:
+def lpc_frames(frames: np.ndarray, order: int) -> np.ndarray:
+    """
+    LPC coefficients of all frames at once by the autocorrelation method: autocorrelations as order + 1 lagged products
+    (cheaper than through the FFT at the low orders of formant estimation) accumulated in float64 and the
+    Levinson-Durbin recursion, both vectorised over frames
+    :param frames: array (n_frames, frame_len) of windowed frames
+    :param order: order of the linear filter
+    :return: array (n_frames, order + 1) of prediction error coefficients, the first being 1 (as librosa.core.lpc)
+    """
+    n = frames.shape[1]
+    r = np.stack([np.einsum('ij,ij->i', frames[:, lag:], frames[:, :n - lag], dtype=np.float64)
+                  for lag in range(order + 1)], axis=1)
+    a = np.zeros((len(frames), order + 1))
+    a[:, 0] = 1
+    error = r[:, 0].copy()
+    for i in range(1, order + 1):
+        acc = r[:, i] + (a[:, 1:i] * r[:, i - 1:0:-1]).sum(axis=1)
+        k = np.divide(-acc, error, out=np.zeros_like(acc), where=error > 0)
+        previous = a[:, 1:i].copy()
+        a[:, 1:i] = previous + k[:, None] * previous[:, ::-1]
+        a[:, i] = k
+        error *= 1 - k ** 2
+    return a
+
+
+def lpc_roots_frequencies(A: np.ndarray, fs: float) -> np.ndarray:
+    """
+    Frequencies of the roots in the upper half plane of many LPC polynomials, as eigenvalues of their companion
+    matrices computed in one batch
+    :param A: array (n, order + 1) of LPC coefficients, the first being 1
+    :return: array (n, order) of sorted frequencies in Hz, NaN for roots in the lower half plane
+    """
+    order = A.shape[1] - 1
+    companion = np.zeros((len(A), order, order))
+    companion[:, 0, :] = -A[:, 1:]
+    companion[:, np.arange(1, order), np.arange(order - 1)] = 1
+    roots = np.linalg.eigvals(companion)
+    frequencies = np.where(roots.imag >= 0, np.arctan2(roots.imag, roots.real) * fs / (2 * np.pi), np.nan)
+    return np.sort(frequencies, axis=1)
+
+
+def decimation_factor(fs: int, band: float) -> int:
     """
-    Compute all bioacustic features
+    :return: integer factor the sampling rate can be divided by keeping frequencies up to band (in Hz, None for all)
+    """
+    return max(int(fs // (2 * band)), 1) if band else 1
+
+
+def formant_frame_sizes(fs: float, order: int, frame: float, hop: float) -> tuple:
+    """
+    :return: frame length and hop in samples of the frame-based formant mode
+    """
+    return max(int(frame * fs), order + 1), max(int(hop * fs), 1)
+
+
+def formant_tracks(y: np.ndarray, fs: int, order: int = None, band: float = 5000, frame: float = 0.03,
+                   hop: float = 0.03) -> tuple:
+    """
+    Frame-based formant estimation: the signal is decimated to the band of interest, LPC coefficients of all frames are
+    computed at once (see lpc_frames) and the roots of all frames are solved in batch
+    :param y: mono audio
+    :param fs: sampling (in Hz)
+    :param order: order of the LPC, fs // 1000 of the decimated signal if None
+    :param band: highest frequency of interest (in Hz), None to keep the sampling rate
+    :param frame: frame duration (in seconds)
+    :param hop: hop between frames (in seconds)
+    :return: frame start times (in seconds) and array (n_frames, order) of sorted formant frequencies of every frame,
+    NaN padded; silent frames are dropped
+    """
+    factor = decimation_factor(fs, band)
+    if factor > 1:
+        y = resample_poly(y, 1, factor)
+        fs = fs / factor
+    if order is None:
+        order = int(fs // 1000)
+    win_len, step = formant_frame_sizes(fs, order, frame, hop)
+    if len(y) < win_len:
+        return np.zeros(0), np.zeros((0, order))
+    frames = strided_array(y, win_len, step)
+    window = np.hamming(win_len).astype(y.dtype)
+    times, tracks = [], []
+    for start in range(0, len(frames), FORMANT_FRAMES_BLOCK):
+        block = frames[start:start + FORMANT_FRAMES_BLOCK] * window
+        voiced = (block ** 2).sum(axis=1) > 0
+        if voiced.any():
+            tracks.append(lpc_roots_frequencies(lpc_frames(block[voiced], order), fs))
+            times.append((start + np.flatnonzero(voiced)) * step / fs)
+    if not tracks:
+        return np.zeros(0), np.zeros((0, order))
+    return np.concatenate(times), np.concatenate(tracks)
+
+
+def formants_from_tracks(tracks: np.ndarray) -> dict:
+    """
+    Formant statistics over the formants of all frames
+    :param tracks: array (n_frames, order) of formant frequencies as returned by formant_tracks
+    :return: dictionary with formants quartiles, IQR and mean number of formants per frame
+    """
+    frqs = tracks[np.isfinite(tracks)]
+    if not len(frqs):
+        return dict.fromkeys(FORMANT_COLUMNS)
+    q25, q50, q75 = np.quantile(frqs, [0.25, 0.50, 0.75])
+    d = {'formant_q25': q25,
+         'formant_q50': q50,
+         'formant_q75': q75,
+         'formant_IQR': q75 - q25,
+         'formant_len': len(frqs) / len(tracks)}
+    return d
+
+
+def acoustic_activity_columns(AE: dict) -> dict:
+    """
+    Output columns of get_acoustic_activity, all None if the feature is off
+    """
+    if AE is None:
+        return dict.fromkeys(ACOUSTIC_ACTIVITY_COLUMNS)
+    return {'SNR': AE['SNR'],
+            'Acoustic_activity': AE['Acoustic_activity'],
+            'Acoustic_events_count': AE['Count_acoustic_events'],
+            'Event_average_duration': AE['Average_duration']}
+
+
+def get_bioacoustic_features(y: np.ndarray, fs: int, config: dict, profiler=NULL_PROFILER,
+                             scope: spectral.SpectralScope = None) -> dict:
+    """
+    Compute all bioacustic features. Spectral intermediates shared by several features (e.g. the spectrogram used by
+    BI and spectral entropy or the segmented spectrogram used by ADI and AEI) are computed once per file according to
+    the feature plan and dropped as soon as their last consumer is done.
     :param y: mono audio
     :param fs: sampling (in Hz)
     :param config: config dictionary
+    :param profiler: instrumentation.Profiler timing every feature as a "bioacoustics/<feature>" stage
+    :param scope: spectral intermediates of y, e.g. a spectral.WindowScope slicing the spectrograms of a longer signal
     :return: dictionary with all bioacustic features
     """
-    AE = get_acoustic_activity(y=y, fs=fs, config=config['Acoustic_activity'])
+    scope = spectral.get_scope(y, fs, scope)
+    execution = PlanExecution(build_plan(config, fs), scope)
+
+    def compute(name, f):
+        with profiler.stage('bioacoustics' + STAGE_SEPARATOR + name):
+            value = f(y=y, fs=fs, config=config[name], scope=scope)
+        execution.done(name)
+        return value
+
+    AE = compute('Acoustic_activity', get_acoustic_activity)
     bioacoustic_features = {
-        'Acoustic_Complexity_Index': get_acoustic_complexity_index(y=y, fs=fs, config=config['Acoustic_Complexity_Index']),
-        'Acoustic_Diversity_Index': get_acoustic_diversity_index(y=y, fs=fs, config=config['Acoustic_Diversity_Index']),
-        'Bioacoustic_Index': get_bioacoustic_index(y=y, fs=fs, config=config['Bioacoustic_Index']),
-        'Spectral_entropy': get_spectral_entropy(y=y, fs=fs, config=config['Spectral_entropy']),
-        'Temporal_entropy': get_temporal_entropy(y=y, fs=fs, config=config['Temporal_entropy']),
-        #'Spectral_centroid': get_spectral_centroid(y=y, fs=fs, config=config['Spectral_centroid']),
-        'Acoustic_Evenness_Index': get_acoustic_evenness_index(y=y, fs=fs, config=config['Acoustic_Evenness_Index']),
-        'SNR': AE['SNR'],
-        'Acoustic_activity': AE['Acoustic_activity'],
-        'Acoustic_events_count': AE['Count_acoustic_events'],
-        'Event_average_duration': AE['Average_duration']
+        'Acoustic_Complexity_Index': compute('Acoustic_Complexity_Index', get_acoustic_complexity_index),
+        'Acoustic_Diversity_Index': compute('Acoustic_Diversity_Index', get_acoustic_diversity_index),
+        'Bioacoustic_Index': compute('Bioacoustic_Index', get_bioacoustic_index),
+        'Spectral_entropy': compute('Spectral_entropy', get_spectral_entropy),
+        'Temporal_entropy': compute('Temporal_entropy', get_temporal_entropy),
+        #'Spectral_centroid': compute('Spectral_centroid', get_spectral_centroid),
+        'Acoustic_Evenness_Index': compute('Acoustic_Evenness_Index', get_acoustic_evenness_index),
+        **acoustic_activity_columns(AE)
     }
-    formants = get_formant_frequencies(y=y, fs=fs, config=config['Formants'])
-    bioacoustic_features.update(formants)
+    formants = compute('Formants', get_formant_frequencies)
+    bioacoustic_features.update(formants or dict.fromkeys(FORMANT_COLUMNS))
     return bioacoustic_features
 
 
+def _entropy_rows(pk: np.ndarray) -> np.ndarray:
+    pk = pk / np.sum(pk, axis=1, keepdims=True)
+    return np.sum(entr(pk), axis=1)
 
 
-
+def get_bioacoustic_features_batch(Y: np.ndarray, fs: int, config: dict) -> list:
+    """
+    Compute all bioacustic features of equally long recordings at once. Spectrograms, ACI, ADI, AEI, BI and spectral and
+    temporal entropy are computed along the batch axis, acoustic activity and formants file by file.
+    :param Y: mono audio of shape (files, samples)
+    :param fs: sampling (in Hz)
+    :param config: config dictionary
+    :return: list with a dictionary of all bioacustic features per file, in the order of Y
+    """
+    n = Y.shape[0]
+    scope = spectral.BatchSpectralScope(Y, fs)
+    plan = build_plan(config, fs)
+    execution = PlanExecution(plan, scope)
+    columns = {}
+
+    if 'Acoustic_Complexity_Index' in plan:
+        aci_params = config['Acoustic_Complexity_Index']['params']
+        spec_params = config['Acoustic_Complexity_Index']['spectrogram']
+        spec, freq = scope.spectrogram(**spec_params)
+        j_bin = int(aci_params['bin'] * fs / spec_params['hop'])
+        full_bins = spec.shape[2] // j_bin
+        spec = spec[..., :j_bin * full_bins].reshape(n, spec.shape[1], full_bins, j_bin)
+        spec_diff = np.sum(np.abs(np.diff(spec)), axis=3)
+        columns['Acoustic_Complexity_Index'] = np.sum(spec_diff / np.sum(spec, axis=3), axis=(1, 2))
+        execution.done('Acoustic_Complexity_Index')
+
+    for name in ['Acoustic_Diversity_Index', 'Acoustic_Evenness_Index']:
+        if name in plan:
+            params = config[name]['params']
+            spec_segmented = scope.segmented_spectrogram(fs_step=params['fs_step'],
+                                                         fs_max=min(params['fs_max'], fs / 2),
+                                                         db_threshold=params['db_threshold'])
+            if name == 'Acoustic_Diversity_Index':
+                columns[name] = _entropy_rows(spec_segmented)
+            else:
+                columns[name] = np.array([gini(row) for row in spec_segmented])
+            execution.done(name)
+
+    if 'Bioacoustic_Index' in plan:
+        bi_params = config['Bioacoustic_Index']['params']
+        spec, freq = scope.spectrogram(**config['Bioacoustic_Index']['spectrogram'])
+        min_freq_idx = (np.abs(freq - bi_params['fs_min'])).argmin() - 1
+        max_freq_idx = (np.abs(freq - min(bi_params['fs_max'], fs / 2))).argmin()
+        spec = spec[:, min_freq_idx: max_freq_idx]
+        spec_BI = 20 * np.log10(spec / np.max(spec, axis=(1, 2), keepdims=True))
+        spec_BI_mean = 10 * np.log10(np.mean(10 ** (spec_BI / 10), axis=2))
+        spectre_BI_mean_normalized = spec_BI_mean - spec_BI_mean.min(axis=1, keepdims=True)
+        columns['Bioacoustic_Index'] = np.sum(spectre_BI_mean_normalized / (freq[1] - freq[0]), axis=1)
+        execution.done('Bioacoustic_Index')
+
+    if 'Spectral_entropy' in plan:
+        spec, freq = scope.spectrogram(**config['Spectral_entropy']['spectrogram'])
+        columns['Spectral_entropy'] = _entropy_rows(np.sum(spec, axis=2)) / np.log(spec.shape[1])
+        execution.done('Spectral_entropy')
+
+    if 'Temporal_entropy' in plan:
+        env = scope.envelope()
+        columns['Temporal_entropy'] = _entropy_rows(env) / np.log(env.shape[1])
+        execution.done('Temporal_entropy')
+
+    rows = []
+    for i in range(n):
+        row = {name: columns[name][i] if name in columns else None
+               for name in ['Acoustic_Complexity_Index', 'Acoustic_Diversity_Index', 'Bioacoustic_Index',
+                            'Spectral_entropy', 'Temporal_entropy', 'Acoustic_Evenness_Index']}
+        AE = get_acoustic_activity(y=Y[i], fs=fs, config=config['Acoustic_activity'])
+        row.update(acoustic_activity_columns(AE))
+        row.update(get_formant_frequencies(y=Y[i], fs=fs, config=config['Formants']) or dict.fromkeys(FORMANT_COLUMNS))
+        rows.append(row)
+    return rows
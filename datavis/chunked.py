@@ -0,0 +1,138 @@
+"""
+Out-of-core processing of results read in time-ordered chunks (see audio_io.iter_results): resampling and the
+statistics f2i needs for normalisation and the correlation matrix, with memory bounded by the chunk size.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class ChunkedResampler(object):
+    """
+    Mean-resamples time-ordered chunks of rows into bins of a number of minutes, giving the same bins as
+    DataFrame.resample(...).mean() of all rows: bins start at midnight of the first day and bins without rows are NaN.
+    The last bin of a chunk may continue in the next chunk, so its rows are held back until a later bin starts.
+    """
+    def __init__(self, minutes: int):
+        self.freq = pd.Timedelta(minutes=minutes)
+        self.origin = None
+        # Start of the first bin not returned yet
+        self.next_bin = None
+        self._carry = None
+
+    def _bins(self, index: pd.DatetimeIndex) -> pd.DatetimeIndex:
+        return self.origin + ((index - self.origin) // self.freq) * self.freq
+
+    def add(self, chunk: pd.DataFrame) -> pd.DataFrame:
+        """
+        :param chunk: timestamp-indexed rows, later than the rows of previous chunks
+        :return: means of the bins completed by the chunk
+        """
+        if self._carry is not None:
+            chunk = pd.concat([self._carry, chunk], sort=False)
+        if not len(chunk):
+            return chunk
+        if self.origin is None:
+            self.origin = chunk.index[0].normalize()
+            self.next_bin = self.origin + ((chunk.index[0] - self.origin) // self.freq) * self.freq
+        bins = self._bins(chunk.index)
+        last = bins[-1]
+        self._carry = chunk[bins == last]
+        return self._emit(chunk[bins < last], bins[bins < last], last)
+
+    def close(self) -> pd.DataFrame:
+        """
+        :return: means of the last bin
+        """
+        if self._carry is None or not len(self._carry):
+            return pd.DataFrame()
+        bins = self._bins(self._carry.index)
+        rows, self._carry = self._carry, None
+        return self._emit(rows, bins, bins[-1] + self.freq)
+
+    def _emit(self, rows: pd.DataFrame, bins: pd.DatetimeIndex, until: pd.Timestamp) -> pd.DataFrame:
+        index = pd.date_range(self.next_bin, until - self.freq, freq=self.freq)
+        self.next_bin = until
+        return rows.groupby(bins).mean().reindex(index)
+
+
+class OnlineStats(object):
+    """
+    Column minimum, maximum and Pearson correlation (over pairwise complete rows, as DataFrame.corr) accumulated over
+    chunks of rows. Sums are taken of values shifted by the mean of the first chunk with values of a column, which
+    avoids the cancellation of the textbook one-pass formula.
+    """
+    def __init__(self):
+        self.columns = []
+        self._shift = np.zeros(0)
+        self._min = np.zeros(0)
+        self._max = np.zeros(0)
+        self._n = np.zeros((0, 0))
+        self._sx = np.zeros((0, 0))
+        self._sxx = np.zeros((0, 0))
+        self._sxy = np.zeros((0, 0))
+
+    def _expand(self, df: pd.DataFrame):
+        new = [c for c in df.columns if c not in self.columns]
+        if not new:
+            return
+        k = len(new)
+        self.columns += new
+        self._shift = np.concatenate([self._shift, np.zeros(k)])
+        self._min = np.concatenate([self._min, np.full(k, np.inf)])
+        self._max = np.concatenate([self._max, np.full(k, -np.inf)])
+        self._n, self._sx, self._sxx, self._sxy = [np.pad(m, ((0, k), (0, k)), mode='constant')
+                                                   for m in (self._n, self._sx, self._sxx, self._sxy)]
+
+    def add(self, df: pd.DataFrame):
+        self._expand(df)
+        x = df.reindex(columns=self.columns).values.astype(np.float64)
+        # Sums of a column without values yet are all zero, so its shift can still be set
+        unseen = np.diag(self._n) == 0
+        if len(x) and unseen.any():
+            values = np.isfinite(x[:, unseen])
+            total = np.where(values, x[:, unseen], 0).sum(axis=0)
+            self._shift[unseen] = total / np.maximum(values.sum(axis=0), 1)
+        x = x - self._shift
+        present = np.isfinite(x)
+        mask = present.astype(np.float64)
+        x = np.where(present, x, 0)
+        self._min = np.minimum(self._min, np.where(present, x, np.inf).min(axis=0, initial=np.inf))
+        self._max = np.maximum(self._max, np.where(present, x, -np.inf).max(axis=0, initial=-np.inf))
+        self._n += mask.T @ mask
+        self._sx += x.T @ mask
+        self._sxx += (x ** 2).T @ mask
+        self._sxy += x.T @ x
+
+    @property
+    def min(self) -> pd.Series:
+        return pd.Series(np.where(np.isfinite(self._min), self._min + self._shift, np.nan), index=self.columns)
+
+    @property
+    def max(self) -> pd.Series:
+        return pd.Series(np.where(np.isfinite(self._max), self._max + self._shift, np.nan), index=self.columns)
+
+    def corr(self) -> pd.DataFrame:
+        n, sx, sxx = self._n, self._sx, self._sxx
+        covariance = n * self._sxy - sx * sx.T
+        variance = (n * sxx - sx ** 2) * (n * sxx.T - sx.T ** 2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.where(variance > 0, covariance / np.sqrt(variance), np.nan)
+        return pd.DataFrame(np.clip(corr, -1, 1), index=self.columns, columns=self.columns)
+
+
+def resample_chunks(chunks, minutes: int):
+    """
+    Mean-resample time-ordered chunks of rows and accumulate statistics of the resampled rows
+    :param chunks: iterable of timestamp-indexed DataFrames, e.g. audio_io.iter_results
+    :return: resampled DataFrame and its OnlineStats
+    """
+    resampler = ChunkedResampler(minutes)
+    stats = OnlineStats()
+    parts = []
+    for chunk in chunks:
+        parts.append(resampler.add(chunk))
+        stats.add(parts[-1])
+    parts.append(resampler.close())
+    stats.add(parts[-1])
+    return pd.concat(parts, sort=False), stats
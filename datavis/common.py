@@ -4,6 +4,22 @@ import json
 import logging.config
 import numpy as np
 
+# Floating point types the extraction path can compute in, chosen by the 'Precision' entry of the config
+PRECISION_KEY = 'Precision'
+PRECISIONS = ('float32', 'float64')
+DEFAULT_PRECISION = 'float32'
+
+
+def working_dtype(config: dict) -> np.dtype:
+    """
+    :param config: config dictionary
+    :return: dtype of the signals and spectral intermediates of the extraction path
+    """
+    precision = config.get(PRECISION_KEY) or DEFAULT_PRECISION
+    if precision not in PRECISIONS:
+        raise ValueError(f'Precision must be one of {", ".join(PRECISIONS)}, got {precision}')
+    return np.dtype(precision)
+
 
 def strided_array(arr, win_len, step):  # Window len = L, Stride len/stepsize = S
     nrows = ((arr.size - win_len) // step) + 1
@@ -11,6 +27,13 @@ def strided_array(arr, win_len, step):  # Window len = L, Stride len/stepsize =
     return np.lib.stride_tricks.as_strided(arr, shape=(nrows, win_len), strides=(step * n, n))
 
 
+def strided_batch_array(arr, win_len, step):  # arr of shape (batch, samples)
+    nrows = ((arr.shape[1] - win_len) // step) + 1
+    n = arr.strides[1]
+    return np.lib.stride_tricks.as_strided(arr, shape=(arr.shape[0], nrows, win_len),
+                                           strides=(arr.strides[0], step * n, n))
+
+
 def gini(x):
     mad = np.abs(np.subtract.outer(x, x)).mean()
     rmad = mad / np.mean(x)
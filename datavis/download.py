@@ -7,8 +7,10 @@ import click
 import requests
 import logging
 import backoff
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from joblib import Parallel, delayed
 
 
 @click.group()
@@ -32,28 +34,183 @@ def clean(download_str: str):
     return link, output
 
 
-def url_to_file(url, filename, log_failed=True):
-    try:
-        download(url, filename)
-        logging.debug('%s downloaded successfully to %', url, filename)
-    except Exception:
-        logging.exception('Failed to download %s to %s', url, filename)
-        if log_failed:
-            with open('failed.log', 'a') as flog:
-                flog.write('{},{}\n'.format(url, filename))
+def read_links(path: str) -> list:
+    """
+    :param path: file with a curl command per line (and an optional comment header), see cli
+    :return: list of (url, filename) tuples
+    """
+    with open(path, 'r') as fin:
+        lines = fin.read().splitlines()
+    if lines and lines[0].startswith('#'):
+        lines.pop(0)
+    return [clean(s) for s in lines if s.strip()]
+
+
+PART_SUFFIX = '.part'
+# Bytes written at once; at most this much of a part is lost when a connection breaks
+CHUNK_SIZE = 64 * 1024
+
+
+class IncompleteDownloadException(Exception):
+    pass
+
+
+# Errors after which a download is retried (with exponential backoff)
+RETRIED_EXCEPTIONS = (requests.exceptions.Timeout,
+                      requests.exceptions.ConnectionError,
+                      requests.exceptions.ChunkedEncodingError,
+                      IncompleteDownloadException)
+
+
+def content_length(response: requests.Response):
+    """
+    :return: size in bytes of the whole file being downloaded, None if unknown
+    """
+    if response.status_code in (206, 416) and '/' in response.headers.get('Content-Range', ''):
+        total = response.headers['Content-Range'].rsplit('/', 1)[1]
+        return int(total) if total != '*' else None
+    if 'Content-Length' in response.headers and 'Content-Encoding' not in response.headers:
+        return int(response.headers['Content-Length'])
+    return None
+
+
+class Downloader(object):
+    """
+    Downloads files with a pool of threads sharing keep-alive connections of one session, with at most per_host
+    downloads from the same host at a time. Data is written into "<filename>.part", which is continued with an HTTP
+    Range request after an interruption and renamed to filename once its size matches the Content-Length.
+    """
+    def __init__(self, jobs: int = 8, per_host: int = 4, timeout: float = 30, failed_log: str = None):
+        self.jobs = jobs
+        self.per_host = per_host
+        self.timeout = timeout
+        self.failed_log = failed_log
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=jobs, pool_maxsize=per_host)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self._hosts = {}
+        self._lock = threading.Lock()
 
+    def close(self):
+        self.session.close()
 
-@backoff.on_exception(backoff.expo,
-                      (requests.exceptions.Timeout,
-                       requests.exceptions.ConnectionError),
-                      max_time=60)
-def download(url, filename):
-    with requests.get(url=url, timeout=30, stream=True) as request:
-        request.raise_for_status()
-        with open(filename, 'wb') as fh:
-            for chunk in request.iter_content(1024 * 1024):
-                if chunk:
-                    fh.write(chunk)
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _host_limit(self, url: str) -> threading.BoundedSemaphore:
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = threading.BoundedSemaphore(self.per_host)
+            return self._hosts[host]
+
+    @backoff.on_exception(backoff.expo, RETRIED_EXCEPTIONS, max_time=60)
+    def get(self, url: str) -> bytes:
+        """
+        Download a file into memory
+        """
+        with self._host_limit(url), self.session.get(url=url, timeout=self.timeout) as response:
+            response.raise_for_status()
+            expected = content_length(response)
+            data = response.content
+        if expected is not None and len(data) != expected:
+            raise IncompleteDownloadException(f'{url}: received {len(data)} of {expected} bytes')
+        return data
+
+    @backoff.on_exception(backoff.expo, RETRIED_EXCEPTIONS, max_time=60)
+    def download(self, url: str, filename: str):
+        part = filename + PART_SUFFIX
+        offset = os.path.getsize(part) if os.path.isfile(part) else 0
+        headers = {'Range': f'bytes={offset}-'} if offset else {}
+        with self._host_limit(url), self.session.get(url=url, timeout=self.timeout, stream=True,
+                                                     headers=headers) as response:
+            if response.status_code == 416:
+                if content_length(response) == offset:
+                    # Interrupted between the last write and the rename
+                    os.replace(part, filename)
+                    return
+                # The part is not a prefix of the file (e.g. the file changed on the server), start over
+                os.remove(part)
+                raise IncompleteDownloadException(f'Range not satisfiable for {url}, restarting')
+            response.raise_for_status()
+            expected = content_length(response)
+            mode = 'ab' if response.status_code == 206 else 'wb'
+            with open(part, mode) as fh:
+                for chunk in response.iter_content(CHUNK_SIZE):
+                    if chunk:
+                        fh.write(chunk)
+        size = os.path.getsize(part)
+        if expected is not None and size != expected:
+            raise IncompleteDownloadException(f'{url}: received {size} of {expected} bytes')
+        os.replace(part, filename)
+
+    def verify(self, url: str, filename: str) -> bool:
+        """
+        Compare the size of a downloaded file with the Content-Length of the URL. A truncated file is moved to its part
+        file, so that the next download continues it.
+        :return: True if the file is complete or the server does not report its size
+        """
+        with self._host_limit(url):
+            response = self.session.head(url, timeout=self.timeout, allow_redirects=True)
+        response.raise_for_status()
+        expected = content_length(response)
+        if expected is None or os.path.getsize(filename) == expected:
+            return True
+        logging.info('%s is truncated (%d of %d bytes)', filename, os.path.getsize(filename), expected)
+        if os.path.getsize(filename) < expected:
+            os.replace(filename, filename + PART_SUFFIX)
+        else:
+            os.remove(filename)
+        return False
+
+    def _log_failed(self, url: str, filename: str):
+        if self.failed_log is None:
+            return
+        with self._lock, open(self.failed_log, 'a') as flog:
+            flog.write('{},{}\n'.format(url, filename))
+
+    def url_to_file(self, url: str, filename: str) -> bool:
+        try:
+            self.download(url, filename)
+            logging.debug('%s downloaded successfully to %s', url, filename)
+            return True
+        except Exception:
+            logging.exception('Failed to download %s to %s', url, filename)
+            self._log_failed(url, filename)
+            return False
+
+    def _map(self, f, links: list) -> list:
+        with ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            futures = {executor.submit(f, url, filename): (url, filename) for url, filename in links}
+            results = {}
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                results[futures[future]] = future.result()
+        return [results[link] for link in links]
+
+    def fetch(self, links: list) -> list:
+        """
+        Download files concurrently
+        :param links: list of (url, filename) tuples
+        :return: list of (url, filename) tuples that failed
+        """
+        return [link for link, done in zip(links, self._map(self.url_to_file, links)) if not done]
+
+    def incomplete(self, links: list) -> list:
+        """
+        :param links: list of (url, filename) tuples of downloaded files
+        :return: list of (url, filename) tuples of files that are truncated or could not be verified
+        """
+        def check(url, filename):
+            try:
+                return self.verify(url, filename)
+            except Exception:
+                logging.exception('Failed to verify %s', filename)
+                return False
+        return [link for link, complete in zip(links, self._map(check, links)) if not complete]
 
 
 def remove_files_already_downloaded(output_dir: str, output_path_with_link: list) -> list:
@@ -70,43 +227,52 @@ def remove_files_already_downloaded(output_dir: str, output_path_with_link: list
 @click.option("--input", "-in", type=click.Path(exists=True), required=True, help="Path to a directory with audio in WAV format.")
 @click.option("--output", "-out", type=click.Path(exists=False, file_okay=False, writable=True), required=True, help="Output directory.")
 @click.option("--jobs", "-j", type=click.INT, default=8, help="Number of threads to run.", show_default=True)
+@click.option("--per-host", type=click.INT, default=4, help="Maximum number of concurrent downloads from one host.", show_default=True)
 @click.option('--fresh', default=False, is_flag=True, help='Ignore any files that might have been already downloaded and start fresh', show_default=True)
+@click.option('--verify', default=False, is_flag=True, help='Compare the size of already downloaded files with the Content-Length reported by the server and download truncated files again', show_default=True)
 @click.option('--dry', default=False, is_flag=True, help='Dry run. Do not download anythyng, just show how much will be downloaded', show_default=True)
-def file_download(input, output, jobs, fresh, dry):
-    with open(input, 'r') as fin:
-        output_path_with_link = fin.read().splitlines()
+def file_download(input, output, jobs, per_host, fresh, verify, dry):
+    output_path_with_link = read_links(input)
 
-    if output_path_with_link[0].startswith('#'):
-        output_path_with_link.pop(0)
-    output_path_with_link = [clean(s) for s in output_path_with_link]
+    os.makedirs(output, exist_ok=True)
+    with Downloader(jobs=jobs, per_host=per_host, failed_log='failed.log') as downloader:
+        total_files = len(output_path_with_link)
+        remaining = output_path_with_link
+        if not fresh:
+            remaining = remove_files_already_downloaded(output_dir=output, output_path_with_link=output_path_with_link)
+            if verify:
+                remaining_names = set(filename for _, filename in remaining)
+                downloaded = [(url, os.path.join(output, filename)) for url, filename in output_path_with_link
+                              if filename not in remaining_names]
+                truncated = downloader.incomplete(downloaded)
+                remaining += [(url, os.path.basename(filename)) for url, filename in truncated]
+                print(f'{len(truncated)} of {len(downloaded)} downloaded files are incomplete')
 
-    total_files = len(output_path_with_link)
-    remaining_files_no = total_files
-    if not fresh:
-        output_path_with_link = remove_files_already_downloaded(output_dir=output, output_path_with_link=output_path_with_link)
-        remaining_files_no = len(output_path_with_link)
+        if dry:
+            print(f'Number of files to download: {len(remaining)} out of total {total_files}')
+        else:
+            downloader.fetch([(url, os.path.join(output, filename)) for url, filename in remaining])
 
-    if dry:
-        print(f'Number of files to download: {remaining_files_no} out of total {total_files}')
-    else:
-        _ = Parallel(n_jobs=jobs, backend='threading')(
-            delayed(url_to_file)(url=url, filename=os.path.join(output, filename))
-            for url, filename in tqdm(output_path_with_link))
 
-
-@cli.command('resume', help='Resume failed downloads')
+@cli.command('resume', help='Resume failed downloads. Downloads that fail again are kept in the input file.')
 @click.option("--input", "-in", type=click.Path(exists=True), required=True, help="Path to a directory with audio in WAV format.", default='failed.log')
-def resume(input):
+@click.option("--jobs", "-j", type=click.INT, default=8, help="Number of threads to run.", show_default=True)
+@click.option("--per-host", type=click.INT, default=4, help="Maximum number of concurrent downloads from one host.", show_default=True)
+def resume(input, jobs, per_host):
     logging.getLogger('backoff').addHandler(logging.StreamHandler())
 
     with open(input, 'r') as fin:
         files_to_download = fin.read().splitlines()
 
-    files_to_download = [s.split(',') for s in files_to_download]
+    files_to_download = [tuple(s.split(',')) for s in files_to_download if s]
+
+    with Downloader(jobs=jobs, per_host=per_host) as downloader:
+        failed = downloader.fetch(files_to_download)
 
-    for url, filepath in tqdm(files_to_download):
-        url_to_file(url, filepath, log_failed=False)
+    with open(input, 'w') as flog:
+        flog.writelines('{},{}\n'.format(url, filename) for url, filename in failed)
+    print(f'{len(files_to_download) - len(failed)} of {len(files_to_download)} downloaded')
 
 
 if __name__ == '__main__':
-    cli()
\ No newline at end of file
+    cli()
@@ -1,45 +1,497 @@
 import os
 import logging
-import librosa
 import yaml
+import numpy as np
 import pandas as pd
-from joblib import Parallel, delayed
+from datetime import timedelta
+from itertools import chain
+from collections import OrderedDict
+from contextlib import ExitStack
+from concurrent.futures import wait, FIRST_COMPLETED
+from joblib import effective_n_jobs
+from joblib.externals.loky import get_reusable_executor
 from tqdm import tqdm
-from datavis.yaafe_wrapper import YaafeWrapper
-from datavis.bioacoustics import get_bioacoustic_features
-from datavis.audio_io import get_all_waves_generator
+from datavis.yaafe_wrapper import get_yaafe_wrapper
+from datavis.bioacoustics import get_bioacoustic_features, get_bioacoustic_features_batch
+from datavis.audio_io import get_same_shape_batches, extract_datetime_from_filename, load_audio, AudioIOException
+from datavis import spectral
+from datavis.store import FeatureStore, OFFSET_COLUMN
+from datavis.streaming import stream_features
+from datavis.filters import get_band_filter, filter_signal
+from datavis.common import working_dtype
+from datavis.spectral import set_fft_backend, fft_threads, DEFAULT_FFT_BACKEND
+from datavis.shard import in_shard, shard_ledger_path, shard_store_path
+from datavis.admission import Admission
+from datavis.windows import get_windowing, set_windowing, window_bounds
+from datavis.ledger import Ledger, DONE, CSV_OUTPUT
+from datavis.instrumentation import Profiler, ProfileReport, NULL_PROFILER
+from datavis import fingerprints
 
+# Number of completed files whose outcomes are written to the ledger in one transaction
+CHUNK_SIZE = 1000
+# Maximum number of tasks in a unit of work sent to a worker
+MAX_UNIT_TASKS = 64
+# Units of work queued per worker, bounds the memory of the main process on large sites
+UNITS_IN_FLIGHT = 2
 
-def process_audio(path, config):
-    try:
-        y, fs = librosa.load(path, sr=None)
-    except Exception as ex:
-        logging.exception('Failed to load %s', path)
-        return
 
-    try:
-        yaafe = YaafeWrapper(fs=fs, config=config['YAAFE_features'])
+def compute_features(path, config, stream_block: float = None, profiler=NULL_PROFILER):
+    """
+    :return: dictionary with the features of the file, or a list of them per window with windowed results (see
+    windows.py)
+    """
+    if stream_block:
+        if get_windowing(config) is not None:
+            raise ValueError('Windowed results cannot be computed in the streaming mode')
+        with profiler.stage('stream'):
+            return stream_features(path=path, config=config, block_duration=stream_block)
+
+    with profiler.stage('load'):
+        y, fs = load_audio(path)
+    return signal_features(y, fs, config, profiler=profiler)
+
+
+def signal_features(y: np.ndarray, fs: int, config: dict, profiler=NULL_PROFILER):
+    y = y.astype(working_dtype(config), copy=False)
+    sos = get_band_filter(config, fs)
+    if sos is not None:
+        with profiler.stage('filter'):
+            y = filter_signal(y, sos)
+    windowing = get_windowing(config)
+    if windowing is not None:
+        return windowed_features(y, fs, config, *windowing, profiler=profiler)
+    with profiler.stage('yaafe'):
+        yaafe = get_yaafe_wrapper(fs=fs, config=config['YAAFE_features'])
         yaafe_features = yaafe.compute_feature_stats(y)
-        bioacoustic_features = get_bioacoustic_features(y=y, fs=fs, config=config['Bioacoustic_features'])
+    with profiler.stage('bioacoustics'):
+        bioacoustic_features = get_bioacoustic_features(y=y, fs=fs, config=config['Bioacoustic_features'],
+                                                        profiler=profiler)
+    return {**bioacoustic_features, **yaafe_features}
+
+
+def windowed_features(y: np.ndarray, fs: int, config: dict, window: float, hop: float,
+                      profiler=NULL_PROFILER) -> list:
+    """
+    :param y: mono audio
+    :param window: duration of the windows in seconds
+    :param hop: seconds between the starts of consecutive windows
+    :return: list of dictionaries with the offset (in seconds) and features of every window
+    """
+    bounds = window_bounds(len(y), fs, window, hop)
+    with profiler.stage('yaafe'):
+        yaafe = get_yaafe_wrapper(fs=fs, config=config['YAAFE_features'])
+        yaafe_features = yaafe.compute_window_stats(y, bounds)
+    rows = []
+    with profiler.stage('bioacoustics'):
+        parent = spectral.SpectralScope(y, fs)
+        for (start, stop), yaafe_row in zip(bounds, yaafe_features):
+            scope = spectral.WindowScope(parent, start, stop)
+            bioacoustic_features = get_bioacoustic_features(y=scope.sig, fs=fs, config=config['Bioacoustic_features'],
+                                                            profiler=profiler, scope=scope)
+            row = OrderedDict([(OFFSET_COLUMN, start / fs)])
+            row.update(bioacoustic_features)
+            row.update(yaafe_row)
+            rows.append(row)
+    return rows
+
+
+def extract_features(path, config, stream_block: float = None):
+    try:
+        return compute_features(path=path, config=config, stream_block=stream_block)
     except Exception as ex:
         logging.exception('Failed to process %s', path)
         return
 
+
+def extract_features_batch(paths: list, config: dict, profiler=NULL_PROFILER) -> list:
+    """
+    Compute features of files with the same sampling rate and length, bioacoustic features are vectorised over the batch
+    :return: list of (features, error) tuples in the order of paths; features are None and error is set on failure
+    """
+    signals, loaded, errors = [], [], {}
+    with profiler.stage('load'):
+        for path in paths:
+            try:
+                y, fs = load_audio(path)
+            except Exception as ex:
+                logging.exception('Failed to load %s', path)
+                errors[path] = repr(ex)
+                continue
+            signals.append(y)
+            loaded.append(path)
+
+    results = {}
+    if signals:
+        try:
+            Y = np.stack(signals).astype(working_dtype(config), copy=False)
+            sos = get_band_filter(config, fs)
+            if sos is not None:
+                with profiler.stage('filter'):
+                    Y = filter_signal(Y, sos)
+            with profiler.stage('yaafe'):
+                yaafe = get_yaafe_wrapper(fs=fs, config=config['YAAFE_features'])
+                yaafe_features = [yaafe.compute_feature_stats(y) for y in Y]
+            with profiler.stage('bioacoustics'):
+                bioacoustic_features = get_bioacoustic_features_batch(Y=Y, fs=fs,
+                                                                      config=config['Bioacoustic_features'])
+            results = {path: {**bio, **yf} for path, bio, yf in zip(loaded, bioacoustic_features, yaafe_features)}
+        except Exception as ex:
+            logging.exception('Failed to process batch %s', loaded)
+            errors.update({path: repr(ex) for path in loaded})
+    return [(results.get(path), errors.get(path)) for path in paths]
+
+
+def extract_task(paths: list, config: dict, stream_block: float = None, profiler=NULL_PROFILER) -> list:
+    """
+    :return: list of (features, error) tuples in the order of paths
+    """
+    if len(paths) > 1 and not stream_block and get_windowing(config) is None:
+        return extract_features_batch(paths=paths, config=config, profiler=profiler)
+    outcomes = []
+    for path in paths:
+        try:
+            outcomes.append((compute_features(path=path, config=config, stream_block=stream_block,
+                                              profiler=profiler), None))
+        except Exception as ex:
+            logging.exception('Failed to process %s', path)
+            outcomes.append((None, repr(ex)))
+    return outcomes
+
+
+def save_csv(path, features):
+    """
+    :param features: dictionary with the features of the file, or a list of them per window
+    """
     output_path = os.path.splitext(path)[0] + '.csv'
-    pd.DataFrame(data={**bioacoustic_features, **yaafe_features}, index=[0]).to_csv(output_path, index=False)
+    if isinstance(features, list):
+        pd.DataFrame(features).to_csv(output_path, index=False)
+    else:
+        pd.DataFrame(data=features, index=[0]).to_csv(output_path, index=False)
+
 
+def load_csv(path):
+    """
+    :return: features saved by save_csv for the audio file, None if there are none
+    """
+    csv_path = os.path.splitext(path)[0] + '.csv'
+    if not os.path.isfile(csv_path):
+        return None
+    return pd.read_csv(csv_path).iloc[0].to_dict()
+
+
+def update_task(paths: list, config: dict, updates: dict, stream_block: float = None, profiler=NULL_PROFILER) -> list:
+    """
+    Recompute only some features of files with results and merge them into the existing results. Files without results
+    are computed in full.
+    :param updates: dictionary path -> keys of the features to recompute
+    :return: list of (features, error) tuples in the order of paths
+    """
+    current = fingerprints.feature_fingerprints(config)
+    previous = {path: load_csv(path) for path in paths}
+    partial = [path for path in paths if previous[path] is not None]
+    full = [path for path in paths if previous[path] is None]
+    outcomes = dict(zip(full, extract_task(paths=full, config=config, stream_block=stream_block, profiler=profiler)))
+
+    keys = sorted(set(key for path in partial for key in updates[path]))
+    if keys:
+        selected = fingerprints.select_features(config, keys)
+        computed = extract_task(paths=partial, config=selected, stream_block=stream_block, profiler=profiler)
+    else:
+        computed = [({}, None)] * len(partial)
+    for path, (features, error) in zip(partial, computed):
+        if features is not None:
+            features = fingerprints.merge_features(previous[path], features, current, keys)
+        outcomes[path] = (features, error)
+    return [outcomes[path] for path in paths]
+
+
+def process_audio(path, config, stream_block: float = None):
+    features = extract_features(path=path, config=config, stream_block=stream_block)
+    if features is not None:
+        save_csv(path, features)
+
+
+def order_features(features, keys: list):
+    """
+    Order the columns of the features of a file (see fingerprints.order_columns), the offset first in windowed rows
+    """
+    if not isinstance(features, list):
+        return fingerprints.order_columns(features, keys)
+    rows = [fingerprints.order_columns(row, keys) for row in features]
+    for row in rows:
+        row.move_to_end(OFFSET_COLUMN, last=False)
+    return rows
+
+
+def process_task(paths: list, config: dict, stream_block: float = None, to_csv: bool = True,
+                 profile: bool = False, updates: dict = None) -> tuple:
+    """
+    Compute features of a task in a worker. With to_csv, results are saved next to the input files and only the
+    errors travel back to the main process.
+    :param profile: time the stages of the task
+    :param updates: dictionary path -> keys of the only features to recompute for files with results (see update_task)
+    :return: list of (features, error) tuples in the order of paths and the profile record (None if not profiled)
+    """
+    profiler = Profiler() if profile else NULL_PROFILER
+    if updates:
+        outcomes = update_task(paths=paths, config=config, updates=updates, stream_block=stream_block,
+                               profiler=profiler)
+    else:
+        outcomes = extract_task(paths=paths, config=config, stream_block=stream_block, profiler=profiler)
+    keys = list(fingerprints.feature_fingerprints(config))
+    outcomes = [(order_features(features, keys) if features is not None else None, error)
+                for features, error in outcomes]
+    if not to_csv:
+        return outcomes, profiler.record(paths)
+    saved = []
+    with profiler.stage('save'):
+        for path, (features, error) in zip(paths, outcomes):
+            if features is not None:
+                try:
+                    save_csv(path, features)
+                except Exception as ex:
+                    logging.exception('Failed to save results of %s', path)
+                    error = repr(ex)
+            saved.append((None, error))
+    return saved, profiler.record(paths)
 
-def wav_dir_to_features(directory: str, config: str, n_jobs: int, resume: bool):
+
+def get_tasks(files: list, batch_size: int, sizes: dict) -> list:
+    """
+    Split files into tasks: single files, or batches of same-shape files when batch_size > 1
+    :param sizes: dictionary of paths to file sizes, tasks are ordered largest first
+    :return: list of tasks (lists of paths)
+    """
+    tasks = get_same_shape_batches(files, batch_size) if batch_size > 1 else [[path] for path in files]
+    return sorted(tasks, key=lambda paths: sum(sizes.get(path, 0) for path in paths), reverse=True)
+
+
+def get_work_units(tasks: list, sizes: dict, n_workers: int, max_tasks: int = MAX_UNIT_TASKS):
+    """
+    Group tasks into units of work sent to a worker at once (guided self-scheduling). Every unit takes about
+    1 / (2 * n_workers) of the bytes not yet assigned, so with tasks ordered largest first a long recording forms a unit
+    on its own, short ones are grouped, and units shrink towards the end of the run to balance the tail.
+    :return: generator of units (lists of tasks)
+    """
+    task_sizes = [sum(sizes.get(path, 0) for path in paths) for paths in tasks]
+    remaining = sum(task_sizes)
+    unit, unit_size = [], 0
+    for paths, size in zip(tasks, task_sizes):
+        unit.append(paths)
+        unit_size += size
+        if unit_size >= remaining / (2 * n_workers) or len(unit) >= max_tasks:
+            yield unit
+            remaining -= unit_size
+            unit, unit_size = [], 0
+    if unit:
+        yield unit
+
+
+# Arguments of process_task shared by all tasks of a run, set once per worker by _init_worker
+_WORKER_ARGS = {}
+
+
+def _init_worker(config: dict, stream_block: float, to_csv: bool, profile: bool,
+                 fft: tuple = (DEFAULT_FFT_BACKEND, 1)):
+    """
+    :param fft: FFT backend and threads per transform of the worker (see spectral.set_fft_backend)
+    """
+    set_fft_backend(*fft)
+    _WORKER_ARGS.update(config=config, stream_block=stream_block, to_csv=to_csv, profile=profile)
+
+
+def process_unit(unit: list, updates: dict, stream_block: float = None) -> list:
+    """
+    :param updates: dictionary path -> keys of the features to recompute of the files of the unit updated in place
+    :param stream_block: stream the files of the unit in blocks of this many seconds instead of the mode of the run
+    :return: list of process_task results in the order of the tasks of the unit
+    """
+    args = dict(_WORKER_ARGS, stream_block=stream_block) if stream_block else _WORKER_ARGS
+    return [process_task(paths=paths, updates={path: updates[path] for path in paths if path in updates}, **args)
+            for paths in unit]
+
+
+def execute_units(units, n_workers: int, initargs: tuple, updates: dict, admission: Admission = None):
+    """
+    Run units of work in a pool of n_workers processes initialised with initargs, keeping a bounded number of units in
+    flight. With a single worker units run in the main process.
+    :param updates: dictionary path -> keys of the features to recompute of files updated in place
+    :param admission: memory budget of the units in flight (see admission.py), None for no limit
+    :return: generator of (unit, results) tuples in the order of completion
+    """
+    def unit_updates(unit):
+        return {path: updates[path] for paths in unit for path in paths if path in updates}
+
+    def unit_stream_block(unit):
+        return admission.unit_stream_block(unit) if admission is not None else None
+
+    if n_workers == 1:
+        _init_worker(*initargs)
+        for unit in units:
+            yield unit, process_unit(unit, unit_updates(unit), unit_stream_block(unit))
+        return
+
+    executor = get_reusable_executor(max_workers=n_workers, initializer=_init_worker, initargs=initargs)
+    units = iter(units)
+    pending, waiting = {}, None
+    while True:
+        while len(pending) < UNITS_IN_FLIGHT * n_workers:
+            waiting = waiting or next(units, None)
+            if waiting is None:
+                break
+            cost = admission.cost(waiting) if admission is not None else 0
+            if admission is not None:
+                if not admission.fits(cost):
+                    break
+                admission.acquire(cost)
+            future = executor.submit(process_unit, waiting, unit_updates(waiting), unit_stream_block(waiting))
+            pending[future] = (waiting, cost)
+            waiting = None
+        if not pending:
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            unit, cost = pending.pop(future)
+            if admission is not None:
+                admission.release(cost)
+            yield unit, future.result()
+
+
+def add_to_store(store: FeatureStore, path, features):
+    """
+    :param features: dictionary with the features of the file, or a list of them per window stored at the start of
+    the recording plus their offset
+    """
+    try:
+        timestamp = extract_datetime_from_filename(os.path.basename(str(path)))
+    except AudioIOException as ex:
+        logging.exception('Skipping %s', path)
+        return repr(ex)
+    if not isinstance(features, list):
+        store.append(timestamp=timestamp, path=str(path), features=features)
+        return
+    for row in features:
+        row = OrderedDict(row)
+        offset = row.pop(OFFSET_COLUMN)
+        store.append(timestamp=timestamp + timedelta(seconds=offset), path=str(path), features=row)
+
+
+def collect_results(unit: list, results: list, store: FeatureStore = None, report: ProfileReport = None) -> list:
+    """
+    Write the rows returned for a unit of work into the store (if any) and its profile records into the report (if any)
+    :return: list of (path, error) outcomes of the files of the unit
+    """
+    outcomes = []
+    for paths, (task_outcomes, record) in zip(unit, results):
+        for path, (features, error) in zip(paths, task_outcomes):
+            if store is not None and features is not None:
+                error = add_to_store(store, path, features)
+            outcomes.append((path, error))
+        if report is not None:
+            report.add(record)
+    return outcomes
+
+
+def run_tasks(tasks: list, sizes: dict, config: dict, n_jobs: int, ledger: Ledger, store: FeatureStore = None,
+              stream_block: float = None, report: ProfileReport = None, updates: dict = None,
+              fft: str = DEFAULT_FFT_BACKEND, threads: int = None, max_memory: int = None):
+    """
+    Dispatch tasks to the workers in units of work; as units complete the main process writes the returned rows into
+    the store (if any), the profile records into the report (if any) and the outcome and feature fingerprints of every
+    file into the ledger
+    :param updates: dictionary path -> keys of the only features to recompute of files with results
+    :param fft: FFT backend of the workers
+    :param threads: FFT threads per worker, by default the cores are shared among the workers
+    :param max_memory: budget in bytes of the estimated memory of the files in flight, None for no limit
+    """
+    n_workers = effective_n_jobs(n_jobs)
+    total = sum(len(paths) for paths in tasks)
+    admission = Admission(max_memory, config, stream_block) if max_memory else None
+    if admission is not None:
+        tasks, streamed = admission.split(tasks)
+        units = chain(get_work_units(tasks, sizes, n_workers), ([paths] for paths in streamed))
+    else:
+        units = get_work_units(tasks, sizes, n_workers)
+    initargs = (config, stream_block, store is None, report is not None, (fft, fft_threads(n_workers, threads)))
+    current = fingerprints.dumps(fingerprints.feature_fingerprints(config))
+    outcomes = []
+    with tqdm(total=total) as progress:
+        try:
+            for unit, results in execute_units(units, n_workers, initargs, updates or {}, admission):
+                outcomes.extend(collect_results(unit, results, store, report))
+                progress.update(sum(len(paths) for paths in unit))
+                if len(outcomes) >= CHUNK_SIZE:
+                    ledger.mark(outcomes, fingerprints=current)
+                    outcomes = []
+        finally:
+            ledger.mark(outcomes, fingerprints=current)
+
+
+def retarget_ledger(ledger: Ledger, store: str = None):
+    """
+    Reset the state of the files in the ledger to the results the output of this run holds when the previous run wrote
+    to another output, e.g. processing into a store the files that were processed into CSVs (see Ledger.retarget)
+    :param store: path of the store of the run, None for CSVs next to the audio
+    """
+    def processed():
+        if store is None:
+            return [path for path in ledger.files() if os.path.isfile(os.path.splitext(path)[0] + '.csv')]
+        return FeatureStore(store).processed_files()
+
+    if ledger.retarget(CSV_OUTPUT if store is None else os.path.abspath(store), processed):
+        logging.info('Results go to another output than in the previous run: %d files already have results in it',
+                     len(ledger.done()))
+
+
+def wav_dir_to_features(directory: str, config: str, n_jobs: int, resume: bool, store: str = None,
+                        stream_block: float = None, batch_size: int = 1, profile: str = None,
+                        fft: str = DEFAULT_FFT_BACKEND, fft_threads: int = None, shard: tuple = None,
+                        max_memory: int = None, window: float = None, hop: float = None):
+    """
+    :param shard: (K, N) to process only the files of shard K of N (see shard.py), with a ledger and store of the shard
+    :param max_memory: budget in bytes of the estimated memory of the files in flight (see admission.py)
+    :param window: compute features of windows of this many seconds of every file (see windows.py), overrides the
+    Window section of the config
+    :param hop: seconds between the starts of consecutive windows, window by default
+    """
     with open(config, 'r') as f:
         config = yaml.load(f, Loader=yaml.FullLoader)
-    files, total = get_all_waves_generator(directory=directory, resume=resume)
+    if window is not None:
+        config = set_windowing(config, window, hop)
+    if stream_block and get_windowing(config) is not None:
+        raise ValueError('Windowed results cannot be computed in the streaming mode, drop --stream-block')
 
-    if n_jobs == 1:
-        for wav in tqdm(files):
-            process_audio(path=wav, config=config)
+    if shard is None:
+        ledger = Ledger(directory)
     else:
-        _ = Parallel(n_jobs=n_jobs, backend='loky')(
-            delayed(process_audio)(path=path, config=config)
-            for path in tqdm(files, total=total))
-
+        ledger = Ledger(directory, path=shard_ledger_path(directory, shard), select=lambda path: in_shard(path, shard))
+        store = shard_store_path(store, shard) if store is not None else None
+    with ledger:
+        ledger.scan()
+        retarget_ledger(ledger, store)
+        updates = {}
+        if resume and store is None:
+            # Files with results computed with another config are updated in place: only their outdated features
+            # are recomputed, except in windowed results, which are recomputed in full
+            current = fingerprints.feature_fingerprints(config)
+            outdated = ledger.outdated(fingerprints.dumps(current))
+            files = sorted(outdated)
+            if get_windowing(config) is None:
+                updates = {path: fingerprints.stale_features(current, stored)
+                           for path, stored in outdated.items() if stored is not None}
+        else:
+            files = ledger.files(pending_only=resume)
+        if resume:
+            counts = ledger.counts()
+            logging.info('Resuming processing')
+            logging.info('%d / %d completed. Remaining: %d (%d with outdated features only)', counts.get(DONE, 0),
+                         sum(counts.values()), len(files), len(updates))
+        sizes = ledger.sizes()
+        tasks = get_tasks(files, batch_size, sizes)
 
+        with ExitStack() as stack:
+            feature_store = stack.enter_context(FeatureStore(store)) if store is not None else None
+            report = stack.enter_context(ProfileReport(profile)) if profile is not None else None
+            run_tasks(tasks, sizes, config=config, n_jobs=n_jobs, ledger=ledger, store=feature_store,
+                      stream_block=stream_block, report=report, updates=updates, fft=fft, threads=fft_threads,
+                      max_memory=max_memory)
@@ -1,27 +1,83 @@
 import numpy as np
+from functools import lru_cache
 from typing import Optional
-from scipy.signal import butter, lfilter
+from scipy.signal import butter, sosfilt
 
+# Section of the config with the band-limiting filter applied to the audio before feature extraction
+FILTER_SECTION = 'Filter'
+# Samples filtered at once, bounds the float64 intermediates of sosfilt
+FILTER_BLOCK = 2 ** 18
 
-def _butter_highpass(cutoff, fs, order=6):
-    nyq = 0.5 * fs
-    high = cutoff / nyq
-    b, a = butter(order, high, btype='highpass')
-    return b, a
 
-def _butter_lowpass(cutoff, fs, order=6):
+@lru_cache(maxsize=None)
+def butter_sos(fs: int, lowcut: Optional[float], highcut: Optional[float], order: int = 6) -> Optional[np.ndarray]:
+    """
+    Butterworth filter in second-order sections, designed once per (fs, band, order)
+    :param fs: sampling rate [Hz]
+    :param lowcut: cut everything below this frequency [Hz]
+    :param highcut: cut everything above this frequency [Hz]
+    :param order: order of the Butterworth filter
+    :return: array (n_sections, 6), None if the band is the whole spectrum
+    """
     nyq = 0.5 * fs
-    low = cutoff / nyq
-    b, a = butter(order, low, btype='lowpass')
-    return b, a
+    if lowcut == 0:
+        lowcut = None
+    if highcut is not None and highcut >= nyq:
+        highcut = None
+
+    if lowcut and highcut:
+        sos = butter(order, [lowcut / nyq, highcut / nyq], btype='band', output='sos')
+    elif lowcut:
+        sos = butter(order, lowcut / nyq, btype='highpass', output='sos')
+    elif highcut:
+        sos = butter(order, highcut / nyq, btype='lowpass', output='sos')
+    else:
+        return None
+    return sos
 
 
-def _butter_bandpass(lowcut, highcut, fs, order=6):
-    nyq = 0.5 * fs
-    low = lowcut / nyq
-    high = highcut / nyq
-    b, a = butter(order, [low, high], btype='band')
-    return b, a
+class SosFilter(object):
+    """
+    Applies second-order sections to consecutive blocks of a signal, carrying the filter state from block to block, so
+    that filtering blocks gives the same result as filtering the whole signal
+    """
+    def __init__(self, sos: np.ndarray):
+        self.sos = sos
+        self.zi = None
+
+    def __call__(self, block: np.ndarray) -> np.ndarray:
+        """
+        :param block: next samples of the signal, along the last axis (leading axes are a batch of signals)
+        :return: filtered block in the dtype of the block
+        """
+        if self.zi is None:
+            self.zi = np.zeros((len(self.sos),) + block.shape[:-1] + (2,))
+        y, self.zi = sosfilt(self.sos, block, axis=-1, zi=self.zi)
+        return y.astype(block.dtype, copy=False)
+
+
+def filter_signal(signal: np.ndarray, sos: np.ndarray, block: int = FILTER_BLOCK) -> np.ndarray:
+    """
+    Filter a signal (or a batch of signals along the last axis) block by block
+    :return: filtered signal in the dtype of the signal
+    """
+    band = SosFilter(sos)
+    y = np.empty(signal.shape, dtype=signal.dtype)
+    for start in range(0, signal.shape[-1], block):
+        y[..., start:start + block] = band(signal[..., start:start + block])
+    return y
+
+
+def get_band_filter(config: dict, fs: int) -> Optional[np.ndarray]:
+    """
+    :param config: config dictionary
+    :return: second-order sections of the filter of the config for the sampling rate, None if there is none
+    """
+    section = config.get(FILTER_SECTION)
+    if not section or not section['use']:
+        return None
+    params = section['params']
+    return butter_sos(fs, params.get('lowcut'), params.get('highcut'), params.get('order', 6))
 
 
 def frequency_filter(signal: np.ndarray, fs: int, lowcut: Optional[int], highcut: Optional[int], order=6) -> np.ndarray:
@@ -32,20 +88,9 @@ def frequency_filter(signal: np.ndarray, fs: int, lowcut: Optional[int], highcut
     :param lowcut: cut everything below this frequency [Hz]
     :param highcut: cut everything above this frequency [Hz]
     :param order: order of the Butterworth filter
-    :return: flitered signal (ndarray float32)
+    :return: flitered signal in the dtype of the signal
     """
-    if lowcut == 0:
-        lowcut = None
-    if highcut == fs // 2:
-        highcut = None
-
-    if lowcut and highcut:
-        b, a = _butter_bandpass(lowcut, highcut, fs, order)
-    elif lowcut and not highcut:
-        b, a = _butter_highpass(lowcut, fs, order)
-    elif highcut and not lowcut:
-        b, a = _butter_lowpass(highcut, fs, order)
-    else:
+    sos = butter_sos(fs, lowcut, highcut, order)
+    if sos is None:
         return signal
-    y = lfilter(b, a, signal).astype('float32')
-    return y
\ No newline at end of file
+    return filter_signal(signal, sos)
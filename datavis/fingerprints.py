@@ -0,0 +1,123 @@
+"""
+Fingerprints of the configuration of every feature, used to recompute only the features whose configuration or code
+changed since a file was processed. Features are identified by "<config section>/<feature name>" keys.
+"""
+
+import copy
+import json
+import hashlib
+from collections import OrderedDict
+from datavis.bioacoustics import FEATURE_COLUMNS
+from datavis.common import working_dtype, DEFAULT_PRECISION, PRECISION_KEY
+from datavis.filters import FILTER_SECTION
+from datavis.windows import WINDOW_SECTION
+
+# Version of the feature code, part of every fingerprint. Bump it when a change alters computed values, or bump a
+# single feature in FEATURE_VERSIONS.
+CODE_VERSION = 1
+FEATURE_VERSIONS = {}
+
+BIOACOUSTIC_SECTION = 'Bioacoustic_features'
+YAAFE_SECTION = 'YAAFE_features'
+KEY_SEPARATOR = '/'
+
+
+def _digest(obj) -> str:
+    return hashlib.md5(json.dumps(obj, sort_keys=True).encode('utf8')).hexdigest()
+
+
+def feature_key(section: str, name: str) -> str:
+    return section + KEY_SEPARATOR + name
+
+
+def feature_fingerprints(config: dict) -> OrderedDict:
+    """
+    :param config: config dictionary
+    :return: ordered dictionary feature key -> fingerprint of the config of the feature and the code version;
+    bioacoustic features in the order of their output columns, followed by YAAFE features in the order of the config
+    """
+    fingerprints = OrderedDict()
+    # The filter changes the input of every feature, windows their rows and the precision their values; they are left
+    # out while off (or at the default precision), which keeps the fingerprints of configs written before they existed
+    preprocessing = [config[section] for section in (FILTER_SECTION, WINDOW_SECTION)
+                     if config.get(section, {}).get('use')]
+    precision = working_dtype(config).name
+    if precision != DEFAULT_PRECISION:
+        preprocessing.append({PRECISION_KEY: precision})
+    bioacoustic = config[BIOACOUSTIC_SECTION]
+    for name in FEATURE_COLUMNS:
+        if name in bioacoustic:
+            key = feature_key(BIOACOUSTIC_SECTION, name)
+            fingerprints[key] = _digest([bioacoustic[name], CODE_VERSION, FEATURE_VERSIONS.get(key)] + preprocessing)
+    for name, feature_config in config[YAAFE_SECTION].items():
+        key = feature_key(YAAFE_SECTION, name)
+        fingerprints[key] = _digest([feature_config, CODE_VERSION, FEATURE_VERSIONS.get(key)] + preprocessing)
+    return fingerprints
+
+
+def dumps(fingerprints: dict) -> str:
+    return json.dumps(fingerprints, sort_keys=True)
+
+
+def stale_features(fingerprints: dict, stored: str) -> list:
+    """
+    :param fingerprints: fingerprints of the current config
+    :param stored: fingerprints the results were computed with (as returned by dumps), None if unknown
+    :return: keys of features that are missing or outdated in the results
+    """
+    stored = json.loads(stored) if stored else {}
+    return [key for key, fingerprint in fingerprints.items() if stored.get(key) != fingerprint]
+
+
+def select_features(config: dict, keys: list) -> dict:
+    """
+    :return: copy of the config with all features but those in keys turned off
+    """
+    config = copy.deepcopy(config)
+    for section in (BIOACOUSTIC_SECTION, YAAFE_SECTION):
+        for name, feature_config in config[section].items():
+            if feature_key(section, name) not in keys:
+                feature_config['use'] = False
+    return config
+
+
+def column_feature(column: str, keys: list):
+    """
+    :param keys: feature keys of the config
+    :return: key of the feature an output column belongs to, None if unknown
+    """
+    for name, columns in FEATURE_COLUMNS.items():
+        if column in columns:
+            return feature_key(BIOACOUSTIC_SECTION, name)
+    for key in keys:
+        section, name = key.split(KEY_SEPARATOR, 1)
+        # YAAFE features give either a single column or "<name>_<statistic>" columns
+        if section == YAAFE_SECTION and (column == name or column.startswith(name + '_')):
+            return key
+    return None
+
+
+def merge_features(old: dict, new: dict, fingerprints: dict, updated: list) -> dict:
+    """
+    Merge recomputed features into existing results
+    :param old: existing results of a file
+    :param new: results computed with only the updated features turned on
+    :param fingerprints: fingerprints of the current config
+    :param updated: keys of the recomputed features
+    :return: results with the columns of updated features from new and the remaining columns of current features from
+    old, in the order of the fingerprints
+    """
+    keys = list(fingerprints)
+    merged = [(column, value) for column, value in old.items() if column_feature(column, keys) not in updated]
+    merged += [(column, value) for column, value in new.items() if column_feature(column, keys) in updated]
+    return order_columns(OrderedDict((column, value) for column, value in merged
+                                     if column_feature(column, keys) is not None), keys)
+
+
+def order_columns(features: dict, keys: list) -> OrderedDict:
+    """
+    Order result columns by the feature they belong to (in the order of keys), keeping the order within a feature
+    """
+    position = {key: i for i, key in enumerate(keys)}
+    columns = sorted(enumerate(features), key=lambda c: (position.get(column_feature(c[1], keys), len(keys)), c[0]))
+    return OrderedDict((column, features[column]) for _, column in columns)
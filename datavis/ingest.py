@@ -0,0 +1,123 @@
+"""
+Ingest of per-file result CSVs (as written by "a2f" without --store) into a feature store.
+
+The CSVs of a chunk are read by threads, their timestamps parsed from the file names in one vectorised pass and their
+rows parsed by one read_csv per distinct header straight into float32 columns. The store keeps a high-water mark of
+the ingested CSVs (path and modification time), so a later sync reads only CSVs that are new or changed since; rows
+of changed CSVs are replaced. CSVs deleted from the tree keep their rows in the store.
+"""
+
+import os
+import logging
+import numpy as np
+import pandas as pd
+from io import StringIO
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+from datavis.store import FeatureStore, TIME_COLUMN, FILE_COLUMN, OFFSET_COLUMN
+
+INGESTED = '_ingested.parquet'
+TIMESTAMP_PATTERN = r'(\d{4}-\d{2}-\d{2}T\d{2}-\d{2}-\d{2})'
+TIMESTAMP_FORMAT = '%Y-%m-%dT%H-%M-%S'
+
+
+def scan_csvs(directory: str) -> pd.Series:
+    """
+    :return: modification times of the CSVs in directory (recursively), indexed by path
+    """
+    mtimes = {}
+    stack = [directory]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.endswith('.csv'):
+                    mtimes[entry.path] = entry.stat().st_mtime
+    return pd.Series(mtimes, dtype=np.float64)
+
+
+def parse_timestamps(paths) -> pd.Series:
+    """
+    Vectorised extract_datetime_from_filename
+    :return: timestamps of the files, NaT where the name has none
+    """
+    names = pd.Series(list(paths)).str.rsplit('/', n=1).str[-1]
+    return pd.to_datetime(names.str.extract(TIMESTAMP_PATTERN, expand=False), format=TIMESTAMP_FORMAT)
+
+
+def _read_head(path: str) -> tuple:
+    """
+    :return: header and result lines of a CSV: the first line, or all lines of windowed results (see windows.py)
+    """
+    with open(path) as fo:
+        header = fo.readline()
+        if not header.startswith(OFFSET_COLUMN + ','):
+            return header, [fo.readline()]
+        return header, fo.readlines()
+
+
+def read_csv_rows(paths: list, threads: int = 16) -> pd.DataFrame:
+    """
+    Read result CSVs into one DataFrame with timestamp, file (the audio file the CSV belongs to) and float32 feature
+    columns. CSVs without a timestamp in the name or a result line are skipped. Rows of windowed results are stamped
+    with the start of their window.
+    """
+    timestamps = parse_timestamps(paths)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        heads = list(executor.map(_read_head, paths))
+    groups = OrderedDict()
+    for i, (header, file_lines) in enumerate(heads):
+        file_lines = [line if line.endswith('\n') else line + '\n' for line in file_lines if line.strip()]
+        if pd.isnull(timestamps[i]) or not file_lines:
+            logging.warning('Skipping %s', paths[i])
+            continue
+        rows, lines = groups.setdefault(header, ([], []))
+        rows.extend([i] * len(file_lines))
+        lines.extend(file_lines)
+    frames = []
+    for header, (rows, lines) in groups.items():
+        # offsets stay float64, float32 seconds lose milliseconds after a few hours
+        dtype = {column: np.float64 if column == OFFSET_COLUMN else np.float32 for column in header.strip().split(',')}
+        df = pd.read_csv(StringIO(header + ''.join(lines)), dtype=dtype)
+        df.insert(0, FILE_COLUMN, [os.path.splitext(paths[i])[0] + '.wav' for i in rows])
+        times = timestamps.values[rows]
+        if OFFSET_COLUMN in df:
+            times = times + pd.to_timedelta(df.pop(OFFSET_COLUMN).values, unit='s').values
+        df.insert(0, TIME_COLUMN, times)
+        frames.append(df)
+    return pd.concat(frames, sort=False) if frames else pd.DataFrame(columns=[TIME_COLUMN, FILE_COLUMN])
+
+
+def ingest_results(directory: str, store_path: str, chunk_files: int = 50000, threads: int = 16) -> int:
+    """
+    Ingest the result CSVs of directory into the store, or sync the store with CSVs new or changed since the last
+    ingest
+    :param directory: directory with result CSVs
+    :param store_path: path to the feature store, created if missing
+    :param chunk_files: number of CSVs read and written at a time; the high-water mark is saved after every chunk
+    :return: number of ingested CSVs
+    """
+    store = FeatureStore(store_path)
+    ingested_path = os.path.join(store_path, INGESTED)
+    ingested = pd.read_parquet(ingested_path)['mtime'] if os.path.isfile(ingested_path) else pd.Series(dtype=np.float64)
+    mtimes = scan_csvs(directory)
+    known = mtimes.index.intersection(ingested.index)
+    changed = known[mtimes[known].values != ingested[known].values]
+    todo = mtimes.index.difference(ingested.index).union(changed)
+    logging.info(f'{len(mtimes)} CSVs in {directory}: {len(todo)} to ingest, of which {len(changed)} changed')
+    if len(changed):
+        files = set(os.path.splitext(path)[0] + '.wav' for path in changed)
+        store.remove_files(files, days=set(parse_timestamps(changed).dropna().dt.strftime('%Y-%m-%d')))
+
+    todo = list(todo)
+    for start in tqdm(range(0, len(todo), chunk_files)):
+        paths = todo[start:start + chunk_files]
+        rows = read_csv_rows(paths, threads)
+        if len(rows):
+            store.write_frame(rows)
+        ingested = pd.concat([ingested.drop(paths, errors='ignore'), mtimes[paths]])
+        pd.DataFrame({'mtime': ingested}).to_parquet(ingested_path + '.tmp')
+        os.replace(ingested_path + '.tmp', ingested_path)
+    return len(todo)
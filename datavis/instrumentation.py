@@ -0,0 +1,161 @@
+"""
+Optional per-stage instrumentation of feature extraction. Workers time the stages of every task with a Profiler and
+return the record with the results; the main process aggregates the records in a ProfileReport. When profiling is off
+the NULL_PROFILER is used, whose stages are no-ops.
+
+Memory of a stage is the change of the current RSS of the worker between its start and end (memory the stage kept,
+negative if it freed memory), read from /proc and 0 where it is not available. Transient allocations freed within the
+stage are not seen; the peak RSS of a task is the high-water mark of the worker process over its lifetime, not of the
+task.
+"""
+
+import sys
+import json
+import time
+import logging
+from collections import OrderedDict
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Nested stages are named "<stage>/<substage>", e.g. "bioacoustics/Acoustic_Complexity_Index"
+STAGE_SEPARATOR = '/'
+
+
+def current_rss_mb() -> float:
+    try:
+        with open('/proc/self/statm') as fo:
+            pages = int(fo.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return 0.0
+    return pages * (resource.getpagesize() if resource is not None else 4096) / 1024 ** 2
+
+
+def peak_rss_mb() -> float:
+    """
+    :return: high-water mark of the RSS of the process since it started
+    """
+    if resource is None:
+        return 0.0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024
+
+
+class _Stage(object):
+    def __init__(self, profiler, name: str):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        self.rss = current_rss_mb()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        record = self.profiler.stages.setdefault(self.name, {'wall': 0.0, 'cpu': 0.0, 'rss_delta_mb': 0.0})
+        record['wall'] += time.perf_counter() - self.wall
+        record['cpu'] += time.process_time() - self.cpu
+        record['rss_delta_mb'] += current_rss_mb() - self.rss
+
+
+class _NullStage(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class Profiler(object):
+    """
+    Wall time, CPU time and RSS change of the named stages of one task
+    """
+    def __init__(self):
+        self.stages = OrderedDict()
+
+    def stage(self, name: str) -> _Stage:
+        return _Stage(self, name)
+
+    def record(self, paths: list) -> dict:
+        return {'files': [str(path) for path in paths], 'stages': self.stages, 'process_peak_rss_mb': peak_rss_mb()}
+
+
+class NullProfiler(object):
+    _stage = _NullStage()
+
+    def stage(self, name: str) -> _NullStage:
+        return self._stage
+
+    def record(self, paths: list):
+        return None
+
+
+NULL_PROFILER = NullProfiler()
+
+
+class ProfileReport(object):
+    """
+    Aggregates the records of the workers in the main process: appends them as JSON lines to the metrics file every
+    flush_interval seconds and logs a summary table per stage and the slowest tasks when closed
+    """
+    def __init__(self, path: str, flush_interval: float = 30, slowest: int = 10):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.slowest = slowest
+        self.buffer = []
+        self.last_flush = time.time()
+        self.totals = OrderedDict()
+        self.tasks = []
+        self.process_peak_rss_mb = 0.0
+        open(path, 'w').close()
+
+    def add(self, record: dict):
+        if record is None:
+            return
+        self.buffer.append(record)
+        for name, stage in record['stages'].items():
+            total = self.totals.setdefault(name, {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'rss_delta_mb': 0.0})
+            total['count'] += 1
+            total['wall'] += stage['wall']
+            total['cpu'] += stage['cpu']
+            total['rss_delta_mb'] = max(total['rss_delta_mb'], stage['rss_delta_mb'])
+        self.process_peak_rss_mb = max(self.process_peak_rss_mb, record['process_peak_rss_mb'])
+        top_level = {name: stage['wall'] for name, stage in record['stages'].items() if STAGE_SEPARATOR not in name}
+        if top_level:
+            slowest_stage = max(top_level, key=top_level.get)
+            self.tasks.append((sum(top_level.values()), slowest_stage, top_level[slowest_stage], record['files']))
+            self.tasks = sorted(self.tasks, reverse=True)[:self.slowest]
+        if time.time() - self.last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        with open(self.path, 'a') as fo:
+            for record in self.buffer:
+                fo.write(json.dumps(record) + '\n')
+        self.buffer = []
+        self.last_flush = time.time()
+
+    def summary(self) -> str:
+        lines = [f'{"stage":<45} {"count":>7} {"wall [s]":>10} {"mean wall":>10} {"mean cpu":>10} '
+                 f'{"max RSS delta [MB]":>19}']
+        for name, total in self.totals.items():
+            lines.append(f'{name:<45} {total["count"]:>7} {total["wall"]:>10.2f} {total["wall"] / total["count"]:>10.4f} '
+                         f'{total["cpu"] / total["count"]:>10.4f} {total["rss_delta_mb"]:>19.1f}')
+        lines.append(f'Peak RSS of the workers (high-water mark of the processes): {self.process_peak_rss_mb:.1f} MB')
+        lines.append('Slowest tasks:')
+        for wall, stage, stage_wall, files in self.tasks:
+            lines.append(f'{wall:>10.2f}s  slowest stage {stage} ({stage_wall:.2f}s)  {", ".join(files)}')
+        return '\n'.join(lines)
+
+    def close(self):
+        self.flush()
+        logging.info('Profile of %d stages written to %s\n%s', len(self.totals), self.path, self.summary())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,272 @@
+import os
+import time
+import struct
+import sqlite3
+import logging
+from datavis.audio_io import probe_wav, AudioIOException
+
+LEDGER_NAME = '.datavis_ledger.sqlite'
+# Output of runs writing a CSV next to every file, other outputs are the absolute paths of feature stores
+CSV_OUTPUT = 'csv'
+
+PENDING = 'pending'
+DONE = 'done'
+FAILED = 'failed'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    directory TEXT NOT NULL,
+    size INTEGER,
+    mtime REAL,
+    duration REAL,
+    state TEXT NOT NULL,
+    error TEXT,
+    updated REAL,
+    fingerprints TEXT
+);
+CREATE INDEX IF NOT EXISTS files_state ON files (state);
+CREATE INDEX IF NOT EXISTS files_directory ON files (directory);
+CREATE TABLE IF NOT EXISTS directories (
+    path TEXT PRIMARY KEY,
+    parent TEXT,
+    mtime REAL
+);
+CREATE INDEX IF NOT EXISTS directories_parent ON directories (parent);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+
+class Ledger(object):
+    """
+    On-disk record of the WAV files under a directory and of their processing state. Paths are stored relative to the
+    directory. A rescan only lists directories whose mtime changed since the previous scan.
+    :param path: path of the ledger, LEDGER_NAME in the directory by default
+    :param select: function of the relative path of a WAV file, only files it returns True for are recorded
+    """
+    def __init__(self, directory: str, path: str = None, select=None):
+        self.directory = directory
+        self.path = path or os.path.join(directory, LEDGER_NAME)
+        self.select = select
+        self.connection = sqlite3.connect(self.path)
+        self.connection.executescript(_SCHEMA)
+        columns = [row[1] for row in self.connection.execute('PRAGMA table_info(files)')]
+        if 'fingerprints' not in columns:
+            with self.connection:
+                self.connection.execute('ALTER TABLE files ADD COLUMN fingerprints TEXT')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _relative(self, path) -> str:
+        return os.path.relpath(str(path), self.directory)
+
+    def _absolute(self, path: str) -> str:
+        return os.path.join(self.directory, path)
+
+    def scan(self, verbose: bool = True):
+        """
+        Bring the ledger up to date with the directory. New files are pending, unless a CSV with results already exists
+        next to them and results go to CSVs (see retarget); files whose size or mtime changed become pending again (and
+        lose their feature fingerprints); removed files are forgotten.
+        :param verbose: log the duration of the scan
+        """
+        start = time.time()
+        with self.connection:
+            self._scan_directory('', parent=None)
+        if verbose:
+            logging.info('Scanned %s in %.2fs', self.directory, time.time() - start)
+
+    def _scan_directory(self, directory: str, parent):
+        mtime = os.stat(self._absolute(directory)).st_mtime
+        row = self.connection.execute('SELECT mtime FROM directories WHERE path = ?', (directory,)).fetchone()
+        if row is not None and row[0] == mtime:
+            subdirectories = [r[0] for r in self.connection.execute(
+                'SELECT path FROM directories WHERE parent = ?', (directory,))]
+        else:
+            subdirectories, waves, results = [], {}, set()
+            for entry in os.scandir(self._absolute(directory)):
+                path = os.path.join(directory, entry.name)
+                if entry.is_dir():
+                    subdirectories.append(path)
+                elif entry.name.endswith('.wav'):
+                    waves[path] = entry.stat()
+                elif entry.name.endswith('.csv'):
+                    results.add(os.path.splitext(path)[0])
+            self._sync_files(directory, waves, results)
+            self._forget_removed_directories(directory, subdirectories)
+            self.connection.execute('INSERT OR REPLACE INTO directories (path, parent, mtime) VALUES (?, ?, ?)',
+                                    (directory, parent, mtime))
+        for subdirectory in subdirectories:
+            self._scan_directory(subdirectory, parent=directory)
+
+    def _sync_files(self, directory: str, waves: dict, results: set):
+        known = {path: (size, mtime) for path, size, mtime in self.connection.execute(
+            'SELECT path, size, mtime FROM files WHERE directory = ?', (directory,))}
+        rows = []
+        csv_output = self.output() in (None, CSV_OUTPUT)
+        if self.select is not None:
+            waves = {path: stat for path, stat in waves.items() if self.select(path)}
+        for path, stat in waves.items():
+            if known.get(path) == (stat.st_size, stat.st_mtime):
+                continue
+            state = DONE if csv_output and path not in known and os.path.splitext(path)[0] in results else PENDING
+            try:
+                duration = probe_wav(self._absolute(path)).duration
+            except (AudioIOException, OSError, struct.error):
+                duration = None
+            rows.append((path, directory, stat.st_size, stat.st_mtime, duration, state))
+        self.connection.executemany('INSERT OR REPLACE INTO files (path, directory, size, mtime, duration, state) '
+                                    'VALUES (?, ?, ?, ?, ?, ?)', rows)
+        removed = [(path,) for path in known if path not in waves]
+        self.connection.executemany('DELETE FROM files WHERE path = ?', removed)
+
+    def _forget_removed_directories(self, directory: str, subdirectories: list):
+        known = [r[0] for r in self.connection.execute('SELECT path FROM directories WHERE parent = ?', (directory,))]
+        for path in set(known) - set(subdirectories):
+            prefix = path + os.sep
+            self.connection.execute('DELETE FROM files WHERE directory = ? OR substr(directory, 1, ?) = ?',
+                                    (path, len(prefix), prefix))
+            self.connection.execute('DELETE FROM directories WHERE path = ? OR substr(path, 1, ?) = ?',
+                                    (path, len(prefix), prefix))
+
+    def files(self, pending_only: bool = False) -> list:
+        """
+        :param pending_only: return only files that have not been processed successfully
+        :return: sorted list of paths (including the directory)
+        """
+        if pending_only:
+            query = 'SELECT path FROM files WHERE state != ? ORDER BY path'
+            rows = self.connection.execute(query, (DONE,))
+        else:
+            rows = self.connection.execute('SELECT path FROM files ORDER BY path')
+        return [self._absolute(r[0]) for r in rows]
+
+    def pending(self) -> list:
+        """
+        :return: sorted list of paths (including the directory) of the files not processed yet, failed files excluded
+        """
+        rows = self.connection.execute('SELECT path FROM files WHERE state = ? ORDER BY path', (PENDING,))
+        return [self._absolute(r[0]) for r in rows]
+
+    def refresh(self, paths: list):
+        """
+        Record the current size, mtime and duration of files. A scan only lists directories whose mtime changed, which
+        appending to a file does not change, so files still being written when they were scanned are refreshed
+        before they are processed.
+        :param paths: paths including the directory
+        """
+        rows = []
+        for path in paths:
+            stat = os.stat(path)
+            try:
+                duration = probe_wav(path).duration
+            except (AudioIOException, OSError, struct.error):
+                duration = None
+            rows.append((stat.st_size, stat.st_mtime, duration, self._relative(path)))
+        with self.connection:
+            self.connection.executemany('UPDATE files SET size = ?, mtime = ?, duration = ? WHERE path = ?', rows)
+
+    def retry_changed(self) -> list:
+        """
+        Make failed files whose size or mtime changed since they were recorded pending again, e.g. recordings whose
+        header was still incomplete when watch mode processed them
+        :return: sorted list of paths (including the directory) of the files made pending
+        """
+        changed = []
+        for path, size, mtime in self.connection.execute('SELECT path, size, mtime FROM files WHERE state = ? '
+                                                         'ORDER BY path', (FAILED,)).fetchall():
+            try:
+                stat = os.stat(self._absolute(path))
+            except FileNotFoundError:
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                changed.append(path)
+        with self.connection:
+            self.connection.executemany('UPDATE files SET state = ?, error = NULL WHERE path = ?',
+                                        [(PENDING, path) for path in changed])
+        return [self._absolute(path) for path in changed]
+
+    def done(self) -> list:
+        """
+        :return: sorted list of paths (including the directory) of the files processed successfully
+        """
+        rows = self.connection.execute('SELECT path FROM files WHERE state = ? ORDER BY path', (DONE,))
+        return [self._absolute(r[0]) for r in rows]
+
+    def outdated(self, fingerprints: str) -> dict:
+        """
+        Processed files without fingerprints (processed before the ledger recorded them, or found in a new output by
+        retarget) are taken as computed with the current config and stamped with its fingerprints, so archives processed
+        by earlier versions keep resuming
+        :param fingerprints: feature fingerprints of the current config (see fingerprints.dumps)
+        :return: dictionary path (including the directory) -> stored fingerprints (None if unknown) of the files that
+        are not processed or whose results were computed with other fingerprints
+        """
+        with self.connection:
+            self.connection.execute('UPDATE files SET fingerprints = ? WHERE state = ? AND fingerprints IS NULL',
+                                    (fingerprints, DONE))
+        rows = self.connection.execute('SELECT path, fingerprints FROM files WHERE state != ? OR fingerprints != ?',
+                                       (DONE, fingerprints))
+        return {self._absolute(path): stored for path, stored in rows}
+
+    def output(self):
+        """
+        :return: output of the previous run (CSV_OUTPUT or the path of a store), None if unknown
+        """
+        row = self.connection.execute("SELECT value FROM meta WHERE key = 'output'").fetchone()
+        return row[0] if row is not None else None
+
+    def retarget(self, output: str, processed) -> bool:
+        """
+        Record the output of a run. When it differs from the output of the previous run, the state of every file is
+        reset to what the new output holds: files with results in it are done (without fingerprints), the others
+        pending. The output of ledgers written before outputs were recorded is unknown: their state is kept for CSVs,
+        which the scan of new files already follows, and reset for a store.
+        :param output: CSV_OUTPUT or the absolute path of a store
+        :param processed: function returning the paths (including the directory) of the files with results in output
+        :return: whether the state was reset
+        """
+        previous = self.output()
+        reset = previous != output and (previous is not None or output != CSV_OUTPUT)
+        with self.connection:
+            if reset:
+                done = set(processed())
+                rows = [(DONE if self._absolute(path) in done else PENDING, path)
+                        for path, in self.connection.execute('SELECT path FROM files').fetchall()]
+                self.connection.executemany('UPDATE files SET state = ?, error = NULL, fingerprints = NULL '
+                                            'WHERE path = ?', rows)
+            self.connection.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('output', ?)", (output,))
+        return reset
+
+    def sizes(self) -> dict:
+        """
+        :return: dictionary of paths (including the directory) to file sizes in bytes
+        """
+        return {self._absolute(path): size for path, size in self.connection.execute('SELECT path, size FROM files')}
+
+    def counts(self) -> dict:
+        return dict(self.connection.execute('SELECT state, COUNT(*) FROM files GROUP BY state'))
+
+    def mark(self, outcomes: list, fingerprints: str = None):
+        """
+        Record the outcome of processed files in one transaction
+        :param outcomes: list of (path, error) tuples, error is None for files processed successfully
+        :param fingerprints: feature fingerprints the results of successful files were computed with
+        """
+        now = time.time()
+        done = [(DONE, now, fingerprints, self._relative(path)) for path, error in outcomes if error is None]
+        failed = [(FAILED, error, now, self._relative(path)) for path, error in outcomes if error is not None]
+        with self.connection:
+            self.connection.executemany('UPDATE files SET state = ?, error = NULL, updated = ?, fingerprints = ? '
+                                        'WHERE path = ?', done)
+            self.connection.executemany('UPDATE files SET state = ?, error = ?, updated = ? WHERE path = ?', failed)
@@ -0,0 +1,115 @@
+"""
+Download to features: audio is downloaded into memory and handed to the feature workers without landing on disk.
+Download threads and feature processes run together; a bounded number of buffers (downloading, queued or being
+processed) keeps memory in check and stalls downloads while the workers catch up.
+"""
+
+import os
+import queue
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from joblib import effective_n_jobs
+from joblib.externals.loky import get_reusable_executor
+from tqdm import tqdm
+from datavis import fingerprints
+from datavis.audio_io import load_audio_bytes
+from datavis.download import Downloader
+from datavis.features import signal_features, order_features, save_csv, add_to_store
+from datavis.store import FeatureStore
+from datavis.spectral import set_fft_backend, fft_threads, DEFAULT_FFT_BACKEND
+
+# Config of the feature workers, set once per worker by _init_worker
+_WORKER_ARGS = {}
+
+
+def _init_worker(config: dict, fft: tuple = (DEFAULT_FFT_BACKEND, 1)):
+    set_fft_backend(*fft)
+    _WORKER_ARGS.update(config=config, keys=list(fingerprints.feature_fingerprints(config)))
+
+
+def buffer_features(data: bytes, name: str) -> tuple:
+    """
+    Compute features of an audio file held in memory in a worker
+    :return: features (a list of rows per window with windowing on) and error (None on success)
+    """
+    try:
+        y, fs = load_audio_bytes(data, name)
+        features = signal_features(y, fs, _WORKER_ARGS['config'])
+        return order_features(features, _WORKER_ARGS['keys']), None
+    except Exception as ex:
+        logging.exception('Failed to process %s', name)
+        return None, repr(ex)
+
+
+def links_to_features(links: list, output: str, config: dict, n_jobs: int, download_jobs: int = 8, per_host: int = 4,
+                      buffers: int = 16, store: FeatureStore = None, keep_audio: bool = False,
+                      failed_log: str = 'failed.log', fft: str = DEFAULT_FFT_BACKEND, threads: int = None) -> int:
+    """
+    Download files and compute their features, writing a CSV per file into output (or rows into the store)
+    :param links: list of (url, filename) tuples, filenames relative to output
+    :param buffers: maximum number of audio files held in memory
+    :param keep_audio: also save the downloaded audio into output
+    :param failed_log: file the (url, path) of failed files are appended to, so that "download.py resume" can fetch them
+    :param fft: FFT backend of the workers
+    :param threads: FFT threads per worker, by default the cores are shared among the workers
+    :return: number of failed files
+    """
+    for directory in set(os.path.dirname(os.path.join(output, filename)) for _, filename in links):
+        os.makedirs(directory, exist_ok=True)
+    slots = threading.BoundedSemaphore(buffers)
+    done = queue.Queue()
+    n_workers = effective_n_jobs(n_jobs)
+    executor = get_reusable_executor(max_workers=n_workers, initializer=_init_worker,
+                                     initargs=(config, (fft, fft_threads(n_workers, threads))))
+    downloader = Downloader(jobs=download_jobs, per_host=per_host)
+
+    def fetch(url, path):
+        slots.acquire()
+        try:
+            data = downloader.get(url)
+            if keep_audio:
+                with open(path, 'wb') as fh:
+                    fh.write(data)
+            future = executor.submit(buffer_features, data, path)
+        except Exception as ex:
+            logging.exception('Failed to download %s', url)
+            slots.release()
+            done.put((url, path, None, repr(ex)))
+            return
+
+        def finished(f):
+            slots.release()
+            features, error = f.result() if f.exception() is None else (None, repr(f.exception()))
+            done.put((url, path, features, error))
+        future.add_done_callback(finished)
+
+    failed = 0
+    with downloader, ThreadPoolExecutor(max_workers=download_jobs) as downloads, tqdm(total=len(links)) as progress:
+        for url, filename in links:
+            downloads.submit(fetch, url, os.path.join(output, filename))
+        for _ in range(len(links)):
+            url, path, features, error = done.get()
+            if features is not None:
+                try:
+                    error = add_to_store(store, path, features) if store is not None else save_csv(path, features)
+                except Exception as ex:
+                    logging.exception('Failed to save results of %s', path)
+                    error = repr(ex)
+            if error is not None:
+                failed += 1
+                with open(failed_log, 'a') as flog:
+                    flog.write('{},{}\n'.format(url, path))
+            progress.update(1)
+    return failed
+
+
+def remove_processed(links: list, output: str, store: FeatureStore = None) -> list:
+    """
+    :return: links of files without results in output (or in the store)
+    """
+    if store is not None:
+        processed = store.processed_files()
+        return [(url, filename) for url, filename in links if os.path.join(output, filename) not in processed]
+    return [(url, filename) for url, filename in links
+            if not os.path.isfile(os.path.splitext(os.path.join(output, filename))[0] + '.csv')]
@@ -0,0 +1,70 @@
+from collections import Counter, OrderedDict
+from datavis import spectral
+
+
+def _spectrogram_deps(config: dict, fs: int) -> list:
+    return [spectral.spectrogram_key(**config['spectrogram'])]
+
+
+def _segmented_deps(config: dict, fs: int) -> list:
+    params = config['params']
+    fs_max = min(params['fs_max'], fs / 2)
+    win_len = spectral.segmented_win_len(fs, params['fs_step'], fs_max)
+    return [spectral.spectrogram_key(win_len=win_len, hop=win_len),
+            spectral.segmented_key(params['fs_step'], fs_max, params['db_threshold'])]
+
+
+def _envelope_deps(config: dict, fs: int) -> list:
+    return [spectral.ENVELOPE_KEY]
+
+
+def _no_deps(config: dict, fs: int) -> list:
+    return []
+
+
+# Bioacoustic features in the order they are evaluated, with the spectral intermediates each of them consumes
+FEATURE_DEPENDENCIES = OrderedDict([
+    ('Acoustic_activity', _no_deps),
+    ('Acoustic_Complexity_Index', _spectrogram_deps),
+    ('Acoustic_Diversity_Index', _segmented_deps),
+    ('Bioacoustic_Index', _spectrogram_deps),
+    ('Spectral_entropy', _spectrogram_deps),
+    ('Temporal_entropy', _envelope_deps),
+    ('Acoustic_Evenness_Index', _segmented_deps),
+    ('Formants', _no_deps),
+])
+
+
+def is_enabled(config: dict) -> bool:
+    return config.get('use', True)
+
+
+def build_plan(config: dict, fs: int) -> OrderedDict:
+    """
+    Turn the enabled bioacoustic features into a dependency graph of spectral intermediates
+    :param config: 'Bioacoustic_features' section of the config
+    :param fs: sampling (in Hz)
+    :return: ordered dictionary feature name -> list of intermediate keys it consumes
+    """
+    plan = OrderedDict()
+    for name, dependencies in FEATURE_DEPENDENCIES.items():
+        if name in config and is_enabled(config[name]):
+            plan[name] = dependencies(config[name], fs)
+    return plan
+
+
+class PlanExecution(object):
+    """
+    Tracks the consumers of every intermediate while a plan is evaluated over one file and releases intermediates from
+    the scope as soon as their last consumer is done, so peak memory holds only the spectrograms still needed.
+    """
+    def __init__(self, plan: OrderedDict, scope: spectral.SpectralScope):
+        self.plan = plan
+        self.scope = scope
+        self.pending = Counter(key for keys in plan.values() for key in keys)
+
+    def done(self, feature: str):
+        for key in self.plan.get(feature, []):
+            self.pending[key] -= 1
+            if self.pending[key] <= 0:
+                self.scope.release(key)
@@ -0,0 +1,244 @@
+"""
+Multi-resolution feature pyramid: features pre-aggregated into time bins of several sizes (levels), so that
+visualisations read a few thousand bins instead of every result row.
+
+Each level keeps the mean, min, max and count (of non-missing values) of every feature per bin and is written as
+Parquet files partitioned by month (<results>/_pyramid/<minutes>min/YYYY-MM.parquet). The finest level is aggregated
+from the result rows, the coarser ones from the finest level. A manifest of the aggregated result files (path,
+modification time and timestamp) makes updates incremental: only bins containing new, changed or removed files are
+recomputed. Levels must divide a day so that bins never span two months. Windowed results (a2f --window) have several
+rows per file and are refused.
+"""
+
+import os
+import json
+import logging
+import pandas as pd
+from pathlib import Path
+from datavis.audio_io import extract_datetime_from_filename, read_result_files, get_result_header
+from datavis.store import pa, is_store, read_store, list_files, OFFSET_COLUMN
+
+PYRAMID_DIR = '_pyramid'
+MANIFEST = 'files.parquet'
+META = 'pyramid.json'
+DEFAULT_LEVELS = [1, 10, 60, 1440]
+STATS = ['mean', 'min', 'max', 'count']
+# Separates feature name and statistic in the column names of a level, e.g. "SNR:mean"
+STAT_SEPARATOR = ':'
+MINUTES_PER_DAY = 1440
+
+
+class PyramidException(Exception):
+    pass
+
+
+def pyramid_path(directory: str) -> str:
+    return os.path.join(directory, PYRAMID_DIR)
+
+
+def has_pyramid(directory: str) -> bool:
+    return os.path.isfile(os.path.join(pyramid_path(directory), META))
+
+
+def pyramid_levels(directory: str) -> list:
+    """
+    :return: bin sizes of the pyramid levels in minutes, empty if the directory has no pyramid
+    """
+    if not has_pyramid(directory):
+        return []
+    with open(os.path.join(pyramid_path(directory), META)) as fo:
+        return json.load(fo)['levels']
+
+
+def nearest_level(levels: list, aggregation: int):
+    """
+    :return: coarsest level whose bins nest exactly into bins of aggregation minutes, None if there is none
+    """
+    divisors = [level for level in levels if aggregation % level == 0]
+    return max(divisors) if divisors else None
+
+
+def list_results(directory: str) -> pd.DataFrame:
+    """
+    :return: DataFrame indexed by path of the result files in directory (or source files in a store) with their
+    modification time (of the Parquet files holding their rows in a store) and timestamp, and for a store their number
+    of rows
+    """
+    if is_store(directory):
+        return list_files(directory)
+    paths = [str(path) for path in Path(directory).rglob('*.csv')]
+    return pd.DataFrame({'mtime': [os.path.getmtime(path) for path in paths],
+                         'timestamp': [extract_datetime_from_filename(os.path.basename(path)) for path in paths]},
+                        index=paths, columns=['mtime', 'timestamp'])
+
+
+def _windowed(directory: str, results: pd.DataFrame, paths) -> list:
+    """
+    :return: the paths among paths whose results have a row per window rather than a row per file
+    """
+    if is_store(directory):
+        return list(paths[results.loc[paths, 'rows'].values > 1])
+    return [path for path in paths if get_result_header(path).startswith(OFFSET_COLUMN + ',')]
+
+
+def _read_rows(directory: str, paths: list) -> pd.DataFrame:
+    if is_store(directory):
+        return read_store(directory, files=set(paths))
+    return read_result_files(paths)
+
+
+def aggregate(df: pd.DataFrame, minutes: int) -> pd.DataFrame:
+    """
+    Aggregate result rows into bins
+    :param df: timestamp-indexed features
+    :return: DataFrame indexed by bin start with feature:stat columns
+    """
+    groups = df.groupby(df.index.floor(f'{minutes}T'))
+    stats = pd.concat([groups.mean(), groups.min(), groups.max(), groups.count()], axis=1, keys=STATS)
+    return _flatten(stats)
+
+
+def combine(stats: pd.DataFrame, minutes: int) -> pd.DataFrame:
+    """
+    Aggregate the bins of a level into coarser bins
+    :param stats: level with feature:stat columns
+    :return: DataFrame indexed by bin start with feature:stat columns
+    """
+    stats = _unflatten(stats)
+    bins = stats.index.floor(f'{minutes}T')
+    count = stats['count'].groupby(bins).sum()
+    total = (stats['mean'] * stats['count']).groupby(bins).sum()
+    combined = pd.concat([total / count.where(count > 0), stats['min'].groupby(bins).min(),
+                          stats['max'].groupby(bins).max(), count], axis=1, keys=STATS)
+    return _flatten(combined)
+
+
+def mean_resample(stats: pd.DataFrame, aggregation: int) -> pd.DataFrame:
+    """
+    Resample a level to mean features in bins of aggregation minutes, the same as resampling the result rows
+    (with bins empty of data being NaN) provided that the level bins nest into the new bins
+    :param stats: level with feature:stat columns
+    :return: timestamp-indexed mean features
+    """
+    stats = _unflatten(stats)
+    rule = f'{aggregation}T'
+    total = (stats['mean'] * stats['count']).resample(rule).sum()
+    count = stats['count'].resample(rule).sum()
+    return total / count.where(count > 0)
+
+
+def _flatten(stats: pd.DataFrame) -> pd.DataFrame:
+    features = list(stats['mean'].columns)
+    stats = stats.reindex(columns=[(stat, feature) for feature in features for stat in STATS])
+    stats.columns = [feature + STAT_SEPARATOR + stat for stat, feature in stats.columns]
+    return stats
+
+
+def _unflatten(stats: pd.DataFrame) -> pd.DataFrame:
+    stats = stats.copy()
+    stats.columns = pd.MultiIndex.from_tuples([tuple(reversed(column.rsplit(STAT_SEPARATOR, 1)))
+                                               for column in stats.columns])
+    stats['count'] = stats['count'].fillna(0)
+    return stats
+
+
+def _level_dir(directory: str, level: int) -> str:
+    return os.path.join(pyramid_path(directory), f'{level}min')
+
+
+def _month(timestamp) -> str:
+    return timestamp.strftime('%Y-%m')
+
+
+def _read_months(directory: str, level: int, months) -> pd.DataFrame:
+    frames = [pd.read_parquet(os.path.join(_level_dir(directory, level), month + '.parquet'))
+              for month in sorted(months)
+              if os.path.isfile(os.path.join(_level_dir(directory, level), month + '.parquet'))]
+    return pd.concat(frames, sort=False) if frames else pd.DataFrame()
+
+
+def _write_months(directory: str, level: int, stats: pd.DataFrame, months):
+    os.makedirs(_level_dir(directory, level), exist_ok=True)
+    for month in months:
+        path = os.path.join(_level_dir(directory, level), month + '.parquet')
+        part = stats[stats.index.strftime('%Y-%m') == month] if len(stats) else stats
+        if len(part):
+            part.to_parquet(path + '.tmp')
+            os.replace(path + '.tmp', path)
+        elif os.path.isfile(path):
+            os.remove(path)
+
+
+def update_pyramid(directory: str, levels: list = None) -> int:
+    """
+    Build the pyramid of a results directory (or feature store), or bring it up to date with the results
+    :param directory: directory with result CSVs or a feature store
+    :param levels: bin sizes in minutes, the levels of an existing pyramid (or DEFAULT_LEVELS) if None
+    :return: number of result files aggregated
+    """
+    if pa is None:
+        raise PyramidException('The pyramid requires pyarrow. Install it with "conda install pyarrow".')
+    levels = sorted(levels or pyramid_levels(directory) or DEFAULT_LEVELS)
+    if any(MINUTES_PER_DAY % level for level in levels):
+        raise PyramidException(f'Pyramid levels must divide a day ({MINUTES_PER_DAY} minutes), got {levels}')
+    path = pyramid_path(directory)
+    results = list_results(directory)
+    if pyramid_levels(directory) == levels:
+        manifest = pd.read_parquet(os.path.join(path, MANIFEST))
+    else:
+        manifest = pd.DataFrame(columns=results.columns)
+        for level in set(pyramid_levels(directory)) | set(levels):
+            _write_months(directory, level, pd.DataFrame(), _existing_months(directory, level))
+
+    known = results.index.intersection(manifest.index)
+    changed = results.index.difference(manifest.index).union(
+        known[results.loc[known, 'mtime'].values != manifest.loc[known, 'mtime'].values])
+    removed = manifest.index.difference(results.index)
+    dirty = pd.DatetimeIndex(list(results.loc[changed, 'timestamp']) + list(manifest.loc[removed, 'timestamp']))
+    if len(dirty) == 0:
+        return 0
+    windowed = _windowed(directory, results, changed)
+    if windowed:
+        raise PyramidException(f'{len(windowed)} result files have a row per window (a2f --window), e.g. '
+                               f'{windowed[0]}: the pyramid expects one row per file')
+
+    base = levels[0]
+    dirty_bins = dirty.floor(f'{base}T').unique()
+    months = set(_month(timestamp) for timestamp in dirty_bins)
+    timestamps = pd.DatetimeIndex(results['timestamp'])
+    rows = _read_rows(directory, list(results.index[timestamps.floor(f'{base}T').isin(dirty_bins)]))
+    logging.info(f'Updating pyramid of {directory} with {len(changed)} new or changed and {len(removed)} removed '
+                 f'files ({len(rows)} rows)')
+
+    stats = _read_months(directory, base, months)
+    if len(stats):
+        stats = stats[~stats.index.isin(dirty_bins)]
+    stats = pd.concat([stats, aggregate(rows, base)], sort=False).sort_index() if len(rows) else stats
+    _write_months(directory, base, stats, months)
+    for level in levels[1:]:
+        level_bins = dirty.floor(f'{level}T').unique()
+        coarse = _read_months(directory, level, months)
+        if len(coarse):
+            coarse = coarse[~coarse.index.isin(level_bins)]
+        if len(stats):
+            fine = stats[stats.index.floor(f'{level}T').isin(level_bins)]
+            coarse = pd.concat([coarse, combine(fine, level)], sort=False).sort_index()
+        _write_months(directory, level, coarse, months)
+
+    results.to_parquet(os.path.join(path, MANIFEST + '.tmp'))
+    os.replace(os.path.join(path, MANIFEST + '.tmp'), os.path.join(path, MANIFEST))
+    with open(os.path.join(path, META), 'w') as fo:
+        json.dump({'levels': levels}, fo)
+    return len(changed)
+
+
+def _existing_months(directory: str, level: int) -> list:
+    return [os.path.splitext(name)[0] for name in os.listdir(_level_dir(directory, level))
+            if name.endswith('.parquet')] if os.path.isdir(_level_dir(directory, level)) else []
+
+
+def read_level(directory: str, level: int) -> pd.DataFrame:
+    """
+    :return: all bins of a pyramid level, indexed by bin start with feature:stat columns
+    """
+    return _read_months(directory, level, _existing_months(directory, level)).sort_index()
@@ -0,0 +1,136 @@
+"""
+Sharding of a2f over several nodes sharing a filesystem. "a2f --shard K/N" processes only the recordings whose path
+relative to the input directory hashes to shard K of N, so N nodes (or processes) split a directory into disjoint
+subsets without coordinating. Every shard keeps its own ledger next to the default one and, with --store, writes its
+own store inside the store directory (in a directory starting with "_", which readers of the store skip). "merge"
+checks the shard ledgers for files that no shard processed or that several shards processed and combines the shard
+outputs into one time-sorted store, by default the store directory itself.
+"""
+
+import os
+import re
+import glob
+import hashlib
+import logging
+import pandas as pd
+from collections import defaultdict
+from datavis.ledger import Ledger
+from datavis.store import FeatureStore, read_rows, FILE_COLUMN, TIME_COLUMN, PARTITION_COLUMN
+from datavis.ingest import ingest_results
+
+SHARD_LEDGER = '.datavis_ledger.shard-{}-of-{}.sqlite'
+SHARD_LEDGER_PATTERN = re.compile(r'\.datavis_ledger\.shard-(\d+)-of-(\d+)\.sqlite$')
+SHARD_STORE = '_shard-{}-of-{}'
+
+
+def parse_shard(text: str) -> tuple:
+    """
+    :param text: "K/N", shard K (from 1) of N
+    :return: tuple (K, N)
+    """
+    match = re.fullmatch(r'\s*(\d+)\s*/\s*(\d+)\s*', text)
+    if match is None:
+        raise ValueError(f'Shard must be K/N, got {text}')
+    k, n = int(match.group(1)), int(match.group(2))
+    if not 1 <= k <= n:
+        raise ValueError(f'Shard K/N must have 1 <= K <= N, got {text}')
+    return k, n
+
+
+def shard_index(relative_path: str, n: int) -> int:
+    """
+    Shard of a file by a hash of its path relative to the input directory, the same on every node and Python process
+    :return: shard from 1 to n
+    """
+    digest = hashlib.md5(relative_path.replace(os.sep, '/').encode('utf8')).digest()
+    return int.from_bytes(digest[:8], 'big') % n + 1
+
+
+def in_shard(relative_path: str, shard: tuple) -> bool:
+    k, n = shard
+    return shard_index(relative_path, n) == k
+
+
+def shard_ledger_path(directory: str, shard: tuple) -> str:
+    return os.path.join(directory, SHARD_LEDGER.format(*shard))
+
+
+def shard_store_path(store: str, shard: tuple) -> str:
+    return os.path.join(store, SHARD_STORE.format(*shard))
+
+
+def find_shards(directory: str) -> list:
+    """
+    :return: sorted list of the (K, N) shards with a ledger in directory
+    """
+    shards = []
+    for path in glob.glob(os.path.join(glob.escape(directory), '.datavis_ledger.shard-*.sqlite')):
+        match = SHARD_LEDGER_PATTERN.search(path)
+        if match is not None:
+            shards.append((int(match.group(1)), int(match.group(2))))
+    return sorted(shards)
+
+
+def list_waves(directory: str) -> set:
+    """
+    :return: paths of the WAV files under directory, relative to it
+    """
+    waves = set()
+    for root, _, names in os.walk(directory):
+        waves.update(os.path.relpath(os.path.join(root, name), directory) for name in names if name.endswith('.wav'))
+    return waves
+
+
+def check_shards(directory: str) -> dict:
+    """
+    Compare the files processed by the shards (according to their ledgers) with the WAV files of directory
+    :return: dictionary with the shards found, the number of files, the missing files (processed by no shard, e.g.
+    failed or in a shard that did not run) and the duplicated files (processed by several shards, e.g. after changing
+    N), all sorted and relative to directory
+    """
+    shards = find_shards(directory)
+    processed = defaultdict(list)
+    for shard in shards:
+        with Ledger(directory, path=shard_ledger_path(directory, shard)) as ledger:
+            for path in ledger.done():
+                processed[os.path.relpath(path, directory)].append(shard)
+    for n in sorted(set(n for _, n in shards)):
+        absent = [str(k) for k in range(1, n + 1) if (k, n) not in shards]
+        if absent:
+            logging.warning(f'No ledger of shards {", ".join(absent)} of {n} in {directory}')
+    waves = list_waves(directory)
+    return {'shards': shards,
+            'files': len(waves),
+            'missing': sorted(waves - set(processed)),
+            'duplicated': sorted(path for path, owners in processed.items() if len(owners) > 1)}
+
+
+def merge_shards(directory: str, output: str, store: str = None) -> dict:
+    """
+    Combine the outputs of the shards of directory into one store, time-sorted and partitioned by day
+    :param directory: input directory of the shards
+    :param output: path of the merged store
+    :param store: store directory the shards wrote into (their --store), None if they wrote CSVs next to the audio
+    :return: report of check_shards and the number of merged files (with CSVs, of new or changed ones); rows of files
+    already in the output are replaced, so merging again is safe
+    """
+    report = check_shards(directory)
+    if store is None:
+        report['merged'] = ingest_results(directory, output)
+        return report
+    stores = [shard_store_path(store, shard) for shard in report['shards']]
+    stores = [path for path in stores if os.path.isdir(path)]
+    days = sorted(set(os.path.basename(partition) for path in stores
+                      for partition in glob.glob(os.path.join(glob.escape(path), f'{PARTITION_COLUMN}=*'))))
+    files = set()
+    with FeatureStore(output) as merged:
+        for day in days:
+            df = pd.concat([read_rows(os.path.join(path, day)) for path in stores
+                            if os.path.isdir(os.path.join(path, day))], sort=False, ignore_index=True)
+            # a file processed by several shards has the same rows (one per window with windowed results) in each
+            df = df.drop_duplicates([FILE_COLUMN, TIME_COLUMN])
+            merged.remove_files(set(df[FILE_COLUMN]), days={day[len(PARTITION_COLUMN) + 1:]})
+            merged.write_frame(df)
+            files.update(df[FILE_COLUMN])
+    report['merged'] = len(files)
+    return report
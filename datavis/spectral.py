@@ -1,41 +1,270 @@
+import os
 import numpy as np
-from cachetools.keys import hashkey
-from cachetools import LRUCache, cached
-from scipy import signal, fftpack
-from datavis.common import strided_array
+from functools import lru_cache
+from collections import OrderedDict
+from scipy import signal, fft
+from datavis.common import strided_array, strided_batch_array
 
 
-def speckey(sig, *args, **kwargs):
-    key = hashkey(*args, **kwargs)
-    return key
+class ScipyFFT(object):
+    """
+    scipy.fft: keeps single precision and splits the frames of a spectrogram over threads
+    """
+    def __init__(self, threads: int = 1):
+        self.threads = threads
+
+    def rfft(self, x: np.ndarray, n: int) -> np.ndarray:
+        return fft.rfft(x, n, workers=self.threads)
+
+    def ifft(self, x: np.ndarray, n: int) -> np.ndarray:
+        return fft.ifft(x, n, workers=self.threads)
+
+
+class NumpyFFT(object):
+    """
+    numpy.fft: single-threaded and always in double precision
+    """
+    def __init__(self, threads: int = 1):
+        self.threads = 1
+
+    def rfft(self, x: np.ndarray, n: int) -> np.ndarray:
+        return np.fft.rfft(x, n)
+
+    def ifft(self, x: np.ndarray, n: int) -> np.ndarray:
+        return np.fft.ifft(x, n)
+
+
+class FFTWFFT(object):
+    """
+    pyFFTW (optional dependency): FFTW plans are cached by pyFFTW and reused for every transform of the same shape,
+    which pays off as the recordings of a site share their length
+    """
+    def __init__(self, threads: int = 1):
+        try:
+            import pyfftw
+        except ImportError:
+            raise ImportError('The fftw backend requires pyFFTW (pip install pyfftw)')
+        pyfftw.interfaces.cache.enable()
+        pyfftw.interfaces.cache.set_keepalive_time(300)
+        self.interface = pyfftw.interfaces.numpy_fft
+        self.threads = threads
+
+    def rfft(self, x: np.ndarray, n: int) -> np.ndarray:
+        return self.interface.rfft(x, n, threads=self.threads)
+
+    def ifft(self, x: np.ndarray, n: int) -> np.ndarray:
+        return self.interface.ifft(x, n, threads=self.threads)
+
+
+FFT_BACKENDS = OrderedDict([('scipy', ScipyFFT), ('numpy', NumpyFFT), ('fftw', FFTWFFT)])
+DEFAULT_FFT_BACKEND = 'scipy'
+# FFT backend of this process, set once per worker by set_fft_backend
+_FFT = {'backend': ScipyFFT()}
+
+
+def set_fft_backend(name: str = DEFAULT_FFT_BACKEND, threads: int = 1):
+    """
+    Select the FFT backend of spectrograms and envelopes computed in this process
+    :param name: one of FFT_BACKENDS
+    :param threads: threads of every transform
+    """
+    if name not in FFT_BACKENDS:
+        raise ValueError(f'FFT backend must be one of {", ".join(FFT_BACKENDS)}, got {name}')
+    _FFT['backend'] = FFT_BACKENDS[name](threads=threads)
+
+
+def get_fft_backend():
+    return _FFT['backend']
+
+
+def fft_threads(n_workers: int, threads: int = None) -> int:
+    """
+    Threads of every transform so that n_workers processes do not oversubscribe the cores
+    :param threads: requested number of threads, if any
+    :return: threads if given, otherwise the cores left to each of the n_workers processes (at least 1)
+    """
+    if threads:
+        return threads
+    return max((os.cpu_count() or 1) // n_workers, 1)
+
+
+def spectrogram_key(win_len: int = 512, hop: int = 256, win_type: str = 'hanning') -> tuple:
+    return 'spectrogram', int(win_len), int(hop), win_type
+
+
+def segmented_key(fs_step: float, fs_max: float, db_threshold: float) -> tuple:
+    return 'segmented_spectrogram', fs_step, fs_max, db_threshold
+
+
+def segmented_win_len(fs: int, fs_step: float, fs_max: float) -> int:
+    fs_win = fs_max / fs_step
+    return int(fs / fs_win)
+
+
+ENVELOPE_KEY = ('envelope',)
+
+
+@lru_cache(maxsize=None)
+def get_window(win_type: str, win_len: int, dtype: np.dtype) -> np.ndarray:
+    """
+    Symmetric window in the dtype of the frames it is applied to, so windowing does not promote float32 frames
+    """
+    return signal.get_window(win_type, win_len, fftbins=False).astype(dtype)
+
+
+def frames_spectrum(frames: np.ndarray, win_len: int, win_type: str = 'hanning') -> np.ndarray:
+    """
+    Magnitude spectra of frames with the FFT backend of the process, in the precision of the frames (except with the
+    numpy backend)
+    """
+    sig_windowed = np.multiply(frames, get_window(win_type, win_len, frames.dtype))
+    Sxx = np.abs(get_fft_backend().rfft(sig_windowed, win_len))[:, :win_len // 2]
+    return np.transpose(Sxx)
+
+
+def spectrogram_freq(fs: int, win_len: int) -> np.ndarray:
+    return np.arange(0, fs / 2, fs / win_len)
 
 
-@cached(LRUCache(maxsize=10), key=speckey)
 def spectrogram(sig, fs, win_len=512, hop=256, win_type='hanning', filename=''):
-    W = signal.get_window(win_type, win_len, fftbins=False)
     sig_strided = strided_array(sig, win_len, hop)
-    sig_windowed = np.multiply(sig_strided, W)
-    Sxx = np.abs(np.fft.rfft(sig_windowed, win_len))[:, :win_len // 2]
-    Sxx = np.transpose(Sxx)
-    freq = np.arange(0, fs / 2, fs / win_len)
+    Sxx = frames_spectrum(sig_strided, win_len, win_type)
+    freq = spectrogram_freq(fs, win_len)
     return Sxx, freq
 
 
+def spectrogram_batch(sigs: np.ndarray, fs: int, win_len=512, hop=256, win_type='hanning'):
+    """
+    Spectrograms of equally long signals stacked along the first axis
+    :return: array of shape (batch, frequency, time) and frequencies
+    """
+    sig_windowed = np.multiply(strided_batch_array(sigs, win_len, hop), get_window(win_type, win_len, sigs.dtype))
+    Sxx = np.abs(get_fft_backend().rfft(sig_windowed, win_len))[..., :win_len // 2]
+    return np.swapaxes(Sxx, 1, 2), spectrogram_freq(fs, win_len)
+
+
 def envelope(sig: np.ndarray):
-    env = np.abs(signal.hilbert(sig, fftpack.helper.next_fast_len(len(sig))))
-    return env
+    """
+    Magnitude of the analytic signal (as scipy.signal.hilbert zero padded to the next fast length) along the last axis,
+    in the precision of the signal; hilbert multiplies the spectrum by a float64 mask, which promotes it to complex128
+    """
+    n = fft.next_fast_len(sig.shape[-1])
+    backend = get_fft_backend()
+    spectrum = backend.rfft(sig, n)
+    spectrum[..., 1:(n + 1) // 2] *= 2
+    return np.abs(backend.ifft(spectrum, n))
 
 
-def segmented_spectogram(y: np.ndarray, fs: int, fs_step: float, fs_max: float, db_threshold: float) -> np.ndarray:
+def segment_bands(fs_step: float, fs_max: float) -> np.ndarray:
     fs_win = fs_max / fs_step
-    win_len = int(fs / fs_win)
-    spec, freq = spectrogram(y, fs, win_len=win_len, hop=win_len)
-
     bands_Hz = np.arange(fs_step, fs_max, fs_step)
-    bands_bin = (bands_Hz / fs_win).astype(int)
+    return (bands_Hz / fs_win).astype(int)
+
+
+def segment_spectrogram(spec: np.ndarray, fs: int, fs_step: float, fs_max: float, db_threshold: float) -> np.ndarray:
+    bands_bin = segment_bands(fs_step, fs_max)
     spec_db = 20 * np.log10(spec / np.max(spec))
     spec_bands = np.split(spec_db, bands_bin)
     spec_segmented_and_thresholded = np.array([np.sum(arr > db_threshold) / arr.size for arr in spec_bands])
-
     return spec_segmented_and_thresholded
 
+
+def segment_spectrogram_batch(spec: np.ndarray, fs: int, fs_step: float, fs_max: float,
+                              db_threshold: float) -> np.ndarray:
+    bands_bin = segment_bands(fs_step, fs_max)
+    spec_db = 20 * np.log10(spec / np.max(spec, axis=(1, 2), keepdims=True))
+    spec_bands = np.split(spec_db, bands_bin, axis=1)
+    return np.stack([np.sum(arr > db_threshold, axis=(1, 2)) / arr[0].size for arr in spec_bands], axis=1)
+
+
+def segmented_spectogram(y: np.ndarray, fs: int, fs_step: float, fs_max: float, db_threshold: float) -> np.ndarray:
+    win_len = segmented_win_len(fs, fs_step, fs_max)
+    spec, freq = spectrogram(y, fs, win_len=win_len, hop=win_len)
+    return segment_spectrogram(spec, fs=fs, fs_step=fs_step, fs_max=fs_max, db_threshold=db_threshold)
+
+
+class SpectralScope(object):
+    """
+    Memo of the spectral intermediates (spectrograms, segmented spectrograms, envelope) of a single signal.
+    A scope is bound to one signal and lives as long as the processing of one file, so intermediates shared by several
+    features are computed once and nothing can leak from one file into the next.
+    """
+    def __init__(self, sig: np.ndarray, fs: int):
+        self.sig = sig
+        self.fs = fs
+        self._memo = {}
+
+    def _get(self, key: tuple, compute):
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    def spectrogram(self, win_len=512, hop=256, win_type='hanning'):
+        key = spectrogram_key(win_len, hop, win_type)
+        return self._get(key, lambda: spectrogram(self.sig, self.fs, win_len=win_len, hop=hop, win_type=win_type))
+
+    def segmented_spectrogram(self, fs_step: float, fs_max: float, db_threshold: float) -> np.ndarray:
+        def compute():
+            win_len = segmented_win_len(self.fs, fs_step, fs_max)
+            spec, freq = self.spectrogram(win_len=win_len, hop=win_len)
+            return segment_spectrogram(spec, fs=self.fs, fs_step=fs_step, fs_max=fs_max, db_threshold=db_threshold)
+        key = segmented_key(fs_step, fs_max, db_threshold)
+        return self._get(key, compute)
+
+    def envelope(self) -> np.ndarray:
+        return self._get(ENVELOPE_KEY, lambda: envelope(self.sig))
+
+    def release(self, key: tuple):
+        self._memo.pop(key, None)
+
+    def __contains__(self, key: tuple):
+        return key in self._memo
+
+
+class BatchSpectralScope(SpectralScope):
+    """
+    SpectralScope of equally long signals stacked along the first axis; intermediates carry the batch as first axis
+    """
+    def spectrogram(self, win_len=512, hop=256, win_type='hanning'):
+        key = spectrogram_key(win_len, hop, win_type)
+        return self._get(key, lambda: spectrogram_batch(self.sig, self.fs, win_len=win_len, hop=hop,
+                                                        win_type=win_type))
+
+    def segmented_spectrogram(self, fs_step: float, fs_max: float, db_threshold: float) -> np.ndarray:
+        def compute():
+            win_len = segmented_win_len(self.fs, fs_step, fs_max)
+            spec, freq = self.spectrogram(win_len=win_len, hop=win_len)
+            return segment_spectrogram_batch(spec, fs=self.fs, fs_step=fs_step, fs_max=fs_max,
+                                             db_threshold=db_threshold)
+        key = segmented_key(fs_step, fs_max, db_threshold)
+        return self._get(key, compute)
+
+
+class WindowScope(SpectralScope):
+    """
+    SpectralScope of the window [start, stop) of a signal whose spectrograms are computed once for the whole signal by
+    the parent scope. The spectrogram of the window is the slice of the frames lying within it, which equals the
+    spectrogram of the window on its own when start is a multiple of the hop; other intermediates (segmented
+    spectrograms, envelope) are computed from the window.
+    """
+    def __init__(self, parent: SpectralScope, start: int, stop: int):
+        super().__init__(parent.sig[start:stop], parent.fs)
+        self.parent = parent
+        self.start = start
+
+    def spectrogram(self, win_len=512, hop=256, win_type='hanning'):
+        def compute():
+            spec, freq = self.parent.spectrogram(win_len=win_len, hop=hop, win_type=win_type)
+            first = -(-self.start // hop)
+            last = (self.start + len(self.sig) - win_len) // hop
+            return spec[:, first:max(last + 1, first)], freq
+        return self._get(spectrogram_key(win_len, hop, win_type), compute)
+
+
+def get_scope(sig: np.ndarray, fs: int, scope: SpectralScope = None) -> SpectralScope:
+    """
+    Return the provided scope if it was built for this very signal, otherwise a fresh one
+    """
+    if scope is not None and scope.sig is sig and scope.fs == fs:
+        return scope
+    return SpectralScope(sig, fs)
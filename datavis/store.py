@@ -0,0 +1,208 @@
+import os
+import json
+import uuid
+import numpy as np
+import pandas as pd
+from pathlib import Path
+from datetime import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+STORE_MARKER = '_feature_store.json'
+TIME_COLUMN = 'timestamp'
+FILE_COLUMN = 'file'
+PARTITION_COLUMN = 'date'
+# Start (in seconds from the start of the recording) of the window of a row of windowed results (a2f --window)
+OFFSET_COLUMN = 'offset'
+
+
+class FeatureStoreException(Exception):
+    pass
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise FeatureStoreException('The feature store requires pyarrow. Install it with "conda install pyarrow".')
+
+
+def is_store(directory: str) -> bool:
+    return os.path.isfile(os.path.join(directory, STORE_MARKER))
+
+
+class FeatureStore(object):
+    """
+    Columnar store of feature rows. Rows are buffered in memory and written as Parquet files partitioned by day
+    (<store>/date=YYYY-MM-DD/part-<id>.parquet) with a timestamp column, the source file and float32 features.
+    """
+    def __init__(self, path: str, rows_per_file: int = 50000):
+        _require_pyarrow()
+        self.path = path
+        self.rows_per_file = rows_per_file
+        self._rows = []
+        os.makedirs(path, exist_ok=True)
+        marker = os.path.join(path, STORE_MARKER)
+        if not os.path.isfile(marker):
+            with open(marker, 'w') as fo:
+                json.dump({'format': 'parquet', 'partitioning': PARTITION_COLUMN}, fo)
+
+    def append(self, timestamp: datetime, path: str, features: dict):
+        """
+        Add features of one file to the store
+        :param timestamp: start of the recording
+        :param path: path of the audio file
+        :param features: dictionary feature name -> value
+        """
+        self._rows.append({TIME_COLUMN: timestamp, FILE_COLUMN: str(path), **features})
+        if len(self._rows) >= self.rows_per_file:
+            self.flush()
+
+    def flush(self):
+        if not self._rows:
+            return
+        df = pd.DataFrame(self._rows)
+        self._rows = []
+        self.write_frame(df)
+
+    def write_frame(self, df: pd.DataFrame):
+        """
+        Write rows to the store directly, without buffering
+        :param df: DataFrame with timestamp, file and feature columns
+        """
+        feature_columns = [c for c in df.columns if c not in (TIME_COLUMN, FILE_COLUMN)]
+        df[feature_columns] = df[feature_columns].astype(np.float32)
+        df = df.sort_values(TIME_COLUMN)
+        for day, part in df.groupby(df[TIME_COLUMN].dt.strftime('%Y-%m-%d')):
+            partition = os.path.join(self.path, f'{PARTITION_COLUMN}={day}')
+            os.makedirs(partition, exist_ok=True)
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            pq.write_table(table, os.path.join(partition, f'part-{uuid.uuid4().hex}.parquet'))
+
+    def remove_files(self, files: set, days: set = None):
+        """
+        Remove the rows of source files, rewriting the Parquet files that contain them
+        :param files: paths of the source files
+        :param days: dates (YYYY-MM-DD) of the partitions to look in, all partitions if None
+        """
+        partitions = sorted(Path(self.path).glob(f'{PARTITION_COLUMN}=*'))
+        if days is not None:
+            partitions = [p for p in partitions if p.name[len(PARTITION_COLUMN) + 1:] in days]
+        for part in [part for partition in partitions for part in sorted(partition.glob('*.parquet'))]:
+            table = pq.read_table(str(part))
+            keep = ~table.column(FILE_COLUMN).to_pandas().isin(files).values
+            if keep.all():
+                continue
+            if keep.any():
+                pq.write_table(table.filter(pa.array(keep)), str(part.parent / f'part-{uuid.uuid4().hex}.parquet'))
+            part.unlink()
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def processed_files(self) -> set:
+        if not _parts(self.path):
+            return set()
+        return set(read_store(self.path, columns=[FILE_COLUMN])[FILE_COLUMN])
+
+
+def _parts(directory: str) -> list:
+    """
+    :return: Parquet files of the store, skipping files and directories starting with "_" or "." as pyarrow does
+    """
+    root = Path(directory)
+    return sorted(path for path in root.rglob('*.parquet')
+                  if not any(name.startswith(('_', '.')) for name in path.relative_to(root).parts))
+
+
+def _read_part(path: Path, columns: list = None) -> pd.DataFrame:
+    # Parts written with different feature sets have different schemas, which a single pq.read_table of the store
+    # does not merge: columns missing in a part are filled with NaN by the concat instead
+    if columns is not None:
+        names = pq.read_schema(str(path)).names
+        columns = [c for c in columns if c in names]
+    return pq.read_table(str(path), columns=columns).to_pandas()
+
+
+def read_rows(directory: str) -> pd.DataFrame:
+    """
+    Read the rows of a store (or of one of its partitions) as they were written: timestamp, file and feature columns
+    :return: DataFrame in the order of the Parquet files, empty if there are none
+    """
+    _require_pyarrow()
+    parts = _parts(directory)
+    if not parts:
+        return pd.DataFrame(columns=[TIME_COLUMN, FILE_COLUMN])
+    return pd.concat([_read_part(path) for path in parts], sort=False, ignore_index=True)
+
+
+def read_store(directory: str, columns: list = None, files: set = None) -> pd.DataFrame:
+    """
+    Read features from the store into a timestamp-indexed DataFrame
+    :param directory: path to the store
+    :param columns: feature columns to read, all if None
+    :param files: read only the rows of these source files
+    :return: DataFrame sorted by time
+    """
+    _require_pyarrow()
+    if columns is not None:
+        columns = [TIME_COLUMN] + [c for c in columns if c != TIME_COLUMN]
+    parts = _parts(directory)
+    if not parts:
+        raise FeatureStoreException(f'No feature files found in {directory}')
+    df = pd.concat([_read_part(path, columns) for path in parts], sort=False, ignore_index=True)
+    if files is not None:
+        df = df[df[FILE_COLUMN].isin(files)]
+    df = df.set_index(TIME_COLUMN)
+    df.index.name = None
+    if columns is None:
+        df = df.drop(columns=[FILE_COLUMN])
+    return df.sort_index()
+
+
+def list_files(directory: str) -> pd.DataFrame:
+    """
+    List the source files of a store. Parquet files are never modified in place (see FeatureStore.remove_files), so
+    the modification time of the files holding the rows of a source file changes whenever they are rewritten
+    :param directory: path to the store
+    :return: DataFrame indexed by source file with the timestamp of its first row, its number of rows and the latest
+    modification time of the Parquet files holding them
+    """
+    _require_pyarrow()
+    parts = _parts(directory)
+    if not parts:
+        raise FeatureStoreException(f'No feature files found in {directory}')
+    df = pd.concat([_read_part(path, [TIME_COLUMN, FILE_COLUMN]).assign(mtime=os.path.getmtime(str(path)))
+                    for path in parts], sort=False, ignore_index=True)
+    groups = df.groupby(FILE_COLUMN)
+    files = pd.DataFrame({'mtime': groups['mtime'].max(), 'timestamp': groups[TIME_COLUMN].min(),
+                          'rows': groups.size()}, columns=['mtime', 'timestamp', 'rows'])
+    files.index.name = None
+    return files
+
+
+def iter_store(directory: str, rows: int = 1000000):
+    """
+    Read features from the store in time-ordered chunks of whole days
+    :param directory: path to the store
+    :param rows: days are read until the chunk has at least this many rows
+    :return: generator of timestamp-indexed DataFrames sorted by time
+    """
+    _require_pyarrow()
+    days = []
+    for partition in sorted(Path(directory).glob(f'{PARTITION_COLUMN}=*')):
+        days.append(read_store(str(partition)))
+        if sum(len(day) for day in days) >= rows:
+            yield pd.concat(days, sort=False)
+            days = []
+    if days:
+        yield pd.concat(days, sort=False)
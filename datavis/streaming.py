@@ -0,0 +1,376 @@
+"""
+Bounded-memory feature extraction. The audio is read in fixed-size blocks and every bioacoustic index keeps only the
+running statistics it needs, so peak memory depends on the block size and not on the duration of the recording.
+
+Frames of spectrograms and envelopes are cut exactly as on the whole signal (the samples that do not fill a frame are
+carried over to the next block), which makes ACI, BI, spectral entropy, ADI/AEI and acoustic activity equal to their
+in-memory counterparts. Three indices are approximated:
+ * ADI/AEI threshold the spectrogram relative to its global maximum, which is only known at the end; values are kept
+   in per-band histograms of DB_RESOLUTION dB.
+ * Temporal entropy computes the Hilbert envelope per block with ENVELOPE_MARGIN samples of context on both sides.
+ * Formants come from the autocorrelation (Levinson-Durbin) LPC of the whole signal instead of Burg's method. In the
+   frame-based mode every block is decimated on its own.
+"""
+
+import numpy as np
+from scipy import signal
+from scipy.linalg import solve_toeplitz
+from scipy.stats import entropy
+from datavis import spectral
+from datavis.common import gini, strided_array, working_dtype
+from datavis.plan import build_plan
+from datavis.bioacoustics import acoustic_activity_from_envelope, formants_from_lpc, formants_from_tracks, \
+    formant_tracks, decimation_factor, formant_frame_sizes
+from datavis.audio_io import iter_blocks
+from datavis.filters import get_band_filter, SosFilter
+from datavis.yaafe_wrapper import get_yaafe_wrapper
+
+DB_RESOLUTION = 0.01
+DB_RANGE = (-300, 200)
+ENVELOPE_MARGIN = 8192
+
+
+class FrameStream(object):
+    """
+    Cuts consecutive blocks into the same frames strided_array would cut the concatenated signal into
+    """
+    def __init__(self, win_len: int, hop: int):
+        self.win_len = win_len
+        self.hop = hop
+        self.carry = np.zeros(0, dtype='float32')
+
+    def frames(self, block: np.ndarray) -> np.ndarray:
+        buf = np.concatenate((self.carry, block))
+        if len(buf) < self.win_len:
+            self.carry = buf
+            return np.zeros((0, self.win_len), dtype=buf.dtype)
+        frames = strided_array(buf, self.win_len, self.hop)
+        self.carry = buf[len(frames) * self.hop:].copy()
+        return frames
+
+
+class SpectrogramStream(object):
+    def __init__(self, fs: int, win_len: int, hop: int, win_type: str):
+        self.frame_stream = FrameStream(win_len, hop)
+        self.win_len = win_len
+        self.win_type = win_type
+        self.freq = spectral.spectrogram_freq(fs, win_len)
+
+    def update(self, block: np.ndarray) -> np.ndarray:
+        return spectral.frames_spectrum(self.frame_stream.frames(block), self.win_len, self.win_type)
+
+
+class ACIStream(object):
+    def __init__(self, fs: int, config: dict):
+        self.j_bin = int(config['params']['bin'] * fs / config['spectrogram']['hop'])
+        self.columns = None
+        self.aci = 0.0
+
+    def update(self, spec: np.ndarray, freq: np.ndarray):
+        spec = spec if self.columns is None else np.concatenate((self.columns, spec), axis=1)
+        full_bins = spec.shape[1] // self.j_bin
+        groups = spec[:, :self.j_bin * full_bins].reshape(spec.shape[0], full_bins, self.j_bin)
+        self.aci += np.sum(np.sum(np.abs(np.diff(groups)), axis=2) / np.sum(groups, axis=2))
+        self.columns = spec[:, self.j_bin * full_bins:]
+
+    def result(self) -> float:
+        return self.aci
+
+
+class BIStream(object):
+    """
+    BI only needs the mean power per frequency bin: normalising the spectrogram by its maximum shifts every bin by the
+    same number of dB and cancels out once the minimum is subtracted
+    """
+    def __init__(self, fs: int, config: dict):
+        self.fs_min = config['params']['fs_min']
+        self.fs_max = min(config['params']['fs_max'], fs / 2)
+        self.power = 0.0
+        self.count = 0
+        self.freq = None
+
+    def update(self, spec: np.ndarray, freq: np.ndarray):
+        self.freq = freq
+        self.power = self.power + np.einsum('ij,ij->i', spec, spec, dtype=np.float64)
+        self.count += spec.shape[1]
+
+    def result(self) -> float:
+        freq = self.freq
+        min_freq_idx = (np.abs(freq - self.fs_min)).argmin() - 1
+        max_freq_idx = (np.abs(freq - self.fs_max)).argmin()
+        power = (self.power / self.count)[min_freq_idx: max_freq_idx]
+        spec_BI_mean = 10 * np.log10(power)
+        return ((spec_BI_mean - spec_BI_mean.min()) / (freq[1] - freq[0])).sum()
+
+
+class SpectralEntropyStream(object):
+    def __init__(self, fs: int, config: dict):
+        self.spec_sum = 0.0
+
+    def update(self, spec: np.ndarray, freq: np.ndarray):
+        self.spec_sum = self.spec_sum + np.sum(spec, axis=1)
+
+    def result(self) -> float:
+        N = len(self.spec_sum)
+        return entropy(self.spec_sum / np.sum(self.spec_sum)) / np.log(N)
+
+
+class SegmentedStream(object):
+    """
+    Per-band histograms of the spectrogram in dB, thresholded against the global maximum when the stream ends
+    """
+    def __init__(self, fs: int, fs_step: float, fs_max: float, db_threshold: float):
+        self.db_threshold = db_threshold
+        self.bands_bin = spectral.segment_bands(fs_step, fs_max)
+        self.n_bins = int((DB_RANGE[1] - DB_RANGE[0]) / DB_RESOLUTION)
+        self.hist = None
+        self.maximum = 0.0
+        self.frames = 0
+
+    def update(self, spec: np.ndarray, freq: np.ndarray):
+        if spec.shape[1] == 0:
+            return
+        n_rows = spec.shape[0]
+        if self.hist is None:
+            self.band_of_row = np.zeros(n_rows, dtype=int)
+            for edge in self.bands_bin:
+                self.band_of_row[edge:] += 1
+            self.band_rows = np.bincount(self.band_of_row, minlength=len(self.bands_bin) + 1)
+            self.hist = np.zeros((len(self.bands_bin) + 1) * self.n_bins, dtype=np.int64)
+        self.maximum = max(self.maximum, spec.max())
+        with np.errstate(divide='ignore'):
+            spec_db = 20 * np.log10(spec)
+        idx = np.clip(((spec_db - DB_RANGE[0]) / DB_RESOLUTION), 0, self.n_bins - 1).astype(int)
+        idx += self.band_of_row[:, np.newaxis] * self.n_bins
+        self.hist += np.bincount(idx.ravel(), minlength=len(self.hist))
+        self.frames += spec.shape[1]
+
+    def result(self) -> np.ndarray:
+        threshold = 20 * np.log10(self.maximum) + self.db_threshold
+        position = (threshold - DB_RANGE[0]) / DB_RESOLUTION
+        threshold_bin = int(position)
+        hist = self.hist.reshape(-1, self.n_bins)
+        # values of the bin holding the threshold are assumed to be spread uniformly over the bin
+        above = hist[:, threshold_bin + 1:].sum(axis=1) + hist[:, threshold_bin] * (threshold_bin + 1 - position)
+        return above / (self.band_rows * self.frames)
+
+
+class TemporalEntropyStream(object):
+    """
+    Entropy of the normalised envelope from running sums: H = log(S) - sum(e * log(e)) / S with S = sum(e)
+    """
+    def __init__(self, fs: int, config: dict):
+        self.left = np.zeros(0, dtype='float32')
+        self.pending = np.zeros(0, dtype='float32')
+        self.total = 0.0
+        self.e_log_e = 0.0
+        self.count = 0
+
+    def _emit(self, env: np.ndarray):
+        self.total += env.sum(dtype=np.float64)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.e_log_e += np.nansum(env * np.log(env), dtype=np.float64)
+        self.count += len(env)
+
+    def _envelope(self, seg: np.ndarray) -> np.ndarray:
+        return spectral.envelope(seg)[:len(seg)]
+
+    def update(self, block: np.ndarray):
+        self.pending = np.concatenate((self.pending, block))
+        if len(self.pending) <= ENVELOPE_MARGIN:
+            return
+        seg = np.concatenate((self.left, self.pending))
+        env = self._envelope(seg)
+        self._emit(env[len(self.left): len(seg) - ENVELOPE_MARGIN])
+        self.left = seg[:len(seg) - ENVELOPE_MARGIN][-ENVELOPE_MARGIN:]
+        self.pending = self.pending[-ENVELOPE_MARGIN:]
+
+    def result(self) -> float:
+        if len(self.pending):
+            seg = np.concatenate((self.left, self.pending))
+            self._emit(self._envelope(seg)[len(self.left):])
+        return (np.log(self.total) - self.e_log_e / self.total) / np.log(self.count)
+
+
+class AcousticActivityStream(object):
+    """
+    Keeps one dB value per frame_len samples, i.e. a frame_len-fold reduction of the signal
+    """
+    def __init__(self, fs: int, config: dict):
+        self.fs = fs
+        self.params = config['params']
+        self.frame_stream = FrameStream(self.params['frame_len'], self.params['frame_len'])
+        self.envelopes = []
+        self.samples = 0
+
+    def update(self, block: np.ndarray):
+        self.samples += len(block)
+        frames = self.frame_stream.frames(block)
+        self.envelopes.append(20 * np.log10(np.max(np.abs(frames), axis=1)))
+
+    def result(self) -> dict:
+        return acoustic_activity_from_envelope(np.concatenate(self.envelopes), self.samples / self.fs, self.params)
+
+
+class FormantStream(object):
+    def __init__(self, fs: int, config: dict):
+        order = config['params']['order']
+        self.order = fs // 1000 if order is None else order
+        self.fs = fs
+        self.r = np.zeros(self.order + 1)
+        self.carry = np.zeros(0, dtype='float32')
+
+    def update(self, block: np.ndarray):
+        buf = np.concatenate((self.carry, block))
+        start = len(self.carry)
+        for k in range(self.order + 1):
+            first = max(start, k)
+            self.r[k] += np.einsum('i,i->', buf[first:], buf[first - k: len(buf) - k], dtype=np.float64)
+        self.carry = buf[-self.order:]
+
+    def result(self) -> dict:
+        a = solve_toeplitz(self.r[:-1], -self.r[1:])
+        return formants_from_lpc(np.concatenate(([1.0], a)), self.fs)
+
+
+class FrameFormantStream(object):
+    """
+    Frame-based formants (see bioacoustics.formant_tracks): every block is decimated on its own and frames continue
+    across blocks
+    """
+    def __init__(self, fs: int, config: dict):
+        params = config['params']
+        self.factor = decimation_factor(fs, params.get('band', 5000))
+        self.fs = fs / self.factor
+        self.order = int(self.fs // 1000) if params['order'] is None else params['order']
+        self.frame, self.hop = params.get('frame', 0.03), params.get('hop', 0.03)
+        self.win_len, self.step = formant_frame_sizes(self.fs, self.order, self.frame, self.hop)
+        self.carry = np.zeros(0, dtype='float32')
+        self.tracks = []
+
+    def update(self, block: np.ndarray):
+        block = signal.resample_poly(block, 1, self.factor) if self.factor > 1 else block
+        buf = np.concatenate((self.carry, block))
+        if len(buf) < self.win_len:
+            self.carry = buf
+            return
+        _, tracks = formant_tracks(buf, self.fs, order=self.order, band=None, frame=self.frame, hop=self.hop)
+        self.tracks.append(tracks)
+        self.carry = buf[((len(buf) - self.win_len) // self.step + 1) * self.step:]
+
+    def result(self) -> dict:
+        return formants_from_tracks(np.concatenate(self.tracks) if self.tracks else np.zeros((0, self.order)))
+
+
+def formant_stream(fs: int, config: dict):
+    if config['params'].get('mode', 'global') == 'frames':
+        return FrameFormantStream(fs, config)
+    return FormantStream(fs, config)
+
+
+SPECTRAL_STREAMS = {
+    'Acoustic_Complexity_Index': ACIStream,
+    'Bioacoustic_Index': BIStream,
+    'Spectral_entropy': SpectralEntropyStream,
+}
+SIGNAL_STREAMS = {
+    'Temporal_entropy': TemporalEntropyStream,
+    'Acoustic_activity': AcousticActivityStream,
+    'Formants': formant_stream,
+}
+
+
+class StreamingExtractor(object):
+    """
+    Bioacoustic (and optionally YAAFE) features of a signal delivered in blocks. Spectrograms shared by several features
+    are computed once per block following the feature plan.
+    """
+    def __init__(self, fs: int, config: dict, yaafe=None):
+        self.fs = fs
+        self.config = config
+        self.plan = build_plan(config['Bioacoustic_features'], fs)
+        self.spectrograms = {}
+        self.consumers = []
+        self.signal_streams = {}
+        self.segmented = {}
+        for name, keys in self.plan.items():
+            feature_config = config['Bioacoustic_features'][name]
+            if name in SIGNAL_STREAMS:
+                self.signal_streams[name] = SIGNAL_STREAMS[name](fs, feature_config)
+                continue
+            spec_key = keys[0]
+            if spec_key not in self.spectrograms:
+                _, win_len, hop, win_type = spec_key
+                self.spectrograms[spec_key] = SpectrogramStream(fs, win_len, hop, win_type)
+            if name in SPECTRAL_STREAMS:
+                self.consumers.append((spec_key, name, SPECTRAL_STREAMS[name](fs, feature_config)))
+            else:
+                segmented_key = keys[1]
+                if segmented_key not in self.segmented:
+                    _, fs_step, fs_max, db_threshold = segmented_key
+                    stream = SegmentedStream(fs, fs_step, fs_max, db_threshold)
+                    self.segmented[segmented_key] = stream
+                    self.consumers.append((spec_key, segmented_key, stream))
+        self.yaafe = yaafe.stream() if yaafe is not None else None
+
+    def update(self, block: np.ndarray):
+        for spec_key, spectrogram in self.spectrograms.items():
+            spec = spectrogram.update(block)
+            for consumer_key, _, stream in self.consumers:
+                if consumer_key == spec_key:
+                    stream.update(spec, spectrogram.freq)
+        for stream in self.signal_streams.values():
+            stream.update(block)
+        if self.yaafe is not None:
+            self.yaafe.update(block)
+
+    def result(self) -> dict:
+        results = {name: stream.result() for _, name, stream in self.consumers}
+        results.update({name: stream.result() for name, stream in self.signal_streams.items()})
+
+        def segmented(name):
+            if name not in self.plan:
+                return None
+            return results[self.plan[name][1]]
+
+        adi = segmented('Acoustic_Diversity_Index')
+        aei = segmented('Acoustic_Evenness_Index')
+        AE = results.get('Acoustic_activity') or dict.fromkeys(['SNR', 'Acoustic_activity', 'Count_acoustic_events',
+                                                                 'Average_duration'])
+        features = {
+            'Acoustic_Complexity_Index': results.get('Acoustic_Complexity_Index'),
+            'Acoustic_Diversity_Index': entropy(adi) if adi is not None else None,
+            'Bioacoustic_Index': results.get('Bioacoustic_Index'),
+            'Spectral_entropy': results.get('Spectral_entropy'),
+            'Temporal_entropy': results.get('Temporal_entropy'),
+            'Acoustic_Evenness_Index': gini(aei) if aei is not None else None,
+            'SNR': AE['SNR'],
+            'Acoustic_activity': AE['Acoustic_activity'],
+            'Acoustic_events_count': AE['Count_acoustic_events'],
+            'Event_average_duration': AE['Average_duration']
+        }
+        if 'Formants' in results:
+            features.update(results['Formants'])
+        if self.yaafe is not None:
+            features.update(self.yaafe.result())
+        return features
+
+
+def stream_features(path: str, config: dict, block_duration: float) -> dict:
+    """
+    Compute bioacoustic and YAAFE features of a file with memory bounded by the block size
+    :param path: path to the audio file
+    :param config: config dictionary
+    :param block_duration: seconds of audio read at once
+    :return: dictionary with the same features process_audio computes
+    """
+    blocks, fs = iter_blocks(str(path), block_duration)
+    dtype = working_dtype(config)
+    yaafe = get_yaafe_wrapper(fs=fs, config=config['YAAFE_features'])
+    extractor = StreamingExtractor(fs=fs, config=config, yaafe=yaafe)
+    sos = get_band_filter(config, fs)
+    band = SosFilter(sos) if sos is not None else None
+    for block in blocks:
+        block = block.astype(dtype, copy=False)
+        extractor.update(band(block) if band is not None else block)
+    return extractor.result()
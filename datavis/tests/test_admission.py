@@ -0,0 +1,70 @@
+import os
+import numpy as np
+import pytest
+import yaml
+import soundfile as sf
+from pathlib import Path
+
+pytest.importorskip('yaafelib')
+
+from datavis.admission import parse_memory, estimate_memory, Admission
+
+config_path = str(Path(__file__).parents[1] / 'config.yaml')
+
+
+def load_config():
+    with open(config_path, 'r') as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+
+def test_estimates_and_split(tmp_path):
+    assert parse_memory('512') == 512
+    assert parse_memory('1.5K') == 1536
+    assert parse_memory('16g') == 16 * 2 ** 30
+    assert parse_memory('2MiB') == 2 * 2 ** 20
+    for text in ['', 'M', '-1G', '3X']:
+        with pytest.raises(ValueError):
+            parse_memory(text)
+
+    config = load_config()
+    short, long = (estimate_memory(48000, 1, 60 * 48000 * n, config) for n in (1, 10))
+    assert 9 * short < long
+    assert estimate_memory(48000, 1, 60 * 48000 * 10, config, stream_block=60) < 1.1 * short
+
+    paths = []
+    for seconds in (1, 1, 30):
+        paths.append(str(tmp_path / f'rec-{len(paths)}.wav'))
+        sf.write(paths[-1], np.zeros(16000 * seconds), 16000)
+    admission = Admission(parse_memory('16M'), config)
+    regular, streamed = admission.split([[paths[0], paths[1]], [paths[2]]])
+    assert regular == [[paths[0], paths[1]]] and streamed == [[paths[2]]]
+    assert admission.unit_stream_block([[paths[2]]]) is not None and admission.unit_stream_block(regular) is None
+    lane = estimate_memory(16000, 1, 16000 * 30, config, stream_block=admission.lane_block)
+    assert admission.cost([[paths[2]]]) == lane
+    assert admission.fits(admission.budget)
+    admission.acquire(admission.cost(regular))
+    assert not admission.fits(admission.budget)
+    admission.release(admission.cost(regular))
+    assert admission.used == 0
+
+
+def test_gated_run(tmp_path, monkeypatch):
+    from tqdm import tqdm
+    from datavis import features
+
+    totals = []
+
+    class Progress(tqdm):
+        def __init__(self, *args, **kwargs):
+            totals.append(kwargs['total'])
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(features, 'tqdm', Progress)
+    rng = np.random.RandomState(0)
+    for i, seconds in enumerate((1, 1, 2, 1, 30)):
+        sf.write(str(tmp_path / f'rec-{i}.wav'), 0.1 * rng.randn(16000 * seconds), 16000)
+    features.wav_dir_to_features(str(tmp_path), config_path, n_jobs=2, resume=False, batch_size=2,
+                                 max_memory=parse_memory('16M'))
+    assert totals == [5]
+    assert sorted(name for name in os.listdir(str(tmp_path)) if name.endswith('.csv')) == \
+        [f'rec-{i}.csv' for i in range(5)]
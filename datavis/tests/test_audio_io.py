@@ -7,4 +7,33 @@ filename_ok_01_date = datetime(year=2020, month=3, day=17, hour=0, minute=5, sec
 
 def test_extract_datetime_from_filename():
     d1 = aio.extract_datetime_from_filename(filename_ok_01)
-    assert d1 == filename_ok_01_date
\ No newline at end of file
+    assert d1 == filename_ok_01_date
+
+def test_load_audio_matches_soundfile(tmp_path):
+    np = pytest.importorskip('numpy')
+    sf = pytest.importorskip('soundfile')
+    rng = np.random.RandomState(0)
+    samples = np.clip(0.3 * rng.randn(16000, 2), -1, 1)
+    for subtype in ['PCM_16', 'PCM_U8', 'FLOAT']:
+        path = str(tmp_path / f'{subtype}.wav')
+        sf.write(path, samples, 16000, subtype=subtype)
+        info = aio.probe_wav(path)
+        assert (info.fs, info.channels, info.frames, info.duration) == (16000, 2, 16000, 1.0)
+        y, fs = aio.load_audio(path)
+        expected = sf.read(path, dtype='float32')[0].mean(axis=1)
+        assert fs == 16000 and y.dtype == np.float32
+        np.testing.assert_allclose(y, expected, atol=1e-7)
+
+
+def test_probe_truncated_wav(tmp_path):
+    np = pytest.importorskip('numpy')
+    sf = pytest.importorskip('soundfile')
+    path = str(tmp_path / 'a.wav')
+    sf.write(path, np.zeros(16000), 16000, subtype='PCM_16')
+    assert not aio.probe_wav(path).truncated
+    with open(path, 'rb') as fo:
+        data = fo.read()
+    with open(path, 'wb') as fo:
+        fo.write(data[:len(data) // 2])
+    info = aio.probe_wav(path)
+    assert info.truncated and info.frames < 8000
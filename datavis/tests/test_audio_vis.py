@@ -0,0 +1,15 @@
+import numpy as np
+import pandas as pd
+from datavis.audio_vis import decimate
+
+
+def test_decimate_keeps_spikes():
+    index = pd.date_range('2020-01-01', periods=1000, freq='1T')
+    df = pd.DataFrame({'a': np.zeros(1000), 'b': np.arange(1000.)}, index=index)
+    df.iloc[501, 0] = 1
+    envelopes = decimate(df, 100)
+    assert envelopes['max'].shape == (100, 2)
+    assert envelopes['max']['a'].sum() == 1 and envelopes['min']['a'].sum() == 0
+    assert envelopes['mean']['b'].iloc[0] == 4.5
+    assert (envelopes['min'].index == index[::10]).all()
+    assert decimate(df, 0)['mean'] is df
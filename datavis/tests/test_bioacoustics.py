@@ -0,0 +1,87 @@
+import yaml
+import pytest
+import numpy as np
+from pathlib import Path
+from scipy.linalg import solve_toeplitz
+from scipy.signal import lfilter
+from datavis import spectral
+from datavis.bioacoustics import get_bioacoustic_features, get_bioacoustic_features_batch, lpc_frames, \
+    lpc_roots_frequencies, get_formant_frequencies
+
+config_path = Path(__file__).parents[1] / 'config.yaml'
+
+
+def test_batch_matches_single_file():
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)['Bioacoustic_features']
+    fs = 16000
+    t = np.arange(4 * fs) / fs
+    rng = np.random.RandomState(0)
+    Y = np.stack([0.05 * (i + 1) * rng.randn(len(t)) + 0.3 * np.sin(2 * np.pi * (1000 + 500 * i) * t)
+                  for i in range(3)]).astype('float32')
+
+    rows = get_bioacoustic_features_batch(Y=Y, fs=fs, config=config)
+    for y, row in zip(Y, rows):
+        expected = get_bioacoustic_features(y=y, fs=fs, config=config)
+        assert row.keys() == expected.keys()
+        for name, value in expected.items():
+            assert row[name] == pytest.approx(value, rel=1e-5), name
+
+
+def test_features_turned_off():
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)['Bioacoustic_features']
+    for feature_config in config.values():
+        feature_config['use'] = False
+    y = np.random.RandomState(0).randn(16000).astype('float32')
+    scope = spectral.SpectralScope(y, 16000)
+    features = get_bioacoustic_features(y=y, fs=16000, config=config, scope=scope)
+    assert all(value is None for value in features.values()), features
+    assert spectral.ENVELOPE_KEY not in scope
+    for row in get_bioacoustic_features_batch(Y=y[None], fs=16000, config=config):
+        assert all(value is None for value in row.values()), row
+
+
+def test_float32_within_agreement_bound():
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)['Bioacoustic_features']
+    fs = 16000
+    t = np.arange(4 * fs) / fs
+    rng = np.random.RandomState(1)
+    y = 0.05 * rng.randn(len(t)) + 0.3 * np.sin(2 * np.pi * (1000 + 200 * t) * t) * (np.sin(2 * np.pi * t) > 0)
+
+    scope = spectral.SpectralScope(y.astype('float32'), fs)
+    assert scope.spectrogram()[0].dtype == np.float32 and scope.envelope().dtype == np.float32
+    assert spectral.BatchSpectralScope(y[None].astype('float32'), fs).spectrogram()[0].dtype == np.float32
+
+    expected = get_bioacoustic_features(y=y, fs=fs, config=config)
+    single = get_bioacoustic_features(y=y.astype('float32'), fs=fs, config=config)
+    batch = get_bioacoustic_features_batch(Y=np.stack([y, y]).astype('float32'), fs=fs, config=config)[0]
+    for name, value in expected.items():
+        assert single[name] == pytest.approx(value, rel=0.01), name
+        assert batch[name] == pytest.approx(value, rel=0.01), name
+
+
+def test_frame_formants():
+    rng = np.random.RandomState(0)
+    frames = rng.randn(5, 300)
+    A = lpc_frames(frames, 8)
+    for frame, a in zip(frames, A):
+        r = np.correlate(frame, frame, 'full')[len(frame) - 1:]
+        assert np.allclose(a, np.r_[1, solve_toeplitz(r[:8], -r[1:9])])
+        expected = np.roots(a)
+        expected = np.sort(np.angle(expected[expected.imag >= 0])) * 8000 / (2 * np.pi)
+        frequencies = lpc_roots_frequencies(a[None], 8000)[0]
+        assert np.allclose(frequencies[np.isfinite(frequencies)], expected)
+
+    # AR process with resonances at 1 and 2.5 kHz, sampled at 40 kHz and decimated to the 5 kHz band
+    fs, poles = 10000, []
+    for f in [1000, 2500]:
+        poles += [0.97 * np.exp(2j * np.pi * f / fs), 0.97 * np.exp(-2j * np.pi * f / fs)]
+    y = lfilter([1], np.real(np.poly(poles)), rng.randn(4 * fs))
+    y = np.repeat(y, 4)
+    config = {'use': True, 'params': {'order': 4, 'mode': 'frames'}}
+    formants = get_formant_frequencies(y=y, fs=4 * fs, config=config)
+    assert formants['formant_q25'] == pytest.approx(1000, rel=0.05)
+    assert formants['formant_q75'] == pytest.approx(2500, rel=0.05)
+    assert formants['formant_len'] == pytest.approx(2, rel=0.05)
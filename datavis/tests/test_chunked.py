@@ -0,0 +1,31 @@
+import numpy as np
+import pandas as pd
+from datavis.chunked import ChunkedResampler, OnlineStats, resample_chunks
+
+
+def test_resample_chunks_matches_in_memory():
+    rng = np.random.RandomState(0)
+    index = pd.date_range('2020-01-01 05:03', periods=3000, freq='1T')
+    index = index[rng.rand(3000) > 0.3].append(pd.date_range('2020-01-05', periods=500, freq='1T'))
+    df = pd.DataFrame(1e6 + rng.randn(len(index), 3), index=index, columns=['a', 'b', 'c'])
+    df['c'] += df['a'] * 0.5
+    df.iloc[rng.rand(len(index)) > 0.9, 1] = np.nan
+    bounds = [0, 7, 8, 400, 1500, len(df) - 1, len(df)]
+    chunks = [df.iloc[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+    resampled, stats = resample_chunks(chunks, 30)
+    expected = df.resample('30T').mean()
+    assert (resampled.index == expected.index).all()
+    assert np.allclose(resampled.values, expected.values, equal_nan=True)
+    assert np.allclose(stats.min, expected.min()) and np.allclose(stats.max, expected.max())
+    assert np.allclose(stats.corr().values, expected.corr().values, atol=1e-9)
+
+
+def test_online_stats_new_columns():
+    stats = OnlineStats()
+    stats.add(pd.DataFrame({'a': [1., 2., 3.]}))
+    stats.add(pd.DataFrame({'a': [4.], 'b': [1.]}))
+    stats.add(pd.DataFrame({'b': [3., 2.], 'a': [6., 5.]}))
+    assert list(stats.max) == [6., 3.]
+    assert np.isclose(stats.corr().loc['a', 'b'], 1)
+    assert ChunkedResampler(10).close().empty
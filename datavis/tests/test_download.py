@@ -0,0 +1,72 @@
+import os
+import threading
+from socketserver import ThreadingMixIn
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from datavis.download import Downloader, PART_SUFFIX
+
+DATA = bytes(range(256)) * 4096
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    requests = []
+    # Paths whose first GET is cut in the middle of the body
+    truncate = set()
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(DATA)))
+        self.end_headers()
+
+    def do_GET(self):
+        Handler.requests.append((self.path, self.headers.get('Range')))
+        start = int(self.headers['Range'][len('bytes='):].rstrip('-')) if self.headers.get('Range') else 0
+        if start >= len(DATA):
+            self.send_response(416)
+            self.send_header('Content-Range', f'bytes */{len(DATA)}')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_response(206 if start else 200)
+        if start:
+            self.send_header('Content-Range', f'bytes {start}-{len(DATA) - 1}/{len(DATA)}')
+        self.send_header('Content-Length', str(len(DATA) - start))
+        self.end_headers()
+        if self.path in Handler.truncate:
+            Handler.truncate.discard(self.path)
+            self.wfile.write(DATA[start: len(DATA) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(DATA[start:])
+
+
+def test_download_resume_and_verify(tmp_path):
+    server = ThreadingServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    Handler.truncate = {'/b.wav'}
+    links = [(f'{url}/{name}', str(tmp_path / name)) for name in ['a.wav', 'b.wav', 'c.wav']]
+    try:
+        with open(links[2][1], 'wb') as fh:
+            fh.write(DATA[:1000])
+
+        with Downloader(jobs=2, per_host=2) as downloader:
+            assert downloader.incomplete([links[2]]) == [links[2]]
+            assert os.path.getsize(links[2][1] + PART_SUFFIX) == 1000
+            assert downloader.fetch(links) == []
+    finally:
+        server.shutdown()
+
+    for _, filename in links:
+        with open(filename, 'rb') as fh:
+            assert fh.read() == DATA
+        assert not os.path.exists(filename + PART_SUFFIX)
+    assert ('/c.wav', 'bytes=1000-') in Handler.requests
+    assert ('/b.wav', f'bytes={len(DATA) // 2}-') in Handler.requests
@@ -0,0 +1,19 @@
+import pytest
+
+pytest.importorskip('yaafelib')
+
+from datavis.features import get_tasks, get_work_units
+
+
+def test_largest_first_work_units():
+    sizes = {'long.wav': 1000, 'a.wav': 10, 'b.wav': 10, 'c.wav': 20, 'd.wav': 10}
+    tasks = get_tasks(sorted(sizes), batch_size=1, sizes=sizes)
+    assert tasks == [['long.wav'], ['c.wav'], ['a.wav'], ['b.wav'], ['d.wav']]
+
+    units = list(get_work_units(tasks, sizes, n_workers=2))
+    assert units[0] == [['long.wav']]
+    assert [paths for unit in units for paths in unit] == tasks
+    assert len(units) == 5
+
+    units = list(get_work_units(tasks, {path: 1 for path in sizes}, n_workers=1, max_tasks=2))
+    assert [len(unit) for unit in units] == [2, 2, 1]
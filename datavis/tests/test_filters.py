@@ -0,0 +1,44 @@
+import copy
+import yaml
+import numpy as np
+from pathlib import Path
+from scipy.signal import sosfilt
+from datavis import fingerprints
+from datavis.filters import butter_sos, filter_signal, get_band_filter, SosFilter
+
+config_path = Path(__file__).parents[1] / 'config.yaml'
+
+
+def test_block_filter_matches_whole_signal():
+    fs = 16000
+    sos = butter_sos(fs, 500, 4000, 6)
+    assert butter_sos(fs, 500, 4000, 6) is sos
+    assert butter_sos(fs, 0, fs // 2) is None
+
+    rng = np.random.RandomState(0)
+    Y = rng.randn(2, 3 * fs).astype('float32')
+    expected = sosfilt(sos, Y, axis=-1)
+    assert np.allclose(filter_signal(Y, sos, block=1000), expected, atol=1e-5)
+    band = SosFilter(sos)
+    blocks = [band(Y[0, start:start + 777]) for start in range(0, Y.shape[1], 777)]
+    assert np.allclose(np.concatenate(blocks), expected[0], atol=1e-5)
+
+    t = np.arange(fs) / fs
+    low = filter_signal(np.sin(2 * np.pi * 50 * t), butter_sos(fs, 500, None))
+    high = filter_signal(np.sin(2 * np.pi * 2000 * t), butter_sos(fs, 500, None))
+    assert np.abs(low[fs // 2:]).max() < 1e-3 and np.abs(high[fs // 2:]).max() > 0.9
+
+
+def test_filter_config_and_fingerprints():
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    assert get_band_filter(config, 16000) is None
+    before = fingerprints.feature_fingerprints(config)
+    without_section = copy.deepcopy(config)
+    del without_section['Filter']
+    assert fingerprints.feature_fingerprints(without_section) == before
+
+    config['Filter']['use'] = True
+    assert get_band_filter(config, 16000) is butter_sos(16000, config['Filter']['params']['lowcut'], None, 6)
+    after = fingerprints.feature_fingerprints(config)
+    assert all(after[key] != before[key] for key in before)
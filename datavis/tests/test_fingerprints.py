@@ -0,0 +1,43 @@
+import copy
+import yaml
+from pathlib import Path
+from datavis import fingerprints
+
+config_path = Path(__file__).parents[1] / 'config.yaml'
+
+
+def test_stale_features_and_merge():
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    before = fingerprints.feature_fingerprints(config)
+
+    changed = copy.deepcopy(config)
+    changed['Bioacoustic_features']['Acoustic_Complexity_Index']['params']['bin'] = 3
+    changed['YAAFE_features']['LPC']['use'] = True
+    after = fingerprints.feature_fingerprints(changed)
+    stale = fingerprints.stale_features(after, fingerprints.dumps(before))
+    assert stale == ['Bioacoustic_features/Acoustic_Complexity_Index', 'YAAFE_features/LPC']
+    assert fingerprints.stale_features(after, None) == list(after)
+
+    selected = fingerprints.select_features(changed, stale)
+    assert selected['YAAFE_features']['LPC']['use'] and not selected['YAAFE_features']['MFCC']['use']
+    assert not selected['Bioacoustic_features']['Formants']['use']
+
+    old = {'Acoustic_Complexity_Index': 1.0, 'SNR': 2.0, 'formant_q25': 3.0, 'MFCC_q25': 4.0, 'Removed': 5.0}
+    new = {'Acoustic_Complexity_Index': 10.0, 'SNR': None, 'LPC_q25': 11.0, 'LPC_IQR': 12.0}
+    merged = fingerprints.merge_features(old, new, after, stale)
+    assert list(merged.items()) == [('Acoustic_Complexity_Index', 10.0), ('SNR', 2.0), ('formant_q25', 3.0),
+                                    ('LPC_q25', 11.0), ('LPC_IQR', 12.0), ('MFCC_q25', 4.0)]
+
+
+def test_precision_fingerprints():
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    before = fingerprints.feature_fingerprints(config)
+    without_precision = copy.deepcopy(config)
+    del without_precision['Precision']
+    assert fingerprints.feature_fingerprints(without_precision) == before
+
+    config['Precision'] = 'float64'
+    after = fingerprints.feature_fingerprints(config)
+    assert fingerprints.stale_features(after, fingerprints.dumps(before)) == list(before)
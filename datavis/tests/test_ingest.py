@@ -0,0 +1,37 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from datavis.audio_io import read_results
+from datavis.ingest import ingest_results
+from datavis.store import read_store, FILE_COLUMN
+
+pytest.importorskip('pyarrow')
+
+
+def write_result(path, values):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame(values, index=[0]).to_csv(path, index=False)
+
+
+def test_ingest_and_sync(tmp_path):
+    results, store = str(tmp_path / 'results'), str(tmp_path / 'store')
+    for i, time in enumerate(pd.date_range('2020-01-01 23:50', periods=20, freq='1T')):
+        name = time.strftime('site/%Y/rec-%Y-%m-%dT%H-%M-%S.csv' if i % 2 else 'rec-%Y-%m-%dT%H-%M-%S.csv')
+        write_result(os.path.join(results, name), {'a': i * 0.5, 'b': -i})
+    assert ingest_results(results, store, chunk_files=7) == 20
+    assert ingest_results(results, store) == 0
+
+    changed = os.path.join(results, 'rec-2020-01-01T23-50-00.csv')
+    write_result(changed, {'a': 100., 'b': 1.})
+    os.utime(changed, (0, 1))
+    write_result(os.path.join(results, 'rec-2020-01-03T00-00-00.csv'), {'a': 1., 'b': 2., 'c': 3.})
+    assert ingest_results(results, store) == 2
+
+    ingested = read_store(store)
+    expected = read_results(results)
+    assert (ingested.index == expected.index).all()
+    assert ingested.dtypes.eq(np.float32).all()
+    assert np.allclose(ingested[expected.columns].values, expected.values, equal_nan=True)
+    files = read_store(store, columns=[FILE_COLUMN])[FILE_COLUMN]
+    assert files.iloc[0] == os.path.splitext(changed)[0] + '.wav'
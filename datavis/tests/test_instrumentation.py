@@ -0,0 +1,40 @@
+import json
+import numpy as np
+import pytest
+from datavis.instrumentation import Profiler, ProfileReport, NULL_PROFILER, current_rss_mb
+
+
+def test_profile_report(tmp_path):
+    profiler = Profiler()
+    with profiler.stage('load'):
+        sum(range(10000))
+    with profiler.stage('bioacoustics'):
+        with profiler.stage('bioacoustics/ACI'):
+            sum(range(10000))
+    record = profiler.record(['a.wav'])
+    assert list(record['stages']) == ['load', 'bioacoustics/ACI', 'bioacoustics']
+    assert all(stage['wall'] > 0 for stage in record['stages'].values())
+    assert record['process_peak_rss_mb'] > 0
+    assert NULL_PROFILER.record(['a.wav']) is None
+
+    path = str(tmp_path / 'profile.jsonl')
+    with ProfileReport(path) as report:
+        report.add(record)
+        report.add(None)
+        assert 'bioacoustics/ACI' in report.summary()
+    with open(path) as f:
+        lines = [json.loads(line) for line in f]
+    assert lines == [json.loads(json.dumps(record))]
+
+
+def test_stage_rss_delta():
+    if current_rss_mb() == 0:
+        pytest.skip('The current RSS is read from /proc')
+    profiler = Profiler()
+    with profiler.stage('kept'):
+        kept = np.ones(2 ** 26 // 8)
+    with profiler.stage('freed'):
+        np.ones(2 ** 26 // 8).sum()
+    assert profiler.stages['kept']['rss_delta_mb'] > 48
+    assert abs(profiler.stages['freed']['rss_delta_mb']) < 16
+    del kept
@@ -0,0 +1,108 @@
+import os
+import pytest
+from datavis.ledger import Ledger, DONE, PENDING, FAILED, CSV_OUTPUT
+
+
+def touch(path, content=b'RIFF'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as fo:
+        fo.write(content)
+
+
+def test_scan_and_resume(tmp_path):
+    root = str(tmp_path)
+    touch(os.path.join(root, 'a.wav'))
+    touch(os.path.join(root, 'sub', 'b.wav'))
+    touch(os.path.join(root, 'sub', 'c.wav'))
+    touch(os.path.join(root, 'sub', 'c.csv'))
+
+    with Ledger(root) as ledger:
+        ledger.scan()
+        assert ledger.counts() == {PENDING: 2, DONE: 1}
+        assert ledger.files(pending_only=True) == [os.path.join(root, 'a.wav'), os.path.join(root, 'sub', 'b.wav')]
+
+        ledger.mark([(os.path.join(root, 'a.wav'), None), (os.path.join(root, 'sub', 'b.wav'), 'ValueError()')])
+        assert ledger.counts() == {DONE: 2, FAILED: 1}
+
+    os.remove(os.path.join(root, 'sub', 'c.wav'))
+    touch(os.path.join(root, 'sub', 'new', 'd.wav'))
+    with Ledger(root) as ledger:
+        ledger.scan()
+        assert ledger.files(pending_only=True) == [os.path.join(root, 'sub', 'b.wav'),
+                                                   os.path.join(root, 'sub', 'new', 'd.wav')]
+        assert len(ledger.files()) == 3
+
+
+def test_resume_results_without_fingerprints(tmp_path):
+    pytest.importorskip('yaafelib')
+    import yaml
+    import numpy as np
+    import soundfile as sf
+    from pathlib import Path
+    from datavis import fingerprints
+    from datavis.features import wav_dir_to_features
+
+    root = str(tmp_path)
+    for name in ['a', 'b', 'c']:
+        sf.write(os.path.join(root, name + '.wav'), np.zeros(16000), 16000)
+        with open(os.path.join(root, name + '.csv'), 'w') as fo:
+            fo.write('Acoustic_Complexity_Index\n1.0\n')
+
+    config_path = str(Path(__file__).parents[1] / 'config.yaml')
+    wav_dir_to_features(root, config_path, n_jobs=1, resume=True)
+    for name in ['a', 'b', 'c']:
+        with open(os.path.join(root, name + '.csv')) as fo:
+            assert fo.read() == 'Acoustic_Complexity_Index\n1.0\n'
+    with open(config_path) as f:
+        current = fingerprints.dumps(fingerprints.feature_fingerprints(yaml.load(f, Loader=yaml.FullLoader)))
+    with Ledger(root) as ledger:
+        assert ledger.counts() == {DONE: 3} and ledger.outdated(current) == {}
+        assert set(stored for _, stored in ledger.connection.execute('SELECT path, fingerprints FROM files')) == \
+            {current}
+
+
+def test_retarget_output(tmp_path):
+    root = str(tmp_path)
+    a, b, c = (os.path.join(root, name + '.wav') for name in 'abc')
+    for path in (a, b, c):
+        touch(path)
+    touch(os.path.join(root, 'c.csv'))
+
+    with Ledger(root) as ledger:
+        ledger.scan()
+        assert not ledger.retarget(CSV_OUTPUT, lambda: [])
+        assert ledger.done() == [c]
+        assert ledger.retarget('/stores/1', lambda: {a})
+        assert ledger.done() == [a] and ledger.pending() == [b, c]
+        ledger.mark([(b, None)])
+        assert not ledger.retarget('/stores/1', lambda: [])
+        assert ledger.done() == [a, b]
+        assert ledger.retarget('/stores/2', lambda: [])
+        assert ledger.done() == []
+        touch(os.path.join(root, 'sub', 'd.wav'))
+        touch(os.path.join(root, 'sub', 'd.csv'))
+        ledger.scan()
+        assert ledger.done() == []
+        assert ledger.retarget(CSV_OUTPUT, lambda: [c, os.path.join(root, 'sub', 'd.wav')])
+        assert ledger.done() == [c, os.path.join(root, 'sub', 'd.wav')]
+
+
+def test_resume_into_store_after_csv_run(tmp_path):
+    pytest.importorskip('yaafelib')
+    pytest.importorskip('pyarrow')
+    import numpy as np
+    import soundfile as sf
+    from pathlib import Path
+    from datavis.features import wav_dir_to_features
+    from datavis.store import read_store, FILE_COLUMN
+
+    root, store = str(tmp_path / 'audio'), str(tmp_path / 'store')
+    os.makedirs(root)
+    for name in ['rec-2020-01-01T00-00-00.wav', 'rec-2020-01-01T00-10-00.wav']:
+        sf.write(os.path.join(root, name), np.zeros(16000), 16000)
+    config_path = str(Path(__file__).parents[1] / 'config.yaml')
+    wav_dir_to_features(root, config_path, n_jobs=1, resume=False)
+    wav_dir_to_features(root, config_path, n_jobs=1, resume=True, store=store)
+    assert read_store(store, columns=[FILE_COLUMN])[FILE_COLUMN].nunique() == 2
+    wav_dir_to_features(root, config_path, n_jobs=1, resume=True, store=store)
+    assert len(read_store(store, columns=[FILE_COLUMN])) == 2
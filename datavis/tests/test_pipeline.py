@@ -0,0 +1,77 @@
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+import soundfile as sf
+from io import BytesIO
+from pathlib import Path
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+pytest.importorskip('yaafelib')
+
+from datavis.features import compute_features
+from datavis.pipeline import links_to_features
+from datavis.store import OFFSET_COLUMN
+from datavis.windows import set_windowing
+
+config_path = Path(__file__).parents[1] / 'config.yaml'
+FILES = {}
+
+
+class Handler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path not in FILES:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(FILES[self.path])))
+        self.end_headers()
+        self.wfile.write(FILES[self.path])
+
+
+def serve_links(tmp_path, config):
+    rng = np.random.RandomState(0)
+    for name in ['a-2020-01-01T00-00-00.wav', 'b-2020-01-01T00-01-00.wav']:
+        buffer = BytesIO()
+        sf.write(buffer, 0.1 * rng.randn(16000 * 3), 16000, format='WAV', subtype='PCM_16')
+        FILES['/' + name] = buffer.getvalue()
+
+    server = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_address[1]}'
+    links = [(url + path, path[1:]) for path in sorted(FILES)] + [(url + '/missing.wav', 'missing.wav')]
+    failed_log = str(tmp_path / 'failed.log')
+    try:
+        failed = links_to_features(links, str(tmp_path), config, n_jobs=1, download_jobs=2, buffers=1,
+                                   keep_audio=True, failed_log=failed_log)
+    finally:
+        server.shutdown()
+
+    assert failed == 1
+    with open(failed_log) as f:
+        assert f.read() == f'{url}/missing.wav,{tmp_path / "missing.wav"}\n'
+
+
+def test_links_to_features(tmp_path):
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    serve_links(tmp_path, config)
+    for path in sorted(FILES):
+        wav = str(tmp_path / path[1:])
+        result = pd.read_csv(os.path.splitext(wav)[0] + '.csv').iloc[0]
+        expected = compute_features(wav, config)
+        assert np.allclose([result[k] for k in expected], list(expected.values()))
+
+
+def test_windowed_links_to_features(tmp_path):
+    with open(config_path) as f:
+        config = set_windowing(yaml.load(f, Loader=yaml.FullLoader), 1)
+    serve_links(tmp_path, config)
+    for path in sorted(FILES):
+        result = pd.read_csv(str(tmp_path / path[1:-4]) + '.csv')
+        assert list(result[OFFSET_COLUMN]) == [0.0, 1.0, 2.0] and result.columns[0] == OFFSET_COLUMN
@@ -0,0 +1,77 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+from datavis.audio_io import read_results
+from datavis.pyramid import update_pyramid, read_level, mean_resample, nearest_level, PyramidException
+from datavis.store import FeatureStore, OFFSET_COLUMN
+
+pytest.importorskip('pyarrow')
+
+
+def write_results(directory, times, rng):
+    for time in times:
+        path = os.path.join(directory, time.strftime('rec-%Y-%m-%dT%H-%M-%S.csv'))
+        pd.DataFrame({'a': [rng.rand()], 'b': [rng.rand() if rng.rand() > 0.2 else np.nan]}).to_csv(path, index=False)
+
+
+def test_pyramid_matches_raw_results(tmp_path):
+    rng = np.random.RandomState(0)
+    times = pd.date_range('2020-01-31 22:00', periods=200, freq='90S')
+    write_results(str(tmp_path), times[:150], rng)
+    assert update_pyramid(str(tmp_path), [1, 10, 60]) == 150
+    assert update_pyramid(str(tmp_path)) == 0
+
+    write_results(str(tmp_path), times[140:], rng)
+    os.remove(os.path.join(str(tmp_path), times[3].strftime('rec-%Y-%m-%dT%H-%M-%S.csv')))
+    assert update_pyramid(str(tmp_path)) == 60
+
+    raw = read_results(str(tmp_path))
+    assert nearest_level([1, 10, 60], 30) == 10
+    for level in [1, 10, 60]:
+        resampled = mean_resample(read_level(str(tmp_path), level), 120)
+        expected = raw.resample('120T').mean()
+        assert (resampled.index == expected.index).all() and list(resampled.columns) == list(expected.columns)
+        assert np.allclose(resampled.values, expected.values, equal_nan=True)
+    hourly = read_level(str(tmp_path), 60)
+    assert hourly['a:count'].sum() == 199
+    assert np.allclose(hourly['a:max'], raw['a'].resample('60T').max())
+
+
+def test_windowed_results_refused(tmp_path):
+    csv_dir, store_dir = tmp_path / 'csv', str(tmp_path / 'store')
+    csv_dir.mkdir()
+    pd.DataFrame({'a': [0.5]}).to_csv(str(csv_dir / 'rec-2020-01-01T00-00-00.csv'), index=False)
+    assert update_pyramid(str(csv_dir), [1, 10]) == 1
+    pd.DataFrame({OFFSET_COLUMN: [0.0, 60.0], 'a': [0.1, 0.2]}).to_csv(str(csv_dir / 'rec-2020-01-01T00-10-00.csv'),
+                                                                     index=False)
+    with pytest.raises(PyramidException):
+        update_pyramid(str(csv_dir))
+
+    start = pd.Timestamp('2020-01-01 00:00')
+    with FeatureStore(store_dir) as store:
+        store.append(start, 'a.wav', {'a': 0.5})
+        store.append(start + pd.Timedelta('1min'), 'b.wav', {'a': 0.1})
+    assert update_pyramid(store_dir, [1, 10]) == 2
+    with FeatureStore(store_dir) as store:
+        store.append(start + pd.Timedelta('10min'), 'c.wav', {'a': 0.1})
+        store.append(start + pd.Timedelta('11min'), 'c.wav', {'a': 0.2})
+    with pytest.raises(PyramidException):
+        update_pyramid(store_dir)
+
+
+def test_store_pyramid_follows_rewritten_files(tmp_path):
+    store_dir = str(tmp_path)
+    start = pd.Timestamp('2020-01-01 00:00')
+    for i, name in enumerate(['a.wav', 'b.wav', 'c.wav']):
+        with FeatureStore(store_dir) as store:
+            store.append(start + pd.Timedelta(minutes=i), name, {'x': float(i)})
+    assert update_pyramid(store_dir, [1, 10]) == 3
+    assert update_pyramid(store_dir) == 0
+
+    with FeatureStore(store_dir) as store:
+        store.remove_files({'b.wav'})
+        store.append(start + pd.Timedelta(minutes=1), 'b.wav', {'x': 10.0})
+    assert update_pyramid(store_dir) == 1
+    assert read_level(store_dir, 1)['x:mean'].tolist() == [0.0, 10.0, 2.0]
+    assert read_level(store_dir, 10)['x:max'].tolist() == [10.0]
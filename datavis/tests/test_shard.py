@@ -0,0 +1,59 @@
+import os
+import numpy as np
+import pandas as pd
+import pytest
+import soundfile as sf
+from multiprocessing import Process
+from pathlib import Path
+from datavis.shard import parse_shard, shard_index, merge_shards
+
+pytest.importorskip('yaafelib')
+pytest.importorskip('pyarrow')
+
+from datavis.features import wav_dir_to_features
+from datavis.store import read_store, FILE_COLUMN
+
+config_path = str(Path(__file__).parents[1] / 'config.yaml')
+
+
+def run_shard(directory, store, shard):
+    wav_dir_to_features(directory, config_path, n_jobs=1, resume=False, store=store, shard=shard)
+
+
+def test_shards_and_merge(tmp_path):
+    assert parse_shard('2/3') == (2, 3)
+    for text in ['0/3', '4/3', '3']:
+        with pytest.raises(ValueError):
+            parse_shard(text)
+    assert shard_index('site/rec-2020-01-01T00-00-00.wav', 4) == shard_index('site/rec-2020-01-01T00-00-00.wav', 4)
+    assert {shard_index(f'rec-{i}.wav', 3) for i in range(30)} == {1, 2, 3}
+
+    directory, store = str(tmp_path / 'audio'), str(tmp_path / 'store')
+    rng = np.random.RandomState(0)
+    for i, time in enumerate(pd.date_range('2020-01-01 23:30', periods=9, freq='10T')):
+        path = os.path.join(directory, 'site' if i % 2 else '', time.strftime('rec-%Y-%m-%dT%H-%M-%S.wav'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        sf.write(path, 0.1 * rng.randn(8000), 16000)
+
+    processes = [Process(target=run_shard, args=(directory, store, (k, 3))) for k in (1, 2)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    report = merge_shards(directory, store, store=store)
+    missing = sorted(path for path in report['missing'] if shard_index(path, 3) == 3)
+    assert report['missing'] == missing and len(missing) > 0 and report['duplicated'] == []
+    assert report['merged'] == 9 - len(missing)
+
+    run_shard(directory, store, (3, 3))
+    run_shard(directory, store, (1, 2))
+    report = merge_shards(directory, store, store=store)
+    assert report['missing'] == []
+    assert report['duplicated'] == sorted(path for path in report['duplicated'] if shard_index(path, 2) == 1)
+    assert len(report['duplicated']) > 0 and report['merged'] == 9
+    merged = read_store(store, columns=[FILE_COLUMN])
+    assert len(merged) == 9 and merged[FILE_COLUMN].nunique() == 9 and merged.index.is_monotonic_increasing
+
+    run_shard(directory, None, (1, 1))
+    report = merge_shards(directory, str(tmp_path / 'from_csv'))
+    assert report['missing'] == [] and report['merged'] == 9
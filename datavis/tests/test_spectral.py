@@ -0,0 +1,52 @@
+import yaml
+import pytest
+import numpy as np
+from pathlib import Path
+from datavis import spectral
+from datavis.plan import build_plan
+
+config_path = Path(__file__).parents[1] / 'config.yaml'
+fs = 16000
+
+
+def test_scope_is_bound_to_signal():
+    y1 = np.random.RandomState(0).randn(fs).astype('float32')
+    y2 = np.random.RandomState(1).randn(fs).astype('float32')
+    scope = spectral.SpectralScope(y1, fs)
+    spec1, _ = scope.spectrogram(win_len=512, hop=256)
+    spec2, _ = spectral.get_scope(y2, fs, scope).spectrogram(win_len=512, hop=256)
+    assert not np.allclose(spec1, spec2)
+    assert spectral.get_scope(y1, fs, scope) is scope
+
+
+def test_plan_shares_intermediates():
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)['Bioacoustic_features']
+    plan = build_plan(config, fs)
+    unique = {key for keys in plan.values() for key in keys}
+    spectrograms = [key for key in unique if key[0] == 'spectrogram']
+    assert len(spectrograms) == 3
+    assert plan['Acoustic_Diversity_Index'] == plan['Acoustic_Evenness_Index']
+
+
+def test_fft_backends_agree():
+    y = np.random.RandomState(0).randn(fs + 123).astype('float32')
+    expected_spec, _ = spectral.spectrogram(y, fs)
+    expected_env = spectral.envelope(y)
+    backends = [('numpy', 1), ('scipy', 2)]
+    try:
+        import pyfftw
+        backends.append(('fftw', 2))
+    except ImportError:
+        pass
+    try:
+        for name, threads in backends:
+            spectral.set_fft_backend(name, threads)
+            spec, _ = spectral.spectrogram(y, fs)
+            assert np.allclose(spec, expected_spec, rtol=1e-4, atol=1e-4), name
+            assert np.allclose(spectral.envelope(y), expected_env, rtol=1e-4, atol=1e-4), name
+    finally:
+        spectral.set_fft_backend()
+    with pytest.raises(ValueError):
+        spectral.set_fft_backend('cufft')
+    assert spectral.fft_threads(4, 3) == 3 and spectral.fft_threads(10 ** 6) == 1
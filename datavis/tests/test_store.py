@@ -0,0 +1,20 @@
+import pytest
+import numpy as np
+from datetime import datetime
+from datavis.audio_io import read_results
+
+pytest.importorskip('pyarrow')
+from datavis.store import FeatureStore
+
+
+def test_store_roundtrip(tmp_path):
+    store_path = str(tmp_path / 'store')
+    times = [datetime(2020, 3, 17, 23, 55), datetime(2020, 3, 18, 0, 5), datetime(2020, 3, 17, 23, 50)]
+    with FeatureStore(store_path, rows_per_file=2) as store:
+        for i, time in enumerate(times):
+            store.append(timestamp=time, path=f'site/{i}.wav', features={'ACI': i + 0.5, 'SNR': 2.0 * i})
+    df = read_results(store_path)
+    assert list(df.index) == sorted(times)
+    assert df['ACI'].dtype == np.float32
+    assert list(df.columns) == ['ACI', 'SNR']
+    assert FeatureStore(store_path).processed_files() == {'site/0.wav', 'site/1.wav', 'site/2.wav'}
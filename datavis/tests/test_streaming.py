@@ -0,0 +1,34 @@
+import yaml
+import pytest
+import numpy as np
+from pathlib import Path
+from datavis.bioacoustics import get_bioacoustic_features
+
+pytest.importorskip('yaafelib')
+from datavis.streaming import StreamingExtractor
+
+config_path = Path(__file__).parents[1] / 'config.yaml'
+exact = ['Acoustic_Complexity_Index', 'Bioacoustic_Index', 'Spectral_entropy', 'SNR', 'Acoustic_activity',
+         'Acoustic_events_count', 'Event_average_duration', 'formant_len']
+
+
+@pytest.mark.parametrize('fs', [16000, 44100])
+@pytest.mark.parametrize('dtype', ['float32', 'float64'])
+def test_streaming_matches_in_memory(fs, dtype):
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    t = np.arange(6 * fs) / fs
+    y = (0.1 * np.random.RandomState(0).randn(len(t)) + 0.3 * np.sin(2 * np.pi * 3000 * t) * (t % 1 > 0.5))
+    y = y.astype('float32').astype(dtype)
+    expected = get_bioacoustic_features(y=y, fs=fs, config=config['Bioacoustic_features'])
+
+    extractor = StreamingExtractor(fs=fs, config=config)
+    block_len = int(0.37 * fs)
+    for start in range(0, len(y), block_len):
+        extractor.update(y[start: start + block_len])
+    result = extractor.result()
+
+    for name, value in expected.items():
+        # in float32 the in-memory path sums in single precision while the streams accumulate in float64
+        tolerance = (1e-9 if dtype == 'float64' else 1e-5) if name in exact else 1e-2
+        assert result[name] == pytest.approx(value, rel=tolerance, abs=1e-12), name
@@ -0,0 +1,100 @@
+import os
+import numpy as np
+import pytest
+import yaml
+import soundfile as sf
+from pathlib import Path
+
+pytest.importorskip('yaafelib')
+
+from datavis.ledger import Ledger, DONE
+from datavis.watch import Watcher
+
+config_path = Path(__file__).parents[1] / 'config.yaml'
+
+
+def test_watch_processes_stable_files(tmp_path):
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    rng = np.random.RandomState(0)
+    first = str(tmp_path / 'rec-2020-01-01T00-00-00.wav')
+    growing = str(tmp_path / 'day' / 'rec-2020-01-01T00-01-00.wav')
+    sf.write(first, 0.1 * rng.randn(16000 * 2), 16000)
+    with Ledger(str(tmp_path)) as ledger:
+        watcher = Watcher(str(tmp_path), config, n_jobs=1, ledger=ledger, settle=0)
+        assert watcher.poll() == 0 and not watcher.in_flight
+
+        os.makedirs(os.path.dirname(growing))
+        with open(growing, 'wb') as fo:
+            fo.write(b'RIFF')
+        watcher.poll(timeout=60)
+        assert [path for unit in watcher.in_flight.values() for paths in unit for path in paths] == []
+        assert watcher.processed == 1 and os.path.isfile(first[:-4] + '.csv')
+
+        sf.write(growing, 0.1 * rng.randn(16000 * 3), 16000)
+        assert watcher.ready_files() == []
+        for _ in range(60):
+            if watcher.processed == 2:
+                break
+            watcher.poll(timeout=1)
+        assert watcher.processed == 2 and os.path.isfile(growing[:-4] + '.csv')
+        assert ledger.counts() == {DONE: 2}
+        assert ledger.sizes()[growing] == os.path.getsize(growing)
+
+
+def test_watch_survives_crashes_and_retries_stalled_uploads(tmp_path):
+    from concurrent.futures import Future
+    from concurrent.futures.process import BrokenProcessPool
+    from datavis.ledger import FAILED, PENDING
+
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    stalled = str(tmp_path / 'rec-2020-01-01T00-00-00.wav')
+    with open(stalled, 'wb') as fo:
+        fo.write(b'RIFF')
+    with Ledger(str(tmp_path)) as ledger:
+        watcher = Watcher(str(tmp_path), config, n_jobs=1, ledger=ledger, settle=0)
+        crashed = Future()
+        crashed.set_exception(BrokenProcessPool('A worker died'))
+        watcher.in_flight[crashed] = [[stalled]]
+        assert watcher.poll() == 1 and not watcher.in_flight
+        assert ledger.counts() == {FAILED: 1}
+
+        watcher.poll()
+        assert ledger.counts() == {FAILED: 1}
+        sf.write(stalled, 0.1 * np.random.RandomState(0).randn(16000 * 2), 16000)
+        for _ in range(60):
+            if watcher.processed == 2:
+                break
+            watcher.poll(timeout=1)
+        assert watcher.processed == 2 and ledger.counts() == {DONE: 1}
+        assert os.path.isfile(stalled[:-4] + '.csv')
+        assert ledger.retry_changed() == [] and ledger.counts().get(PENDING) is None
+
+
+def test_watch_waits_for_stalled_uploads(tmp_path):
+    from io import BytesIO
+    from datavis.ledger import PENDING
+
+    with open(config_path) as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    buffer = BytesIO()
+    sf.write(buffer, 0.1 * np.random.RandomState(0).randn(16000 * 2), 16000, format='WAV', subtype='PCM_16')
+    data = buffer.getvalue()
+    path = str(tmp_path / 'rec-2020-01-01T00-00-00.wav')
+    with open(path, 'wb') as fo:
+        fo.write(data[:len(data) // 2])
+    with Ledger(str(tmp_path)) as ledger:
+        watcher = Watcher(str(tmp_path), config, n_jobs=1, ledger=ledger, settle=0)
+        for _ in range(3):
+            watcher.poll()
+        assert watcher.processed == 0 and not watcher.in_flight and ledger.counts() == {PENDING: 1}
+
+        with open(path, 'ab') as fo:
+            fo.write(data[len(data) // 2:])
+        for _ in range(60):
+            if watcher.processed == 1:
+                break
+            watcher.poll(timeout=1)
+        assert watcher.processed == 1 and ledger.counts() == {DONE: 1}
+        assert ledger.connection.execute('SELECT duration FROM files').fetchone()[0] == 2.0
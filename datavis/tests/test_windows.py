@@ -0,0 +1,62 @@
+import numpy as np
+import pandas as pd
+import pytest
+import yaml
+import soundfile as sf
+from pathlib import Path
+from datavis.windows import window_bounds, set_windowing, get_windowing
+from datavis.store import OFFSET_COLUMN
+
+pytest.importorskip('yaafelib')
+
+from datavis.features import signal_features, wav_dir_to_features
+
+config_path = str(Path(__file__).parents[1] / 'config.yaml')
+
+
+def load_config():
+    with open(config_path, 'r') as f:
+        return yaml.load(f, Loader=yaml.FullLoader)
+
+
+def test_windows_match_split_signal():
+    assert window_bounds(100, 10, 4, 2) == [(0, 40), (20, 60), (40, 80), (60, 100)]
+    assert window_bounds(30, 10, 4, 4) == [(0, 30)]
+    with pytest.raises(ValueError):
+        set_windowing(load_config(), 0)
+
+    # 8s windows at 16kHz start on multiples of the spectrogram hops, the ADI/AEI segment length and the YAAFE steps
+    fs = 16000
+    y = (0.1 * np.random.RandomState(0).randn(20 * fs)).astype(np.float32)
+    config = load_config()
+    assert get_windowing(config) is None
+    # YAAFE features with blocks longer than their step (the CQT of Chroma2) read the neighbouring windows near the
+    # edges of a window and are only approximated, their columns are not compared
+    approximated = tuple(name for name, feature in config['YAAFE_features'].items()
+                         if feature['params'].get('blockSize') != feature['params'].get('stepSize'))
+    whole = {start: signal_features(y[start:start + 8 * fs], fs, config) for start in (0, 8 * fs)}
+    rows = signal_features(y, fs, set_windowing(config, 8))
+    assert [row[OFFSET_COLUMN] for row in rows] == [0.0, 8.0]
+    for row in rows:
+        expected = whole[int(row.pop(OFFSET_COLUMN) * fs)]
+        assert list(row) == list(expected)
+        for column, value in row.items():
+            if value is not None and not column.startswith(approximated):
+                assert value == pytest.approx(expected[column], rel=1e-5, nan_ok=True), column
+
+    assert [row[OFFSET_COLUMN] for row in signal_features(y, fs, set_windowing(config, 8, 4))] == [0.0, 4.0, 8.0, 12.0]
+
+
+def test_windowed_store(tmp_path):
+    pytest.importorskip('pyarrow')
+    from datavis.store import read_store, FILE_COLUMN
+
+    rng = np.random.RandomState(0)
+    for name in ['rec-2020-01-01T23-59-50.wav', 'rec-2020-01-02T00-10-00.wav']:
+        sf.write(str(tmp_path / name), 0.1 * rng.randn(16000 * 25), 16000)
+    store = str(tmp_path / 'store')
+    wav_dir_to_features(str(tmp_path), config_path, n_jobs=1, resume=False, store=store, window=10)
+    df = read_store(store, columns=[FILE_COLUMN, 'Acoustic_Complexity_Index'])
+    assert list(df.index) == list(pd.to_datetime(['2020-01-01 23:59:50', '2020-01-02 00:00:00',
+                                                  '2020-01-02 00:10:00', '2020-01-02 00:10:10']))
+    assert df[FILE_COLUMN].nunique() == 2 and OFFSET_COLUMN not in df
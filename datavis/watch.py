@@ -0,0 +1,161 @@
+"""
+Watch mode: a long-running process that computes features of recordings as they arrive.
+
+Every poll rescans the input directory with the ledger (which only lists directories whose mtime changed) and stats
+the pending files. A file is dispatched once its size and mtime are unchanged since the previous poll and it has not
+been modified for a settle time, so recordings still being uploaded are left alone. Files holding less data than
+their WAVE header announces (uploads that stalled for longer than the settle time) are held back until the rest
+arrives. Failed files are retried once their size or mtime changes. Workers of the pool are started once and keep
+their YAAFE engines loaded between files; a pool broken by a crashed worker fails the files in flight and is
+replaced.
+"""
+
+import os
+import time
+import struct
+import signal
+import logging
+from concurrent.futures import wait, FIRST_COMPLETED
+from joblib import effective_n_jobs
+from joblib.externals.loky import get_reusable_executor
+from datavis import fingerprints
+from datavis.features import _init_worker, process_unit, collect_results, get_tasks, get_work_units, retarget_ledger
+from datavis.spectral import fft_threads, DEFAULT_FFT_BACKEND
+from datavis.audio_io import probe_wav, AudioIOException
+from datavis.ledger import Ledger
+from datavis.store import FeatureStore
+
+
+class Watcher(object):
+    """
+    Polls a directory and processes new recordings in a warm worker pool
+    :param interval: seconds between polls
+    :param settle: seconds a file must be left unmodified before it is processed
+    :param flush_interval: seconds between flushes of the rows buffered for the store (if any)
+    :param fft: FFT backend of the workers
+    :param threads: FFT threads per worker, by default the cores are shared among the workers
+    """
+    def __init__(self, directory: str, config: dict, n_jobs: int, ledger: Ledger, store: FeatureStore = None,
+                 stream_block: float = None, interval: float = 5, settle: float = 10, flush_interval: float = 60,
+                 fft: str = DEFAULT_FFT_BACKEND, threads: int = None):
+        self.directory = directory
+        self.ledger = ledger
+        self.ledger.scan(verbose=False)
+        retarget_ledger(ledger, store.path if store is not None else None)
+        self.store = store
+        self.interval = interval
+        self.settle = settle
+        self.flush_interval = flush_interval
+        self.n_workers = effective_n_jobs(n_jobs)
+        self._pool = dict(max_workers=self.n_workers, initializer=_init_worker,
+                          initargs=(config, stream_block, store is None, False,
+                                    (fft, fft_threads(self.n_workers, threads))))
+        get_reusable_executor(**self._pool)
+        self.current = fingerprints.dumps(fingerprints.feature_fingerprints(config))
+        self.in_flight = {}
+        self.processed = 0
+        self._seen = {}
+        self._flushed = time.time()
+        self._stopped = False
+
+    def ready_files(self, now: float = None) -> list:
+        """
+        :return: pending files not in flight whose size and mtime are unchanged since the previous call, that were
+        last modified at least settle seconds ago and that hold all the data their header announces
+        """
+        now = time.time() if now is None else now
+        in_flight = set(path for unit in self.in_flight.values() for paths in unit for path in paths)
+        seen, ready = {}, []
+        for path in self.ledger.pending():
+            if path in in_flight:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            seen[path] = (stat.st_size, stat.st_mtime)
+            if self._seen.get(path) == seen[path] and now - stat.st_mtime >= self.settle and not self._truncated(path):
+                ready.append(path)
+        self._seen = seen
+        return ready
+
+    @staticmethod
+    def _truncated(path: str) -> bool:
+        try:
+            return probe_wav(path).truncated
+        except (AudioIOException, OSError, struct.error):
+            # not a WAVE file the header can be read from, processing reports the error
+            return False
+
+    def poll(self, timeout: float = 0) -> int:
+        """
+        Scan for new files, dispatch the ready ones and collect the results completed within timeout seconds
+        :return: number of files whose results were collected
+        """
+        self.ledger.scan(verbose=False)
+        retried = self.ledger.retry_changed()
+        if retried:
+            logging.info(f'Retrying {len(retried)} failed files that changed since they were processed')
+        ready = self.ready_files()
+        if ready:
+            self.ledger.refresh(ready)
+            sizes = {path: self._seen[path][0] for path in ready}
+            # Returns the running pool, or a new one if a crashed worker broke it
+            executor = get_reusable_executor(**self._pool)
+            for unit in get_work_units(get_tasks(ready, 1, sizes), sizes, self.n_workers):
+                self.in_flight[executor.submit(process_unit, unit, {})] = unit
+        collected = 0
+        if self.in_flight:
+            done, _ = wait(list(self.in_flight), timeout=timeout, return_when=FIRST_COMPLETED)
+            collected = self._collect(done)
+        elif timeout:
+            time.sleep(timeout)
+        if self.store is not None and time.time() - self._flushed >= self.flush_interval:
+            self.store.flush()
+            self._flushed = time.time()
+        return collected
+
+    def _collect(self, futures) -> int:
+        outcomes = []
+        for future in futures:
+            unit = self.in_flight.pop(future)
+            if future.exception() is not None:
+                logging.error(f'Worker failed processing {unit}: {future.exception()!r}')
+                outcomes.extend((path, repr(future.exception())) for paths in unit for path in paths)
+                continue
+            outcomes.extend(collect_results(unit, future.result(), self.store))
+        if outcomes:
+            self.ledger.mark(outcomes, fingerprints=self.current)
+            failed = sum(1 for _, error in outcomes if error is not None)
+            latency = time.time() - min(self._mtime(path) for path, _ in outcomes)
+            logging.info(f'Processed {len(outcomes)} files ({failed} failed), {latency:.1f}s since the oldest was '
+                         f'written')
+        self.processed += len(outcomes)
+        return len(outcomes)
+
+    @staticmethod
+    def _mtime(path: str) -> float:
+        try:
+            return os.stat(path).st_mtime
+        except FileNotFoundError:
+            return time.time()
+
+    def stop(self, *args):
+        self._stopped = True
+
+    def run(self):
+        """
+        Poll until interrupted (Ctrl+C or SIGTERM), then wait for the files in flight
+        """
+        signal.signal(signal.SIGTERM, self.stop)
+        logging.info(f'Watching {self.directory} every {self.interval}s with {self.n_workers} workers')
+        try:
+            while not self._stopped:
+                self.poll(timeout=self.interval)
+        except KeyboardInterrupt:
+            pass
+        logging.info(f'Stopping, waiting for {len(self.in_flight)} units in flight')
+        self._collect(wait(list(self.in_flight))[0])
+        if self.store is not None:
+            self.store.flush()
+        logging.info(f'Processed {self.processed} files')
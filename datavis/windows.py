@@ -0,0 +1,49 @@
+"""
+Windowed results (a2f --window / --hop): features of consecutive windows of every recording instead of the whole
+recording, computed in a single pass (see features.windowed_features). The spectrograms of the bioacoustic features
+are computed once for the whole signal and sliced per window (see spectral.WindowScope) and YAAFE processes the signal
+once, its frames being grouped by window. Every window gives a row starting with its offset (in seconds) from the start
+of the recording. Windows starting on a multiple of the spectrogram hops and YAAFE steps give the same bioacoustic
+features, and the same YAAFE features whose block equals their step, as splitting the recording into files of one
+window. YAAFE features with longer blocks (Chroma2) differ near the window edges, where they read the neighbouring
+windows instead of zero padding (see YaafeWrapper.compute_window_stats). Audio after the last full window is dropped.
+"""
+
+from typing import Optional
+
+# Section of the config with the window and hop (in seconds) of windowed results
+WINDOW_SECTION = 'Window'
+
+
+def get_windowing(config: dict) -> Optional[tuple]:
+    """
+    :param config: config dictionary
+    :return: window and hop in seconds, None if features are computed over whole recordings
+    """
+    section = config.get(WINDOW_SECTION)
+    if not section or not section['use']:
+        return None
+    params = section['params']
+    return params['window'], params.get('hop') or params['window']
+
+
+def set_windowing(config: dict, window: float, hop: float = None) -> dict:
+    """
+    :param hop: seconds between the starts of consecutive windows, window (no overlap) if None
+    :return: the config with windowed results turned on
+    """
+    if window <= 0 or (hop is not None and hop <= 0):
+        raise ValueError(f'Window and hop must be positive, got {window} and {hop}')
+    config[WINDOW_SECTION] = {'use': True, 'params': {'window': window, 'hop': hop or window}}
+    return config
+
+
+def window_bounds(n_samples: int, fs: int, window: float, hop: float) -> list:
+    """
+    :return: list of (start, stop) samples of the full windows of a signal; a signal shorter than a window is a single
+    window
+    """
+    length, step = int(round(window * fs)), int(round(hop * fs))
+    if n_samples <= length:
+        return [(0, n_samples)]
+    return [(start, start + length) for start in range(0, n_samples - length + 1, step)]
@@ -1,15 +1,44 @@
+import json
+import hashlib
 import numpy as np
 import yaafelib
 from scipy.stats import median_absolute_deviation
 
+# Frame step of YAAFE features whose config has no stepSize
+YAAFE_DEFAULT_STEP = 512
+
+
+def get_feature_specs(config: dict) -> dict:
+    """
+    Translate the 'YAAFE_features' section of the config into YAAFE feature definitions
+    :param config: config dictionary
+    :return: dictionary feature name -> YAAFE parameter string of all features in use
+    """
+    yaafe_config = {}
+    for feature_name, feature_params in config.items():
+        if feature_params['use']:
+            specs = feature_name + ' ' + str(feature_params['params']).replace("'", '').replace(",", "").replace(": ", "=")[1:-1]
+            yaafe_config[feature_name] = specs
+    return yaafe_config
+
+
+def get_config_hash(config: dict) -> str:
+    specs = get_feature_specs(config)
+    return hashlib.md5(json.dumps(specs, sort_keys=True).encode('utf8')).hexdigest()
+
+
+def engine_input(audio_data: np.ndarray) -> np.ndarray:
+    """
+    YAAFE only accepts contiguous float64 arrays of shape (1, samples); float32 audio is converted, float64 audio is
+    passed without a copy
+    """
+    return np.ascontiguousarray(audio_data.reshape(1, -1), dtype=np.float64)
+
 
 class YaafeWrapper(object):
     def __init__(self, fs: int, config: dict):
-        yaafe_config = {}
-        for feature_name, feature_params in config.items():
-            if feature_params['use']:
-                specs = feature_name + ' ' + str(feature_params['params']).replace("'", '').replace(",", "").replace(": ", "=")[1:-1]
-                yaafe_config[feature_name] = specs
+        yaafe_config = get_feature_specs(config)
+        self.steps = {name: int(config[name]['params'].get('stepSize', YAAFE_DEFAULT_STEP)) for name in yaafe_config}
 
         if yaafe_config:
             feature_plan = yaafelib.FeaturePlan(sample_rate=fs, normalize=True)
@@ -22,23 +51,111 @@ class YaafeWrapper(object):
             self.engine = None
 
     def compute_features(self, audio_data: np.ndarray) -> dict:
-        features = self.engine.processAudio(audio_data.reshape(1, -1).astype('float64'))
+        features = self.engine.processAudio(engine_input(audio_data))
         return features
 
     def compute_feature_stats(self, audio_data: np.ndarray) -> dict:
-        features = self.engine.processAudio(audio_data.reshape(1, -1).astype('float64'))
-
-        flat_dict = {}
-        for name, values in features.items():
-            if values.shape[1] == 1:
-                flat_dict[f'{name}'] = values.mean()
-            else:
-                temporal_mean = values.mean(axis=0)
-                q25, q50, q75 = np.quantile(temporal_mean, [0.25, 0.50, 0.75])
-                flat_dict[name + '_q25'] = q25
-                flat_dict[name + '_q50'] = q50
-                flat_dict[name + '_q75'] = q75
-                flat_dict[name + '_MAD'] = median_absolute_deviation(temporal_mean)
-                flat_dict[name + '_IQR'] = q75 - q25
-
-        return flat_dict
+        if self.engine is None:
+            return {}
+        features = self.engine.processAudio(engine_input(audio_data))
+        return feature_stats({name: values.mean(axis=0) for name, values in features.items()})
+
+    def compute_window_stats(self, audio_data: np.ndarray, bounds: list) -> list:
+        """
+        Statistics of windows of the signal from a single pass of the engine; a frame belongs to the windows it starts
+        in. For features whose block equals their step (blockSize == stepSize), windows on frame boundaries get the
+        frames the engine would compute on the window on its own. Features with longer blocks (e.g. Chroma2, whose CQT
+        block at a 27.5Hz minimum frequency spans seconds) are approximated: frames near the edges of a window read the
+        audio of the neighbouring windows where the window on its own is zero padded
+        :param bounds: list of (start, stop) samples of the windows
+        :return: list of dictionaries column name -> value in the order of bounds
+        """
+        if self.engine is None:
+            return [{} for _ in bounds]
+        features = self.engine.processAudio(engine_input(audio_data))
+        rows = []
+        for start, stop in bounds:
+            means = {}
+            for name, values in features.items():
+                step = self.steps[name]
+                means[name] = values[-(-start // step):-(-stop // step)].mean(axis=0)
+            rows.append(feature_stats(means))
+        return rows
+
+    def stream(self) -> 'YaafeStream':
+        return YaafeStream(self.engine)
+
+
+class YaafeStream(object):
+    """
+    Feeds the engine block by block and aggregates the temporal means of its outputs on the fly, so the statistics
+    equal those of compute_feature_stats on the concatenated blocks without holding the whole signal
+    """
+    def __init__(self, engine):
+        self.engine = engine
+        self.sums = {}
+        self.counts = {}
+        if self.engine is not None:
+            self.engine.reset()
+
+    def _accumulate(self, outputs: dict):
+        for name, values in outputs.items():
+            self.sums[name] = self.sums.get(name, 0) + values.sum(axis=0)
+            self.counts[name] = self.counts.get(name, 0) + values.shape[0]
+
+    def update(self, block: np.ndarray):
+        if self.engine is None:
+            return
+        self.engine.writeInput('audio', engine_input(block))
+        self.engine.process()
+        self._accumulate(self.engine.readAllOutputs())
+
+    def result(self) -> dict:
+        if self.engine is None:
+            return {}
+        self.engine.flush()
+        self._accumulate(self.engine.readAllOutputs())
+        return feature_stats({name: np.atleast_1d(self.sums[name] / self.counts[name]) for name in self.sums})
+
+
+def feature_stats(temporal_means: dict) -> dict:
+    """
+    Flatten the temporal means of YAAFE outputs; multidimensional features are summarised by quartiles, MAD and IQR
+    :param temporal_means: dictionary feature name -> mean over frames (one value per dimension)
+    :return: dictionary column name -> value
+    """
+    flat_dict = {}
+    for name, temporal_mean in temporal_means.items():
+        if temporal_mean.size == 1:
+            flat_dict[f'{name}'] = temporal_mean.mean()
+        else:
+            q25, q50, q75 = np.quantile(temporal_mean, [0.25, 0.50, 0.75])
+            flat_dict[name + '_q25'] = q25
+            flat_dict[name + '_q50'] = q50
+            flat_dict[name + '_q75'] = q75
+            flat_dict[name + '_MAD'] = median_absolute_deviation(temporal_mean)
+            flat_dict[name + '_IQR'] = q75 - q25
+
+    return flat_dict
+
+
+# Engines loaded in this process, keyed by (sampling rate, config hash). Loky reuses its worker processes between
+# tasks, so every worker builds the engine for a given site once and reuses it for all the files that follow.
+_ENGINE_POOL = {}
+
+
+def get_yaafe_wrapper(fs: int, config: dict) -> YaafeWrapper:
+    """
+    Return the YAAFE wrapper of this process for the given sampling rate and config, loading it on first use
+    :param fs: sampling (in Hz)
+    :param config: 'YAAFE_features' section of the config
+    :return: YaafeWrapper with a loaded engine
+    """
+    key = (int(fs), get_config_hash(config))
+    if key not in _ENGINE_POOL:
+        _ENGINE_POOL[key] = YaafeWrapper(fs=fs, config=config)
+    return _ENGINE_POOL[key]
+
+
+def clear_yaafe_pool():
+    _ENGINE_POOL.clear()
@@ -1,12 +1,56 @@
 #!/usr/bin/env python3
 
+import csv
 import time
+import yaml
 import click
 import logging
+from contextlib import ExitStack
 from datavis.common import setup_logging
 from datavis.features import wav_dir_to_features
-from datavis.audio_io import read_results
-from datavis.audio_vis import save_heatmap_with_datetime, SUPPORTED_FORMATS, save_corr_matrix
+from datavis.download import read_links
+from datavis.pipeline import links_to_features, remove_processed
+from datavis.store import FeatureStore
+from datavis.ledger import Ledger
+from datavis.watch import Watcher
+from datavis.ingest import ingest_results
+from datavis.audio_io import iter_results
+from datavis.chunked import OnlineStats, resample_chunks
+from datavis.pyramid import DEFAULT_LEVELS, has_pyramid, pyramid_levels, nearest_level, update_pyramid, read_level, \
+    mean_resample, PyramidException
+from datavis.windows import get_windowing
+from datavis.audio_vis import save_heatmap_with_datetime, SUPPORTED_FORMATS, ENVELOPES, save_corr_matrix
+from datavis.spectral import FFT_BACKENDS, DEFAULT_FFT_BACKEND
+from datavis.shard import parse_shard, merge_shards
+from datavis.admission import parse_memory
+
+
+def check_fft_backend(ctx, param, value):
+    try:
+        FFT_BACKENDS[value]()
+    except ImportError as ex:
+        raise click.BadParameter(str(ex))
+    return value
+
+
+def check_shard(ctx, param, value):
+    try:
+        return parse_shard(value) if value is not None else None
+    except ValueError as ex:
+        raise click.BadParameter(str(ex))
+
+
+def check_memory(ctx, param, value):
+    try:
+        return parse_memory(value) if value is not None else None
+    except ValueError as ex:
+        raise click.BadParameter(str(ex))
+
+
+def check_seconds(ctx, param, value):
+    if value is not None and value <= 0:
+        raise click.BadParameter(f'must be a positive number of seconds, got {value}')
+    return value
 
 
 @click.group()
@@ -27,26 +71,236 @@ def cli(quiet):
 @click.option("--config", "-c", type=click.Path(exists=True), default='datavis/config.yaml',
               help="File with configuration parameters for the algorithm.")
 @click.option('--resume', default=False, is_flag=True, help='Resume processing')
-def audio_to_features(input, jobs, config, resume):
+@click.option("--store", type=click.Path(file_okay=False), default=None,
+              help="Write features into a columnar (Parquet) store in this directory instead of a CSV next to every "
+                   "input file.")
+@click.option("--stream-block", type=click.FLOAT, default=None,
+              help="Read every file in blocks of this many seconds and compute features incrementally. Bounds the "
+                   "memory of a job independently of the duration of the recordings.")
+@click.option("--batch-size", type=click.INT, default=1, show_default=True,
+              help="Compute bioacoustic features of up to this many files with the same sampling rate and length at "
+                   "once. Ignored with --stream-block.")
+@click.option("--profile", type=click.Path(dir_okay=False), default=None,
+              help="Time every stage (and bioacoustic feature) of every task: wall time, CPU time and RSS change of "
+                   "every stage and the peak RSS of the worker are appended as JSON lines to this file and summarised "
+                   "in the log at the end of the run.")
+@click.option('--pyramid', default=False, is_flag=True,
+              help='Update the feature pyramid (see the pyramid command) with the new results at the end of the run.')
+@click.option("--fft", type=click.Choice(list(FFT_BACKENDS)), default=DEFAULT_FFT_BACKEND, show_default=True,
+              callback=check_fft_backend,
+              help="FFT backend of spectrograms and envelopes. fftw needs pyFFTW and reuses its plans between files.")
+@click.option("--fft-threads", type=click.INT, default=None,
+              help="Threads of every FFT. Defaults to the cores divided by the number of jobs, so that jobs and "
+                   "threads do not oversubscribe the cores.")
+@click.option("--shard", type=click.STRING, default=None, callback=check_shard,
+              help="K/N: process only shard K (from 1) of N of the files, chosen by a hash of their path, e.g. on one "
+                   "of N nodes sharing the input. Every shard has its own ledger and store; combine them with merge.")
+@click.option("--max-memory", type=click.STRING, default=None, callback=check_memory,
+              help="Memory budget of the files being processed, e.g. 16G. The peak memory of every file is estimated "
+                   "from its header and files enter the pool while the sum of the estimates stays within the budget; "
+                   "files exceeding it alone are streamed (in blocks of --stream-block or 60 seconds).")
+@click.option("--window", type=click.FLOAT, default=None, callback=check_seconds,
+              help="Compute features of consecutive windows of this many seconds of every file, one row per window "
+                   "stamped with the time in the file name plus the offset of the window. Spectrograms and YAAFE are "
+                   "computed once per file.")
+@click.option("--hop", type=click.FLOAT, default=None, callback=check_seconds,
+              help="Seconds between the starts of consecutive windows. Defaults to --window (no overlap).")
+def audio_to_features(input, jobs, config, resume, store, stream_block, batch_size, profile, pyramid, fft,
+                      fft_threads, shard, max_memory, window, hop):
+    if shard is not None and pyramid:
+        raise click.UsageError('--pyramid cannot be combined with --shard, build the pyramid after merge')
+    if hop is not None and window is None:
+        raise click.UsageError('--hop requires --window')
+    if window is not None and stream_block:
+        raise click.UsageError('--window cannot be combined with --stream-block')
+    if pyramid:
+        with open(config, 'r') as f:
+            windowed = get_windowing(yaml.load(f, Loader=yaml.FullLoader)) is not None
+        if window is not None or windowed:
+            raise click.UsageError('--pyramid cannot be combined with windowed features (--window or the Window '
+                                   'section of the config), the pyramid expects one row per file')
+    start_time = time.time()
+    wav_dir_to_features(directory=input, config=config, n_jobs=jobs, resume=resume, store=store,
+                        stream_block=stream_block, batch_size=batch_size, profile=profile, fft=fft,
+                        fft_threads=fft_threads, shard=shard, max_memory=max_memory, window=window, hop=hop)
+    if pyramid:
+        update_pyramid(store or input)
+    logging.info(f'Total time: {time.time() - start_time:.2f}s')
+
+
+@cli.command('watch', help='Watch a directory and compute features of recordings as they arrive. Files are processed '
+                            'once their size has been stable for --settle seconds, by workers started once for the '
+                            'whole session. Stop with Ctrl+C.')
+@click.option("--input", "-in", type=click.Path(exists=True, file_okay=False), required=True,
+              help="Path to a directory with audio in WAV format.")
+@click.option("--jobs", "-j", type=click.INT, default=-1, help="Number of jobs to run. Defaults to all cores",
+              show_default=True)
+@click.option("--config", "-c", type=click.Path(exists=True), default='datavis/config.yaml',
+              help="File with configuration parameters for the algorithm.")
+@click.option("--store", type=click.Path(file_okay=False), default=None,
+              help="Write features into a columnar (Parquet) store in this directory instead of a CSV next to every "
+                   "input file.")
+@click.option("--stream-block", type=click.FLOAT, default=None,
+              help="Read every file in blocks of this many seconds and compute features incrementally.")
+@click.option("--interval", type=click.FLOAT, default=5, show_default=True, help="Seconds between polls.")
+@click.option("--settle", type=click.FLOAT, default=10, show_default=True,
+              help="Seconds a file must be left unmodified before it is processed.")
+@click.option("--flush-interval", type=click.FLOAT, default=60, show_default=True,
+              help="Seconds between writes of the rows buffered for the store.")
+@click.option("--fft", type=click.Choice(list(FFT_BACKENDS)), default=DEFAULT_FFT_BACKEND, show_default=True,
+              callback=check_fft_backend,
+              help="FFT backend of spectrograms and envelopes. fftw needs pyFFTW and reuses its plans between files.")
+@click.option("--fft-threads", type=click.INT, default=None,
+              help="Threads of every FFT. Defaults to the cores divided by the number of jobs, so that jobs and "
+                   "threads do not oversubscribe the cores.")
+def watch(input, jobs, config, store, stream_block, interval, settle, flush_interval, fft, fft_threads):
+    with open(config, 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    with ExitStack() as stack:
+        ledger = stack.enter_context(Ledger(input))
+        feature_store = stack.enter_context(FeatureStore(store)) if store is not None else None
+        Watcher(input, config, n_jobs=jobs, ledger=ledger, store=feature_store, stream_block=stream_block,
+                interval=interval, settle=settle, flush_interval=flush_interval, fft=fft, threads=fft_threads).run()
+
+
+@cli.command('d2f', help='Download to Features. Downloads the files of a link list (as used by download.py) into memory and '
+                         'calculates their features on the fly, saving only the results.')
+@click.option("--input", "-in", type=click.Path(exists=True, dir_okay=False), required=True,
+              help="File with the links to download.")
+@click.option("--output", "-out", type=click.Path(file_okay=False), required=True,
+              help="Output directory for the results (and the audio with --keep-audio).")
+@click.option("--jobs", "-j", type=click.INT, default=-1, help="Number of feature jobs to run. Defaults to all cores",
+              show_default=True)
+@click.option("--download-jobs", type=click.INT, default=8, show_default=True, help="Number of download threads.")
+@click.option("--per-host", type=click.INT, default=4, show_default=True,
+              help="Maximum number of concurrent downloads from one host.")
+@click.option("--buffers", type=click.INT, default=16, show_default=True,
+              help="Maximum number of audio files held in memory. Downloads wait while the feature jobs catch up.")
+@click.option("--config", "-c", type=click.Path(exists=True), default='datavis/config.yaml',
+              help="File with configuration parameters for the algorithm.")
+@click.option("--store", type=click.Path(file_okay=False), default=None,
+              help="Write features into a columnar (Parquet) store in this directory instead of CSV files.")
+@click.option('--keep-audio', default=False, is_flag=True, help='Also save the downloaded audio.')
+@click.option('--fresh', default=False, is_flag=True, help='Process files that already have results.')
+@click.option("--fft", type=click.Choice(list(FFT_BACKENDS)), default=DEFAULT_FFT_BACKEND, show_default=True,
+              callback=check_fft_backend,
+              help="FFT backend of spectrograms and envelopes. fftw needs pyFFTW and reuses its plans between files.")
+@click.option("--fft-threads", type=click.INT, default=None,
+              help="Threads of every FFT. Defaults to the cores divided by the number of jobs, so that jobs and "
+                   "threads do not oversubscribe the cores.")
+def download_to_features(input, output, jobs, download_jobs, per_host, buffers, config, store, keep_audio, fresh, fft,
+                         fft_threads):
     start_time = time.time()
-    wav_dir_to_features(directory=input, config=config, n_jobs=jobs, resume=resume)
+    with open(config, 'r') as f:
+        config = yaml.load(f, Loader=yaml.FullLoader)
+    links = read_links(input)
+    with ExitStack() as stack:
+        feature_store = stack.enter_context(FeatureStore(store)) if store is not None else None
+        remaining = links if fresh else remove_processed(links, output, feature_store)
+        logging.info('%d / %d files to process', len(remaining), len(links))
+        failed = links_to_features(remaining, output, config, n_jobs=jobs, download_jobs=download_jobs,
+                                   per_host=per_host, buffers=buffers, store=feature_store, keep_audio=keep_audio,
+                                   fft=fft, threads=fft_threads)
+    if failed:
+        logging.info('%d files failed, see failed.log', failed)
     logging.info(f'Total time: {time.time() - start_time:.2f}s')
 
 
+@cli.command('ingest', help='Ingest the per-file result CSVs of a directory into a feature store. Run again to sync: '
+                             'only CSVs new or changed since the last ingest are read.')
+@click.option("--input", "-in", type=click.Path(exists=True, file_okay=False), required=True,
+              help="Path to the directory with csv features.")
+@click.option("--store", type=click.Path(file_okay=False), required=True, help="Path to the feature store.")
+@click.option("--chunk-files", type=click.INT, default=50000, show_default=True,
+              help="Number of CSVs read and written at a time.")
+@click.option("--threads", type=click.INT, default=16, show_default=True, help="Number of threads reading CSVs.")
+def ingest(input, store, chunk_files, threads):
+    start_time = time.time()
+    ingested = ingest_results(input, store, chunk_files=chunk_files, threads=threads)
+    logging.info(f'Ingested {ingested} CSVs in {time.time() - start_time:.2f}s')
+
+
+@cli.command('merge', help='Merge the outputs of "a2f --shard" into one store and report the files no shard processed '
+                           '(failed or in a shard that did not run) or several shards processed.')
+@click.option("--input", "-in", type=click.Path(exists=True, file_okay=False), required=True,
+              help="Input directory of the shards.")
+@click.option("--store", type=click.Path(file_okay=False), default=None,
+              help="Store directory the shards wrote into. Without it the result CSVs next to the audio are merged.")
+@click.option("--output", "-out", type=click.Path(file_okay=False), default=None,
+              help="Merged store. Defaults to the store directory of the shards.")
+@click.option("--report", type=click.Path(dir_okay=False), default=None,
+              help="Write the missing and duplicated files into this CSV file.")
+def merge(input, store, output, report):
+    output = output or store
+    if output is None:
+        raise click.UsageError('--output is required when the shards wrote CSV files')
+    start_time = time.time()
+    result = merge_shards(input, output, store=store)
+    logging.info(f'Merged {result["merged"]} files of {len(result["shards"])} shards into {output} in '
+                 f'{time.time() - start_time:.2f}s')
+    for problem in ('missing', 'duplicated'):
+        paths = result[problem]
+        if paths:
+            logging.warning(f'{len(paths)} / {result["files"]} files {problem}, e.g. {", ".join(paths[:5])}')
+    if report:
+        with open(report, 'w', newline='') as fo:
+            writer = csv.writer(fo)
+            writer.writerow(['file', 'problem'])
+            for problem in ('missing', 'duplicated'):
+                writer.writerows((path, problem) for path in result[problem])
+
+
+@cli.command('pyramid', help='Build or update the feature pyramid: mean, min, max and count of every feature '
+                              'pre-aggregated at several time resolutions, which f2i reads instead of the results. '
+                              'Only bins of new, changed or removed result files are recomputed.')
+@click.option("--input", "-in", type=click.Path(exists=True), required=True,
+              help="Path to the directory with csv features or to a feature store.")
+@click.option("--levels", type=click.STRING, default=None,
+              help=f"Comma separated bin sizes in minutes, each dividing a day. Defaults to the levels of an existing "
+                   f"pyramid or {','.join(map(str, DEFAULT_LEVELS))}. Changing the levels rebuilds the pyramid.")
+def build_pyramid(input, levels):
+    start_time = time.time()
+    levels = [int(level) for level in levels.split(',')] if levels else None
+    updated = update_pyramid(input, levels)
+    logging.info(f'Aggregated {updated} files in {time.time() - start_time:.2f}s')
+
+
 @cli.command('f2i', help='Features to Image')
-@click.option("--input", "-in", type=click.Path(exists=True), required=True, help="Path to the directory with csv features.")
+@click.option("--input", "-in", type=click.Path(exists=True), required=True, help="Path to the directory with csv features or to a feature store.")
 @click.option("--output", "-out", type=click.STRING, required=True, help="Output file.")
 @click.option("--format", "-f", type=click.Choice(SUPPORTED_FORMATS), default="html", show_default=True)
 @click.option("--aggregation", "-agg", type=click.INT, help="Aggregation (in minutes) to apply on the data",
               default=10, show_default=True)
 @click.option('--corr', type=click.STRING, help="Output path for plotting correlation matrix. ")
-def features_to_image(input, output, format, aggregation, corr):
-    df = read_results(directory=input)
-    df = df.resample(f'{aggregation}T').mean()
-    df = (df - df.min()) / (df.max() - df.min())
-    save_heatmap_with_datetime(df, output_path=output, dformat=format)
+@click.option("--width", type=click.INT, default=2000, show_default=True,
+              help="Maximum number of time columns of the heatmap. Longer data is decimated into min/mean/max "
+                   "envelopes, which bounds the size and render time of the output. 0 plots every aggregated row.")
+@click.option("--envelope", type=click.Choice(ENVELOPES), default='max', show_default=True,
+              help="Envelope of decimated data shown as colour, all envelopes are shown on hover.")
+@click.option('--webgl', default=False, is_flag=True, help='Render the heatmap with WebGL.')
+@click.option("--chunk-files", type=click.INT, default=20000, show_default=True,
+              help="Number of result files read at a time. Results are resampled chunk by chunk, which bounds the "
+                   "memory used for the raw rows.")
+def features_to_image(input, output, format, aggregation, corr, width, envelope, webgl, chunk_files):
+    level = nearest_level(pyramid_levels(input), aggregation) if has_pyramid(input) else None
+    if level is not None:
+        try:
+            update_pyramid(input)
+        except PyramidException as ex:
+            logging.warning(f'Not reading the feature pyramid: {ex}')
+            level = None
+    if level is not None:
+        logging.info(f'Reading the {level} minute level of the feature pyramid')
+        df = mean_resample(read_level(input, level), aggregation)
+        stats = OnlineStats()
+        stats.add(df)
+    else:
+        df, stats = resample_chunks(iter_results(input, chunk_files), aggregation)
+    low, high = stats.min[df.columns], stats.max[df.columns]
+    df = (df - low) / (high - low)
+    save_heatmap_with_datetime(df, output_path=output, dformat=format, width=width, envelope=envelope, webgl=webgl)
     if corr:
-        save_corr_matrix(df, output_path=corr)
+        save_corr_matrix(df, output_path=corr, corr=stats.corr())
 
 
 if __name__ == '__main__':